@@ -1,36 +1,227 @@
+import heapq
+import threading
+import time
+import weakref
+from array import array
+from collections import deque
+from contextlib import AbstractContextManager, ExitStack, nullcontext
 from enum import Enum
-from typing import List, Self
+from itertools import compress, count
+from operator import not_
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Self,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+
+class DeviceEventTypes(Enum):
+    SWITCHED = "switched"
+    RATE_CHANGED = "rate_changed"
+    MODE_CHANGED = "mode_changed"
+    ADDED = "added"
+    REMOVED = "removed"
+
+
+class DeviceEvent:
+    __slots__ = ("device", "event_type")
+
+    def __init__(
+        self: Self, event_type: DeviceEventTypes, device: "SmartDevice"
+    ) -> None:
+        self.event_type: DeviceEventTypes = event_type
+        self.device: SmartDevice = device
+
+    def get_event_type(self: Self) -> DeviceEventTypes:
+        return self.event_type
+
+    def get_device(self: Self) -> "SmartDevice":
+        return self.device
+
+
+DEVICE_LISTENER_TYPE = Callable[[DeviceEvent], None]
+# The switched on state and the consumption rate or cooking mode of a device
+DEVICE_STATE_TYPE = tuple[bool, int | str | None]
 
 
 class SmartDevice:
+    # Slots keep the per device memory small as homes can have a very
+    # large number of devices
+    __slots__ = (
+        "device_id",
+        "home",
+        "listeners",
+        "slot",
+        "store",
+        "switched_on",
+    )
+
+    # Every device gets a stable id when it is created, which is used by
+    # SmartHome to look up and remove devices without searching for them
+    device_ids = count()
+
     def __init__(self: Self) -> None:
+        self.device_id: int = next(SmartDevice.device_ids)
         self.switched_on: bool = False
+        # When the device is added to a SmartHome using the columnar store,
+        # its state lives in the store arrays at index slot and the
+        # attributes above are only used while the device is detached
+        self.store: "ColumnarDeviceStore | None" = None
+        self.slot: int = -1
+        # The home the device is in, which is told about every change so
+        # that it can keep its stats up to date
+        self.home: "SmartHome | None" = None
+        # Only created when something subscribes to this device, as most
+        # devices are only listened to through their home
+        self.listeners: List[DEVICE_LISTENER_TYPE] | None = None
+
+    def get_id(self: Self) -> int:
+        return self.device_id
+
+    # Event methods
+    def subscribe(self: Self, listener: DEVICE_LISTENER_TYPE) -> None:
+        if self.listeners is None:
+            self.listeners = []
+        self.listeners.append(listener)
+
+    def unsubscribe(self: Self, listener: DEVICE_LISTENER_TYPE) -> None:
+        if self.listeners is not None and listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self: Self, event_type: DeviceEventTypes) -> None:
+        if self.listeners:
+            event = DeviceEvent(event_type, self)
+            for listener in self.listeners:
+                listener(event)
 
     def get_switched_on(self: Self) -> bool:
-        return self.switched_on
+        # The slot is read before the store, the store is set to None
+        # before the slot is changed when the device is detached. Another
+        # device being detached can move this one to a new slot and shrink
+        # the arrays meanwhile, so the read is retried if the slot changed
+        while True:
+            slot = self.slot
+            store = self.store
+            if store is None:
+                return self.switched_on
+            try:
+                switched_on = store.get_switched_on(slot)
+            except IndexError:
+                continue
+            if self.slot == slot:
+                return switched_on
+
+    def get_state(self: Self) -> DEVICE_STATE_TYPE:
+        return (self.get_switched_on(), None)
+
+    def flip_switch(self: Self) -> None:
+        if self.store is not None:
+            self.store.toggle_switch(self.slot)
+        else:
+            self.switched_on = not self.switched_on
 
     def toggle_switch(self: Self) -> None:
-        self.switched_on = not self.switched_on
+        while True:
+            home = self.home
+            if home is None:
+                # A home can't add the device while the device lock is held
+                with DEVICE_LOCKS[self.device_id % DEVICE_LOCK_STRIPES]:
+                    if self.home is not None:
+                        continue
+                    self.flip_switch()
+                break
+            with home.get_power_lock(self):
+                home.check_switch_power(self)
+                with home.get_device_lock(self):
+                    # Removed from the home while waiting for the lock
+                    if self.home is not home:
+                        continue
+                    home.save_state(self)
+                    self.flip_switch()
+                    home.update_switched_on(self)
+            # Listeners are told once the locks are released, about the
+            # devices shed for the power budget first
+            home.notify_pending()
+            home.notify(DeviceEventTypes.SWITCHED, self)
+            break
+        self.notify(DeviceEventTypes.SWITCHED)
 
 
 class SmartPlug(SmartDevice):
+    __slots__ = ("consumption_rate",)
+
+    # Shared by every smart plug instead of being stored on each one
+    error_message: str = "invalid consumption rate (>= 0 and <= 150)."
+
     def __init__(self: Self, consumption_rate: int) -> None:
         super().__init__()
-        self.error_message: str = "invalid consumption rate (>= 0 and <= 150)."
         self.consumption_rate: int = 150
         self.set_consumption_rate(consumption_rate)
 
     def __str__(self: Self) -> str:
-        output = f"Smart Plug: {'On' if self.switched_on is True else 'Off'}, "
-        output += f"Consumption rate: {self.consumption_rate}"
+        output = "Smart Plug: "
+        output += f"{'On' if self.get_switched_on() is True else 'Off'}, "
+        output += f"Consumption rate: {self.get_consumption_rate()}"
         return output
 
     def get_consumption_rate(self: Self) -> int:
-        return self.consumption_rate
+        # Read the same way as get_switched_on
+        while True:
+            slot = self.slot
+            store = self.store
+            if store is None:
+                return self.consumption_rate
+            try:
+                consumption_rate = store.get_consumption_rate(slot)
+            except IndexError:
+                continue
+            if self.slot == slot:
+                return consumption_rate
+
+    def get_state(self: Self) -> DEVICE_STATE_TYPE:
+        return (self.get_switched_on(), self.get_consumption_rate())
+
+    def write_consumption_rate(self: Self, rate: int) -> None:
+        if self.store is not None:
+            self.store.set_consumption_rate(self.slot, rate)
+        else:
+            self.consumption_rate = rate
 
     def set_consumption_rate(self: Self, rate: int) -> None:
         if rate >= 0 and rate <= 150:
-            self.consumption_rate = rate
+            while True:
+                home = self.home
+                if home is None:
+                    with DEVICE_LOCKS[self.device_id % DEVICE_LOCK_STRIPES]:
+                        if self.home is not None:
+                            continue
+                        self.write_consumption_rate(rate)
+                    break
+                with home.get_power_lock(self):
+                    if self.get_switched_on():
+                        home.check_power(
+                            self, rate - self.get_consumption_rate()
+                        )
+                    with home.get_device_lock(self):
+                        if self.home is not home:
+                            continue
+                        # Read again as it can have changed without a budget
+                        old_rate = self.get_consumption_rate()
+                        home.save_state(self)
+                        self.write_consumption_rate(rate)
+                        home.update_consumption_rate(self, old_rate)
+                home.notify_pending()
+                home.notify(DeviceEventTypes.RATE_CHANGED, self)
+                break
+            self.notify(DeviceEventTypes.RATE_CHANGED)
         else:
             raise ValueError(self.error_message)
 
@@ -45,36 +236,85 @@ def test_smart_plug() -> None:
     print(smart_plug)
 
 
-test_smart_plug()
-
-
 class CookingModes(Enum):
     HEALTHY = "Healthy"
     DEFROST = "Defrost"
     CRISPY = "Crispy"
 
 
+# Cooking modes are stored as a code, which is their index in this tuple
+COOKING_MODE_VALUES: tuple[str, ...] = tuple(
+    cooking_mode.value for cooking_mode in CookingModes
+)
+COOKING_MODE_CODES: Dict[str, int] = {
+    cooking_mode: code for code, cooking_mode in enumerate(COOKING_MODE_VALUES)
+}
+
+
 class SmartAirFryer(SmartDevice):
+    __slots__ = ("cooking_mode_code",)
+
     def __init__(self: Self) -> None:
         super().__init__()
-        self.cooking_mode: str = CookingModes.HEALTHY.value
+        self.cooking_mode_code: int = COOKING_MODE_CODES[
+            CookingModes.HEALTHY.value
+        ]
 
     def __str__(self: Self) -> str:
-        output = (
-            f"Smart Air Fryer: {'On' if self.switched_on is True else 'Off'}, "
-        )
-        output += f"Cooking mode: {self.cooking_mode}"
+        output = "Smart Air Fryer: "
+        output += f"{'On' if self.get_switched_on() is True else 'Off'}, "
+        output += f"Cooking mode: {self.get_cooking_mode()}"
         return output
 
     def get_cooking_mode(self: Self) -> str:
-        return self.cooking_mode
+        return COOKING_MODE_VALUES[self.get_cooking_mode_code()]
+
+    def get_cooking_mode_code(self: Self) -> int:
+        # Read the same way as get_switched_on
+        while True:
+            slot = self.slot
+            store = self.store
+            if store is None:
+                return self.cooking_mode_code
+            try:
+                cooking_mode_code = store.get_cooking_mode_code(slot)
+            except IndexError:
+                continue
+            if self.slot == slot:
+                return cooking_mode_code
+
+    def get_state(self: Self) -> DEVICE_STATE_TYPE:
+        return (self.get_switched_on(), self.get_cooking_mode())
+
+    def write_cooking_mode_code(self: Self, cooking_mode_code: int) -> None:
+        if self.store is not None:
+            self.store.set_cooking_mode_code(self.slot, cooking_mode_code)
+        else:
+            self.cooking_mode_code = cooking_mode_code
 
     def set_cooking_mode(self: Self, cooking_mode: str) -> None:
-        cooking_modes: List[str] = [
-            cooking_mode.value for cooking_mode in CookingModes
-        ]
-        if cooking_mode in cooking_modes:
-            self.cooking_mode = cooking_mode
+        cooking_mode_code = None
+        # Values that aren't strings could be unhashable
+        if isinstance(cooking_mode, str):
+            cooking_mode_code = COOKING_MODE_CODES.get(cooking_mode)
+        if cooking_mode_code is not None:
+            while True:
+                home = self.home
+                if home is None:
+                    with DEVICE_LOCKS[self.device_id % DEVICE_LOCK_STRIPES]:
+                        if self.home is not None:
+                            continue
+                        self.write_cooking_mode_code(cooking_mode_code)
+                    break
+                with home.get_device_lock(self):
+                    if self.home is not home:
+                        continue
+                    home.save_state(self)
+                    self.write_cooking_mode_code(cooking_mode_code)
+                    home.update_cooking_mode(self)
+                home.notify(DeviceEventTypes.MODE_CHANGED, self)
+                break
+            self.notify(DeviceEventTypes.MODE_CHANGED)
         else:
             raise ValueError("invalid cooking mode.")
 
@@ -89,51 +329,884 @@ def test_smart_air_fryer() -> None:
     print(smart_air_fryer)
 
 
-test_smart_air_fryer()
+class DeviceTypeCodes(Enum):
+    SMART_DEVICE = 0
+    SMART_PLUG = 1
+    SMART_AIR_FRYER = 2
 
 
-class SmartHome:
+class ColumnarDeviceStore:
+    # Keeps the state of a home's devices in typed arrays, attached devices are
+    # views onto their slot, so bulk operations and aggregates run over whole
+    # arrays
     def __init__(self: Self) -> None:
+        # Slots are kept dense by moving the last device into the slot of
+        # a detached one, so the order here is not the order of the home
         self.devices: List[SmartDevice] = []
+        self.switched_on: array = array("B")
+        self.type_codes: array = array("B")
+        self.consumption_rates: array = array("H")
+        self.cooking_modes: array = array("B")
+
+    def __len__(self: Self) -> int:
+        return len(self.devices)
+
+    def get_columns(self: Self) -> tuple[array, array, array, array]:
+        return (
+            self.switched_on,
+            self.type_codes,
+            self.consumption_rates,
+            self.cooking_modes,
+        )
+
+    def attach(self: Self, device: SmartDevice) -> None:
+        self.attach_all([device])
+
+    def attach_all(self: Self, devices: List[SmartDevice]) -> None:
+        for device in devices:
+            if device.store is not None:
+                raise ValueError("device is already in a columnar store.")
+
+        # Build each column first so that every array is extended once
+        smart_plug_code = DeviceTypeCodes.SMART_PLUG.value
+        smart_air_fryer_code = DeviceTypeCodes.SMART_AIR_FRYER.value
+        smart_device_code = DeviceTypeCodes.SMART_DEVICE.value
+        type_codes: List[int] = []
+        consumption_rates: List[int] = []
+        cooking_modes: List[int] = []
+        for device in devices:
+            if isinstance(device, SmartPlug):
+                type_codes.append(smart_plug_code)
+                consumption_rates.append(device.consumption_rate)
+                cooking_modes.append(0)
+            elif isinstance(device, SmartAirFryer):
+                type_codes.append(smart_air_fryer_code)
+                consumption_rates.append(0)
+                cooking_modes.append(device.cooking_mode_code)
+            else:
+                type_codes.append(smart_device_code)
+                consumption_rates.append(0)
+                cooking_modes.append(0)
+
+        first_slot = len(self.devices)
+        self.devices.extend(devices)
+        self.switched_on.extend([device.switched_on for device in devices])
+        self.type_codes.extend(type_codes)
+        self.consumption_rates.extend(consumption_rates)
+        self.cooking_modes.extend(cooking_modes)
+        # Only once the arrays have the slots, as devices can be read by
+        # other threads without a lock
+        for slot, device in enumerate(devices, first_slot):
+            device.slot = slot
+            device.store = self
+
+    def write_back(self: Self, device: SmartDevice) -> None:
+        # Copy the state in the arrays back onto the device so that it
+        # still has its values once it is detached
+        slot = device.slot
+        device.switched_on = self.switched_on[slot] == 1
+        if isinstance(device, SmartPlug):
+            device.consumption_rate = self.consumption_rates[slot]
+        elif isinstance(device, SmartAirFryer):
+            device.cooking_mode_code = self.cooking_modes[slot]
+        device.store = None
+        device.slot = -1
+
+    def detach(self: Self, device: SmartDevice) -> None:
+        if device.store is not self:
+            raise ValueError("device is not in this columnar store.")
+
+        slot = device.slot
+        self.write_back(device)
+
+        last_slot = len(self.devices) - 1
+        if slot != last_slot:
+            last_device = self.devices[last_slot]
+            # The state is copied before the slot is moved, so the last
+            # device can be read while this happens
+            for column in self.get_columns():
+                column[slot] = column[last_slot]
+            last_device.slot = slot
+            self.devices[slot] = last_device
+
+        self.devices.pop()
+        for column in self.get_columns():
+            column.pop()
+
+    def detach_all(self: Self) -> None:
+        for device in self.devices:
+            self.write_back(device)
+        self.devices = []
+        self.switched_on = array("B")
+        self.type_codes = array("B")
+        self.consumption_rates = array("H")
+        self.cooking_modes = array("B")
+
+    def get_switched_on(self: Self, slot: int) -> bool:
+        return self.switched_on[slot] == 1
+
+    def toggle_switch(self: Self, slot: int) -> None:
+        self.switched_on[slot] ^= 1
+
+    def get_consumption_rate(self: Self, slot: int) -> int:
+        return self.consumption_rates[slot]
+
+    def set_consumption_rate(self: Self, slot: int, rate: int) -> None:
+        self.consumption_rates[slot] = rate
+
+    def get_cooking_mode_code(self: Self, slot: int) -> int:
+        return self.cooking_modes[slot]
+
+    def set_cooking_mode_code(self: Self, slot: int, code: int) -> None:
+        self.cooking_modes[slot] = code
+
+    def get_devices_to_switch(
+        self: Self, switched_on: bool
+    ) -> List[SmartDevice]:
+        # The devices that set_switched_on_all(switched_on) would change
+        if switched_on:
+            return list(compress(self.devices, map(not_, self.switched_on)))
+        return list(compress(self.devices, self.switched_on))
+
+    def set_switched_on_all(self: Self, switched_on: bool) -> None:
+        self.switched_on = array("B", [switched_on]) * len(self.devices)
+
+    def get_switched_on_count(self: Self) -> int:
+        return sum(self.switched_on)
+
+    def get_total_consumption(self: Self) -> int:
+        # Only smart plugs have a non-zero consumption rate in the arrays
+        return sum(compress(self.consumption_rates, self.switched_on))
+
+
+class BatchError(ValueError):
+    # errors maps the position (for add_devices) or device id of each invalid
+    # entry to its error message, none of the batch is applied
+    def __init__(self: Self, errors: Dict[int, str]) -> None:
+        self.errors: Dict[int, str] = errors
+        message = f"invalid batch ({len(errors)} invalid entries):"
+        for key, error in errors.items():
+            message += f"\n  - {key}: {error}"
+        super().__init__(message)
+
+    def get_errors(self: Self) -> Dict[int, str]:
+        return self.errors
+
+
+class HomeSnapshot:
+    # A read only view of a SmartHome, taking one is O(1) and the state of a
+    # device is only saved into it just before the device is first changed
+    def __init__(self: Self, devices: Dict[int, SmartDevice]) -> None:
+        # Never changed after the snapshot is taken
+        self.devices: Dict[int, SmartDevice] = devices
+        # The states of the devices that have changed since the snapshot
+        self.saved_states: Dict[int, DEVICE_STATE_TYPE] = {}
+
+    def __len__(self: Self) -> int:
+        return len(self.devices)
+
+    def __str__(self: Self) -> str:
+        output = "Smart Home Devices:"
+        for device, switched_on, value in self.get_states():
+            output += f"\n  - {type(device).__name__}: "
+            output += f"{'On' if switched_on is True else 'Off'}"
+            if value is not None:
+                output += f", {value}"
+        return output
+
+    def save_state(self: Self, device: SmartDevice) -> None:
+        device_id = device.get_id()
+        if device_id in self.devices and device_id not in self.saved_states:
+            self.saved_states[device_id] = device.get_state()
+
+    def get_device_ids(self: Self) -> List[int]:
+        return list(self.devices)
+
+    def get_state(self: Self, device_id: int) -> DEVICE_STATE_TYPE:
+        saved_state = self.saved_states.get(device_id)
+        if saved_state is not None:
+            return saved_state
+        state = self.devices[device_id].get_state()
+        # The state is always saved before a device is changed, so if the
+        # device was changed while it was being read, it is saved now
+        saved_state = self.saved_states.get(device_id)
+        if saved_state is not None:
+            return saved_state
+        return state
+
+    def get_states(
+        self: Self,
+    ) -> Iterator[tuple[SmartDevice, bool, int | str | None]]:
+        for device_id, device in self.devices.items():
+            switched_on, value = self.get_state(device_id)
+            yield device, switched_on, value
+
+    def get_switched_on_count(self: Self) -> int:
+        return sum(switched_on for _, switched_on, _ in self.get_states())
+
+    def get_total_consumption(self: Self) -> int:
+        total_consumption = 0
+        for device, switched_on, value in self.get_states():
+            if switched_on and isinstance(device, SmartPlug):
+                total_consumption += int(value or 0)
+        return total_consumption
+
+    def diff(self: Self, other: "HomeSnapshot") -> Dict[str, List[int]]:
+        # The ids of the devices added, removed and changed in other
+        return {
+            "added": [
+                device_id
+                for device_id in other.devices
+                if device_id not in self.devices
+            ],
+            "removed": [
+                device_id
+                for device_id in self.devices
+                if device_id not in other.devices
+            ],
+            "changed": [
+                device_id
+                for device_id in self.devices
+                if device_id in other.devices
+                and self.get_state(device_id) != other.get_state(device_id)
+            ],
+        }
+
+
+class SeqLock:
+    # Readers don't take the lock, they retry if a write was in progress (the
+    # version is odd) or happened while they read, so readers never block
+    # writers
+    __slots__ = ("lock", "version")
+
+    def __init__(self: Self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.version: int = 0
+
+    def __enter__(self: Self) -> None:
+        self.lock.acquire()
+        self.version += 1
+
+    def __exit__(self: Self, *args: object) -> None:
+        self.version += 1
+        self.lock.release()
+
+    def read(self: Self, reader: Callable[[], T]) -> T:
+        while True:
+            version = self.version
+            if version % 2 == 0:
+                try:
+                    result = reader()
+                except Exception:
+                    # Anything can be raised by a read that saw a write half
+                    # done (a dict that changed size, a key that was just
+                    # removed...), it is only an error if nothing was written
+                    if self.version == version:
+                        raise
+                else:
+                    if self.version == version:
+                        return result
+            # Let the writer finish
+            time.sleep(0)
+
+
+# The number of device locks, each device uses the lock at its id modulo
+# this, so that changes to different devices rarely wait. The locks are
+# shared by every SmartHome, so that a device that is not in a home is
+# changed under the same lock that a home takes to add it
+DEVICE_LOCK_STRIPES = 64
+DEVICE_LOCKS: List[threading.RLock] = [
+    threading.RLock() for _ in range(DEVICE_LOCK_STRIPES)
+]
+
+NO_LOCK = nullcontext()
+
+
+class PowerBudgetModes(Enum):
+    # Switch lower priority smart plugs off, or lower their consumption rate
+    SHED = "shed"
+    THROTTLE = "throttle"
+
+
+DEFAULT_PRIORITY = 0
+
+# How many shed decisions are kept in the log of a SmartHome
+SHED_LOG_SIZE = 1000
+
+
+class ShedDecision:
+    __slots__ = (
+        "device_id",
+        "mode",
+        "new_rate",
+        "old_rate",
+        "time",
+        "trigger_device_id",
+    )
+
+    def __init__(
+        self: Self,
+        mode: PowerBudgetModes,
+        device_id: int,
+        old_rate: int,
+        new_rate: int,
+        trigger_device_id: int | None,
+    ) -> None:
+        self.time: float = time.time()
+        self.mode: PowerBudgetModes = mode
+        self.device_id: int = device_id
+        self.old_rate: int = old_rate
+        # 0 when the device is switched off
+        self.new_rate: int = new_rate
+        # None when the power was needed for a batch
+        self.trigger_device_id: int | None = trigger_device_id
+
+    def __str__(self: Self) -> str:
+        output = f"Device {self.device_id} "
+        if self.mode is PowerBudgetModes.SHED:
+            output += f"switched off ({self.old_rate})"
+        else:
+            output += f"throttled ({self.old_rate} -> {self.new_rate})"
+        if self.trigger_device_id is not None:
+            output += f" for device {self.trigger_device_id}"
+        return output
+
+    def get_time(self: Self) -> float:
+        return self.time
+
+    def get_mode(self: Self) -> PowerBudgetModes:
+        return self.mode
+
+    def get_device_id(self: Self) -> int:
+        return self.device_id
+
+    def get_old_rate(self: Self) -> int:
+        return self.old_rate
+
+    def get_new_rate(self: Self) -> int:
+        return self.new_rate
+
+    def get_trigger_device_id(self: Self) -> int | None:
+        return self.trigger_device_id
+
+
+def get_switched_on_consumption(devices: Iterable[SmartDevice]) -> int:
+    # What the devices consume once switched on devices are added to a home
+    return sum(
+        device.get_consumption_rate()
+        for device in devices
+        if isinstance(device, SmartPlug) and device.get_switched_on()
+    )
+
+
+class SmartHome:
+    def __init__(self: Self, columnar: bool = False) -> None:
+        # Devices are kept by id, dicts preserve insertion order so the
+        # devices are still listed in the order they were added
+        self.devices: Dict[int, SmartDevice] = {}
         self.switch_all_state: bool = False
+        # The optional columnar store holds the device state in arrays
+        # so that bulk operations and aggregates do not visit every device
+        self.store: ColumnarDeviceStore | None = (
+            ColumnarDeviceStore() if columnar else None
+        )
+        # The stats are updated on every change instead of being
+        # calculated from the devices each time they are needed
+        self.total_consumption: int = 0
+        # Sum of the consumption rate of every smart plug, switched on
+        # or not, used when all of the devices are switched on at once
+        self.total_consumption_rate: int = 0
+        # Number of devices and switched on devices by device type name
+        self.device_counts: Dict[str, int] = {}
+        self.switched_on_counts: Dict[str, int] = {}
+        # Told about every change to the home and its devices
+        self.listeners: List[DEVICE_LISTENER_TYPE] = []
+        # Named groups of devices (rooms, floors, circuits...), with the
+        # groups of each device so that a removed device can be taken out
+        # of its groups without searching every group
+        self.groups: Dict[str, Dict[int, SmartDevice]] = {}
+        self.group_switch_states: Dict[str, bool] = {}
+        self.device_groups: Dict[int, List[str]] = {}
+        # Secondary indexes used by query, so that finding the devices of
+        # a type, switched on state or cooking mode does not scan them all
+        self.type_index: Dict[type[SmartDevice], Dict[int, SmartDevice]] = {}
+        self.switched_on_index: Dict[bool, Dict[int, SmartDevice]] = {
+            True: {},
+            False: {},
+        }
+        self.cooking_mode_index: Dict[str, Dict[int, SmartDevice]] = {
+            cooking_mode: {} for cooking_mode in COOKING_MODE_VALUES
+        }
+        # The snapshots that are still in use, and whether the devices dict
+        # is shared with one of them and has to be copied before a change
+        self.snapshots: weakref.WeakSet[HomeSnapshot] = weakref.WeakSet()
+        self.devices_shared: bool = False
+        # The most the switched on smart plugs can consume, None for no
+        # budget, and the priority of each device (DEFAULT_PRIORITY if not
+        # set), lower priority devices are shed first to stay in budget
+        self.power_budget: int | None = None
+        self.power_budget_mode: PowerBudgetModes = PowerBudgetModes.SHED
+        self.device_priorities: Dict[int, int] = {}
+        # Heap of (priority, order, smart plug) of the switched on smart
+        # plugs with a consumption rate, entries are not removed when a plug
+        # is switched off, only the order in shed_orders is valid
+        self.shed_heap: List[tuple[int, int, SmartPlug]] = []
+        self.shed_orders: Dict[int, int] = {}
+        self.shed_order = count()
+        self.shed_log: deque[ShedDecision] = deque(maxlen=SHED_LOG_SIZE)
+        # Locks for use from several threads, always taken in this order:
+        # lock for adding and removing devices, groups and priorities,
+        # power_lock while a budget is set so that the power checked for a
+        # change is still free when it is made, the device locks in stripe
+        # order, stats for the stats, indexes and shed heap (readers use
+        # its version instead) and snapshots_lock. Listeners are told about
+        # changes once the locks are released, so they can change the home
+        self.lock: threading.RLock = threading.RLock()
+        self.power_lock: threading.RLock = threading.RLock()
+        self.device_locks: List[threading.RLock] = DEVICE_LOCKS
+        self.stats: SeqLock = SeqLock()
+        self.snapshots_lock: threading.Lock = threading.Lock()
+        # The changes made with the locks held whose listeners haven't been
+        # told yet, such as the devices shed for the power budget
+        self.pending_events: deque[tuple[DeviceEventTypes, SmartDevice]] = (
+            deque()
+        )
 
     def __str__(self: Self) -> str:
         output = "Smart Home Devices:"
-        for device in self.devices:
+        for device in self.get_devices():
             output += f"\n  - {device}"
         return output
 
     def get_devices(self: Self) -> List[SmartDevice]:
-        return self.devices
+        return list(self.devices.values())
 
+    def get_device(self: Self, device_id: int) -> SmartDevice | None:
+        return self.devices.get(device_id)
+
+    # The index based methods are kept for compatibility, they have to
+    # walk the devices to find the index so prefer the id based methods
     def get_device_at(self: Self, index: int) -> SmartDevice | None:
         if index < len(self.devices):
-            return self.devices[index]
+            return self.get_devices()[index]
 
     def get_switch_all_state(self: Self) -> bool:
         return self.switch_all_state
 
+    def set_switch_all_state(self: Self, switch_all_state: bool) -> None:
+        self.switch_all_state = switch_all_state
+
+    def get_store(self: Self) -> ColumnarDeviceStore | None:
+        return self.store
+
+    # Lock methods
+    def get_device_lock(self: Self, device: SmartDevice) -> threading.RLock:
+        return self.device_locks[device.device_id % DEVICE_LOCK_STRIPES]
+
+    def lock_devices(self: Self, devices: Iterable[SmartDevice]) -> ExitStack:
+        stack = ExitStack()
+        for stripe in sorted(
+            {device.device_id % DEVICE_LOCK_STRIPES for device in devices}
+        ):
+            stack.enter_context(self.device_locks[stripe])
+        return stack
+
+    def lock_all_devices(self: Self) -> ExitStack:
+        stack = ExitStack()
+        for lock in self.device_locks:
+            stack.enter_context(lock)
+        return stack
+
+    def get_power_lock(
+        self: Self, device: SmartDevice | None = None
+    ) -> AbstractContextManager[Any]:
+        # Only changes that can use more power (None for a batch) wait for
+        # each other, and only while there is a power budget
+        if self.power_budget is not None and (
+            device is None or isinstance(device, SmartPlug)
+        ):
+            return self.power_lock
+        return NO_LOCK
+
+    def remove_device(self: Self, device_id: int) -> SmartDevice | None:
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                return None
+            # Detaching from the store moves its last device
+            locked_devices = [device]
+            if self.store is not None:
+                locked_devices.append(self.store.devices[-1])
+            with self.lock_devices(locked_devices), self.stats:
+                self.unshare_devices()
+                del self.devices[device_id]
+                # The device can still be changed once it is removed
+                self.save_state(device)
+                self.update_stats(device, -1)
+                self.update_indexes(device, -1)
+                device.home = None
+                if self.store is not None:
+                    self.store.detach(device)
+            for group_name in self.device_groups.pop(device_id, []):
+                del self.groups[group_name][device_id]
+            self.device_priorities.pop(device_id, None)
+        self.notify(DeviceEventTypes.REMOVED, device)
+        return device
+
     def remove_device_at(self: Self, index: int) -> SmartDevice | None:
-        if index < len(self.devices):
-            return self.devices.remove(self.devices[index])
+        device = self.get_device_at(index)
+        if device is not None:
+            return self.remove_device(device.get_id())
 
     def add_device(self: Self, device: SmartDevice) -> None:
         if isinstance(device, SmartDevice):
-            self.devices.append(device)
+            with self.lock, self.get_power_lock(device):
+                if device.home is not None:
+                    raise ValueError("device is already in a smart home.")
+                if device.get_id() in self.devices:
+                    raise ValueError("device id is already in the smart home.")
+                if isinstance(device, SmartPlug) and device.get_switched_on():
+                    self.reserve_power(
+                        device.get_consumption_rate(), DEFAULT_PRIORITY, None
+                    )
+                with self.lock_devices([device]), self.stats:
+                    self.unshare_devices()
+                    if self.store is not None:
+                        self.store.attach(device)
+                    self.devices[device.get_id()] = device
+                    device.home = self
+                    self.update_stats(device, 1)
+                    self.update_indexes(device, 1)
+            self.notify_pending()
+            self.notify(DeviceEventTypes.ADDED, device)
         else:
             raise ValueError("invalid device.")
 
+    # Batch methods, the whole batch is validated before any of it is
+    # applied, so either every entry is applied or a BatchError is raised
+    def add_devices(self: Self, devices: Iterable[SmartDevice]) -> None:
+        devices = list(devices)
+        with self.lock, self.get_power_lock():
+            self.add_devices_locked(devices)
+        self.notify_pending()
+        if self.listeners:
+            for device in devices:
+                self.notify(DeviceEventTypes.ADDED, device)
+
+    def add_devices_locked(self: Self, devices: List[SmartDevice]) -> None:
+        self.check_new_devices(devices)
+        if self.power_budget is not None:
+            self.reserve_power(
+                get_switched_on_consumption(devices), DEFAULT_PRIORITY, None
+            )
+        with self.lock_devices(devices), self.stats:
+            self.attach_devices_locked(devices)
+
+    def check_new_devices(
+        self: Self, devices: List[SmartDevice], replace: bool = False
+    ) -> None:
+        # With replace every device of the home is removed first, so their
+        # ids can be used again
+        errors: Dict[int, str] = {}
+        device_ids: set[int] = set()
+        for index, device in enumerate(devices):
+            if not isinstance(device, SmartDevice):
+                errors[index] = "invalid device."
+            elif device.home is not None:
+                errors[index] = "device is already in a smart home."
+            elif device.get_id() in device_ids:
+                errors[index] = "device is in the batch more than once."
+            elif not replace and device.get_id() in self.devices:
+                errors[index] = "device id is already in the smart home."
+            else:
+                device_ids.add(device.get_id())
+        if len(errors) > 0:
+            raise BatchError(errors)
+
+    def attach_devices_locked(self: Self, devices: List[SmartDevice]) -> None:
+        # Called with the locks of the devices and stats held
+        self.unshare_devices()
+        # The stats are updated before the devices are attached to the
+        # store, so that their state is read from the devices directly
+        for device in devices:
+            device.home = self
+            self.update_stats(device, 1)
+            self.update_indexes(device, 1)
+        if self.store is not None:
+            self.store.attach_all(devices)
+        self.devices.update((device.get_id(), device) for device in devices)
+
+    def replace_devices(
+        self: Self, devices: Iterable[SmartDevice]
+    ) -> List[SmartDevice]:
+        # Removes every device and adds devices in one operation, so that
+        # readers see either the old or the new devices, returns the
+        # removed devices. The home is left as it was if a device is
+        # invalid or the devices go over the power budget
+        devices = list(devices)
+        with self.lock, self.get_power_lock():
+            self.check_new_devices(devices, replace=True)
+            if (
+                self.power_budget is not None
+                and get_switched_on_consumption(devices) > self.power_budget
+            ):
+                raise ValueError("power budget exceeded.")
+            with self.lock_all_devices(), self.stats:
+                removed_devices = self.detach_all_devices_locked()
+                self.attach_devices_locked(devices)
+        if self.listeners:
+            for device in removed_devices:
+                self.notify(DeviceEventTypes.REMOVED, device)
+            for device in devices:
+                self.notify(DeviceEventTypes.ADDED, device)
+        return removed_devices
+
+    def check_batch_device(
+        self: Self,
+        device_id: int,
+        device_class: type[SmartDevice],
+        errors: Dict[int, str],
+    ) -> SmartDevice | None:
+        device = self.devices.get(device_id)
+        if device is None:
+            errors[device_id] = "device is not in the smart home."
+        elif not isinstance(device, device_class):
+            errors[device_id] = f"device is not a {device_class.__name__}."
+        else:
+            return device
+
+    def set_consumption_rates(self: Self, rates: Mapping[int, int]) -> None:
+        self.set_changes(rates, {}, {})
+
+    def set_cooking_modes(
+        self: Self, cooking_modes: Mapping[int, str]
+    ) -> None:
+        self.set_changes({}, cooking_modes, {})
+
+    def set_switched_on(self: Self, switched_on: Mapping[int, bool]) -> None:
+        self.set_changes({}, {}, switched_on)
+
+    def check_changes(
+        self: Self,
+        rates: Mapping[int, int],
+        cooking_modes: Mapping[int, str],
+        switched_on: Mapping[int, bool],
+    ) -> tuple[
+        List[tuple[SmartPlug, int]],
+        List[tuple[SmartAirFryer, str]],
+        List[tuple[SmartDevice, bool]],
+    ]:
+        # Raises a BatchError if any change is invalid, nothing is changed
+        errors: Dict[int, str] = {}
+        smart_plugs: List[tuple[SmartPlug, int]] = []
+        for device_id, rate in rates.items():
+            smart_plug = self.check_batch_device(device_id, SmartPlug, errors)
+            if smart_plug is None:
+                continue
+            # bool is a subclass of int
+            if (
+                not isinstance(rate, int)
+                or isinstance(rate, bool)
+                or rate < 0
+                or rate > 150
+            ):
+                errors[device_id] = SmartPlug.error_message
+            else:
+                smart_plugs.append((smart_plug, rate))
+
+        smart_air_fryers: List[tuple[SmartAirFryer, str]] = []
+        for device_id, cooking_mode in cooking_modes.items():
+            smart_air_fryer = self.check_batch_device(
+                device_id, SmartAirFryer, errors
+            )
+            if smart_air_fryer is None:
+                continue
+            if (
+                not isinstance(cooking_mode, str)
+                or cooking_mode not in COOKING_MODE_CODES
+            ):
+                errors[device_id] = "invalid cooking mode."
+            else:
+                smart_air_fryers.append((smart_air_fryer, cooking_mode))
+
+        devices: List[tuple[SmartDevice, bool]] = []
+        for device_id, device_switched_on in switched_on.items():
+            device = self.check_batch_device(device_id, SmartDevice, errors)
+            if device is None:
+                continue
+            if not isinstance(device_switched_on, bool):
+                errors[device_id] = "invalid switched on value."
+            else:
+                devices.append((device, device_switched_on))
+        if len(errors) > 0:
+            raise BatchError(errors)
+        return smart_plugs, smart_air_fryers, devices
+
+    def set_changes(
+        self: Self,
+        rates: Mapping[int, int],
+        cooking_modes: Mapping[int, str],
+        switched_on: Mapping[int, bool],
+    ) -> None:
+        # Every change is checked, and the power for all of them reserved,
+        # before any is applied, so on an error nothing is changed
+        smart_plugs, smart_air_fryers, devices = self.check_changes(
+            rates, cooking_modes, switched_on
+        )
+
+        # Once the power is reserved the changes are written without
+        # checking the budget again, so the order they are written in
+        # doesn't matter
+        events: List[tuple[DeviceEventTypes, SmartDevice]] = []
+        with self.get_power_lock():
+            if self.power_budget is not None:
+                self.reserve_batch_power(
+                    self.get_change_consumptions(rates, switched_on)
+                )
+            for smart_plug, rate in smart_plugs:
+                if self.write_consumption_rate(smart_plug, rate):
+                    events.append((DeviceEventTypes.RATE_CHANGED, smart_plug))
+            for smart_air_fryer, cooking_mode in smart_air_fryers:
+                if self.write_cooking_mode(smart_air_fryer, cooking_mode):
+                    events.append(
+                        (DeviceEventTypes.MODE_CHANGED, smart_air_fryer)
+                    )
+            for device, device_switched_on in devices:
+                if self.write_switched_on(device, device_switched_on):
+                    events.append((DeviceEventTypes.SWITCHED, device))
+        self.notify_pending()
+        for event_type, device in events:
+            self.notify(event_type, device)
+            device.notify(event_type)
+
+    # Write methods, change a device of the home without checking the power
+    # budget, for changes whose power has already been reserved. They
+    # return whether the device was changed, the caller tells the
+    # listeners once the locks are released
+    def write_switched_on(
+        self: Self, device: SmartDevice, switched_on: bool
+    ) -> bool:
+        with self.get_device_lock(device):
+            # Removed from the home or switched by another thread meanwhile
+            if device.home is not self:
+                return False
+            if device.get_switched_on() == switched_on:
+                return False
+            self.save_state(device)
+            device.flip_switch()
+            self.update_switched_on(device)
+        return True
+
+    def write_consumption_rate(
+        self: Self, smart_plug: SmartPlug, rate: int
+    ) -> bool:
+        with self.get_device_lock(smart_plug):
+            old_rate = smart_plug.get_consumption_rate()
+            if smart_plug.home is not self or old_rate == rate:
+                return False
+            self.save_state(smart_plug)
+            smart_plug.write_consumption_rate(rate)
+            self.update_consumption_rate(smart_plug, old_rate)
+        return True
+
+    def write_cooking_mode(
+        self: Self, smart_air_fryer: SmartAirFryer, cooking_mode: str
+    ) -> bool:
+        cooking_mode_code = COOKING_MODE_CODES[cooking_mode]
+        with self.get_device_lock(smart_air_fryer):
+            if (
+                smart_air_fryer.home is not self
+                or smart_air_fryer.get_cooking_mode_code() == cooking_mode_code
+            ):
+                return False
+            self.save_state(smart_air_fryer)
+            smart_air_fryer.write_cooking_mode_code(cooking_mode_code)
+            self.update_cooking_mode(smart_air_fryer)
+        return True
+
+    def get_change_consumptions(
+        self: Self,
+        rates: Mapping[int, int],
+        switched_on: Mapping[int, bool],
+    ) -> Iterator[tuple[SmartDevice, int]]:
+        # The change in consumption of each smart plug that set_changes
+        # changes, called with the power lock held after check_changes
+        for device_id in rates.keys() | switched_on.keys():
+            device = self.devices.get(device_id)
+            if not isinstance(device, SmartPlug):
+                continue
+            rate = device.get_consumption_rate()
+            old = rate if device.get_switched_on() else 0
+            new = rates.get(device_id, rate)
+            if not switched_on.get(device_id, device.get_switched_on()):
+                new = 0
+            if new != old:
+                yield device, new - old
+
     def toggle_switch(self: Self, index: int) -> None:
-        if index < len(self.devices):
-            self.devices[index].toggle_switch()
+        device = self.get_device_at(index)
+        if device is not None:
+            device.toggle_switch()
+
+    def toggle_switch_device(self: Self, device_id: int) -> None:
+        device = self.devices.get(device_id)
+        if device is not None:
+            device.toggle_switch()
 
     def turn_on_all(self: Self) -> None:
-        for device in self.devices:
+        if self.power_budget is not None:
+            # The highest priority devices are switched on first, the
+            # devices that would go over the power budget are left off
+            for device in sorted(
+                self.query(switched_on=False),
+                key=lambda device: self.get_device_priority(device.get_id()),
+                reverse=True,
+            ):
+                if device.get_switched_on() is False:
+                    try:
+                        device.toggle_switch()
+                    except ValueError:
+                        pass
+            return
+        if self.store is not None:
+            with self.lock, self.lock_all_devices(), self.stats:
+                switched_devices = self.store.get_devices_to_switch(True)
+                self.save_states(switched_devices)
+                self.store.set_switched_on_all(True)
+                self.switched_on_counts = dict(self.device_counts)
+                self.total_consumption = self.total_consumption_rate
+                self.switched_on_index = {
+                    True: self.switched_on_index[True]
+                    | self.switched_on_index[False],
+                    False: {},
+                }
+                for device in switched_devices:
+                    if isinstance(device, SmartPlug):
+                        self.push_shed_heap(device)
+            self.notify_switched(switched_devices)
+            return
+        for device in self.get_devices():
             if device.get_switched_on() is False:
                 device.toggle_switch()
 
     def turn_off_all(self: Self) -> None:
-        for device in self.devices:
+        if self.store is not None:
+            with self.lock, self.lock_all_devices(), self.stats:
+                switched_devices = self.store.get_devices_to_switch(False)
+                self.save_states(switched_devices)
+                self.store.set_switched_on_all(False)
+                self.switched_on_counts = dict.fromkeys(self.device_counts, 0)
+                self.total_consumption = 0
+                self.switched_on_index = {
+                    True: {},
+                    False: self.switched_on_index[False]
+                    | self.switched_on_index[True],
+                }
+                self.shed_heap = []
+                self.shed_orders = {}
+            self.notify_switched(switched_devices)
+            return
+        for device in self.get_devices():
             if device.get_switched_on() is True:
                 device.toggle_switch()
 
@@ -146,7 +1219,582 @@ class SmartHome:
             self.turn_off_all()
 
     def delete_all_devices(self: Self) -> None:
-        self.devices = []
+        with self.lock, self.lock_all_devices(), self.stats:
+            devices = self.detach_all_devices_locked()
+        if self.listeners:
+            for device in devices:
+                self.notify(DeviceEventTypes.REMOVED, device)
+
+    def detach_all_devices_locked(self: Self) -> List[SmartDevice]:
+        # Called with every lock but snapshots_lock held, returns the
+        # removed devices
+        devices = self.devices
+        # The devices dict is replaced instead of changed, so it does
+        # not need to be copied, but the devices can still be changed
+        self.save_states(devices.values())
+        self.devices_shared = False
+        for device in devices.values():
+            device.home = None
+        if self.store is not None:
+            self.store.detach_all()
+        self.devices = {}
+        self.total_consumption = 0
+        self.total_consumption_rate = 0
+        self.device_counts = {}
+        self.switched_on_counts = {}
+        self.type_index = {}
+        self.switched_on_index = {True: {}, False: {}}
+        self.cooking_mode_index = {
+            cooking_mode: {} for cooking_mode in COOKING_MODE_VALUES
+        }
+        # The groups are kept, only their devices are removed
+        self.groups = {group_name: {} for group_name in self.groups}
+        self.device_groups = {}
+        self.device_priorities = {}
+        self.shed_heap = []
+        self.shed_orders = {}
+        return list(devices.values())
+
+    # Snapshot methods
+    def snapshot(self: Self) -> HomeSnapshot:
+        with self.lock, self.snapshots_lock:
+            snapshot = HomeSnapshot(self.devices)
+            self.devices_shared = True
+            self.snapshots.add(snapshot)
+        return snapshot
+
+    def unshare_devices(self: Self) -> None:
+        # Called before the devices dict is changed. The first add or
+        # remove after a snapshot copies the whole dict, which is O(n),
+        # later ones don't copy until the next snapshot. Sharing the dict
+        # in chunks would make that copy smaller, but every lookup and
+        # listing of the devices would have to go through the chunks, and
+        # adds and removes are rare next to device changes, which only
+        # save the state of the one device
+        if self.devices_shared:
+            self.devices = dict(self.devices)
+            self.devices_shared = False
+
+    def save_state(self: Self, device: SmartDevice) -> None:
+        # Called before a device is changed
+        if len(self.snapshots) > 0:
+            with self.snapshots_lock:
+                for snapshot in self.snapshots:
+                    snapshot.save_state(device)
+
+    def save_states(self: Self, devices: Iterable[SmartDevice]) -> None:
+        if len(self.snapshots) > 0:
+            with self.snapshots_lock:
+                for snapshot in self.snapshots:
+                    for device in devices:
+                        snapshot.save_state(device)
+
+    # Power budget methods
+    def get_power_budget(self: Self) -> int | None:
+        return self.power_budget
+
+    def get_power_budget_mode(self: Self) -> PowerBudgetModes:
+        return self.power_budget_mode
+
+    def get_shed_log(self: Self) -> List[ShedDecision]:
+        return list(self.shed_log)
+
+    def get_device_priority(self: Self, device_id: int) -> int:
+        return self.device_priorities.get(device_id, DEFAULT_PRIORITY)
+
+    def set_device_priority(self: Self, device_id: int, priority: int) -> None:
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                raise ValueError("device is not in the smart home.")
+            with self.get_device_lock(device), self.stats:
+                self.device_priorities[device_id] = priority
+                if isinstance(device, SmartPlug) and device.get_switched_on():
+                    # The old entry is left in the heap and is no longer
+                    # valid
+                    self.push_shed_heap(device)
+
+    def set_power_budget(
+        self: Self,
+        power_budget: int | None,
+        mode: PowerBudgetModes = PowerBudgetModes.SHED,
+    ) -> None:
+        if power_budget is not None and power_budget < 0:
+            raise ValueError("invalid power budget (>= 0).")
+        with self.power_lock:
+            self.power_budget = power_budget
+            self.power_budget_mode = mode
+            if power_budget is not None:
+                # Any device can be shed to get back within the new budget
+                self.reserve_power(0, None, None)
+        self.notify_pending()
+
+    def push_shed_heap(self: Self, smart_plug: SmartPlug) -> None:
+        device_id = smart_plug.get_id()
+        if smart_plug.get_consumption_rate() == 0:
+            # Nothing to shed
+            self.shed_orders.pop(device_id, None)
+            return
+        order = next(self.shed_order)
+        self.shed_orders[device_id] = order
+        heapq.heappush(
+            self.shed_heap,
+            (self.get_device_priority(device_id), order, smart_plug),
+        )
+        # Rebuild the heap once most of it is entries that are not valid
+        if len(self.shed_heap) > 2 * len(self.shed_orders) + 64:
+            self.shed_heap = [
+                entry
+                for entry in self.shed_heap
+                if self.shed_orders.get(entry[2].get_id()) == entry[1]
+            ]
+            heapq.heapify(self.shed_heap)
+
+    def check_switch_power(self: Self, device: SmartDevice) -> None:
+        # Called before a device is switched
+        if (
+            self.power_budget is not None
+            and isinstance(device, SmartPlug)
+            and not device.get_switched_on()
+        ):
+            self.check_power(device, device.get_consumption_rate())
+
+    def check_power(self: Self, device: SmartDevice, increase: int) -> None:
+        # Called before the consumption of a device is increased
+        if self.power_budget is not None and increase > 0:
+            device_id = device.get_id()
+            self.reserve_power(
+                increase, self.get_device_priority(device_id), device_id
+            )
+
+    def reserve_batch_power(
+        self: Self, changes: Iterable[tuple[SmartDevice, int]]
+    ) -> None:
+        # Only devices with a lower priority than every device that needs
+        # more power are shed
+        increase = 0
+        priority: int | None = None
+        for device, change in changes:
+            increase += change
+            if change > 0:
+                device_priority = self.get_device_priority(device.get_id())
+                if priority is None or device_priority < priority:
+                    priority = device_priority
+        if increase > 0 and priority is not None:
+            self.reserve_power(increase, priority, None)
+
+    def reserve_power(
+        self: Self,
+        increase: int,
+        priority: int | None,
+        trigger_device_id: int | None,
+    ) -> None:
+        # Sheds switched on smart plugs with a lower priority than priority
+        # (any priority if None) until increase fits in the power budget,
+        # nothing is shed if it can't be made to fit
+        # Called with the power lock held
+        if self.power_budget is None:
+            return
+        excess = self.total_consumption + increase - self.power_budget
+        if excess <= 0:
+            return
+
+        throttle = self.power_budget_mode is PowerBudgetModes.THROTTLE
+        popped: List[tuple[int, int, SmartPlug]] = []
+        sheds: List[tuple[SmartPlug, int]] = []
+        with self.stats:
+            shed_heap = self.shed_heap
+            shed_orders = self.shed_orders
+            while excess > 0 and len(shed_heap) > 0:
+                entry = shed_heap[0]
+                entry_priority, order, smart_plug = entry
+                if shed_orders.get(smart_plug.get_id()) != order:
+                    heapq.heappop(shed_heap)
+                    continue
+                if priority is not None and entry_priority >= priority:
+                    break
+                popped.append(heapq.heappop(shed_heap))
+                rate = smart_plug.get_consumption_rate()
+                amount = min(rate, excess) if throttle else rate
+                sheds.append((smart_plug, amount))
+                excess -= amount
+            # The entries are still valid, shedding replaces or removes
+            # them
+            for entry in popped:
+                heapq.heappush(shed_heap, entry)
+        if excess > 0:
+            raise ValueError(
+                "power budget exceeded "
+                "(not enough lower priority devices to shed)."
+            )
+
+        # The sheds are written without checking the budget, as they only
+        # lower the consumption, and their listeners are told once the
+        # caller has released the locks, with notify_pending
+        for smart_plug, amount in sheds:
+            old_rate = smart_plug.get_consumption_rate()
+            if throttle:
+                new_rate = old_rate - amount
+                if self.write_consumption_rate(smart_plug, new_rate):
+                    self.pending_events.append(
+                        (DeviceEventTypes.RATE_CHANGED, smart_plug)
+                    )
+            else:
+                new_rate = 0
+                if self.write_switched_on(smart_plug, False):
+                    self.pending_events.append(
+                        (DeviceEventTypes.SWITCHED, smart_plug)
+                    )
+            self.shed_log.append(
+                ShedDecision(
+                    self.power_budget_mode,
+                    smart_plug.get_id(),
+                    old_rate,
+                    new_rate,
+                    trigger_device_id,
+                )
+            )
+
+    # Group methods
+    def get_groups(self: Self) -> List[str]:
+        return list(self.groups)
+
+    def get_group(self: Self, group_name: str) -> Dict[int, SmartDevice]:
+        group = self.groups.get(group_name)
+        if group is None:
+            raise ValueError("invalid group.")
+        return group
+
+    def get_group_devices(self: Self, group_name: str) -> List[SmartDevice]:
+        return list(self.get_group(group_name).values())
+
+    def get_device_groups(self: Self, device_id: int) -> List[str]:
+        return list(self.device_groups.get(device_id, []))
+
+    def add_group(self: Self, group_name: str) -> None:
+        group_name = group_name.strip()
+        if group_name == "":
+            raise ValueError("invalid group name.")
+        with self.lock:
+            if group_name in self.groups:
+                raise ValueError("group already exists.")
+            self.groups[group_name] = {}
+            self.group_switch_states[group_name] = False
+
+    def remove_group(self: Self, group_name: str) -> None:
+        with self.lock:
+            for device_id in self.get_group(group_name):
+                self.device_groups[device_id].remove(group_name)
+                if len(self.device_groups[device_id]) == 0:
+                    del self.device_groups[device_id]
+            del self.groups[group_name]
+            del self.group_switch_states[group_name]
+
+    def add_device_to_group(
+        self: Self, group_name: str, device_id: int
+    ) -> None:
+        with self.lock:
+            group = self.get_group(group_name)
+            device = self.devices.get(device_id)
+            if device is None:
+                raise ValueError("device is not in the smart home.")
+            if device_id not in group:
+                group[device_id] = device
+                self.device_groups.setdefault(device_id, []).append(group_name)
+
+    def remove_device_from_group(
+        self: Self, group_name: str, device_id: int
+    ) -> None:
+        with self.lock:
+            group = self.get_group(group_name)
+            if device_id in group:
+                del group[device_id]
+                self.device_groups[device_id].remove(group_name)
+                if len(self.device_groups[device_id]) == 0:
+                    del self.device_groups[device_id]
+
+    def turn_on_group(self: Self, group_name: str) -> None:
+        for device in self.get_group_devices(group_name):
+            if device.get_switched_on() is False:
+                device.toggle_switch()
+
+    def turn_off_group(self: Self, group_name: str) -> None:
+        for device in self.get_group_devices(group_name):
+            if device.get_switched_on() is True:
+                device.toggle_switch()
+
+    def get_group_switch_state(self: Self, group_name: str) -> bool:
+        self.get_group(group_name)
+        return self.group_switch_states[group_name]
+
+    def toggle_group(self: Self, group_name: str) -> None:
+        # The same as toggle_switch_all, but only for the devices in the group
+        if self.get_group_switch_state(group_name) is False:
+            self.group_switch_states[group_name] = True
+            self.turn_on_group(group_name)
+        else:
+            self.group_switch_states[group_name] = False
+            self.turn_off_group(group_name)
+
+    def get_group_consumption(self: Self, group_name: str) -> int:
+        total_consumption = 0
+        for device in self.get_group_devices(group_name):
+            if isinstance(device, SmartPlug) and device.get_switched_on():
+                total_consumption += device.get_consumption_rate()
+        return total_consumption
+
+    # Event methods
+    def subscribe(self: Self, listener: DEVICE_LISTENER_TYPE) -> None:
+        self.listeners.append(listener)
+
+    def unsubscribe(self: Self, listener: DEVICE_LISTENER_TYPE) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(
+        self: Self, event_type: DeviceEventTypes, device: SmartDevice
+    ) -> None:
+        if self.listeners:
+            event = DeviceEvent(event_type, device)
+            for listener in self.listeners:
+                listener(event)
+
+    def notify_pending(self: Self) -> None:
+        # Called once the locks are released, any thread can tell the
+        # listeners about the events queued by another
+        pending_events = self.pending_events
+        while pending_events:
+            try:
+                event_type, device = pending_events.popleft()
+            except IndexError:
+                # Taken by another thread meanwhile
+                break
+            self.notify(event_type, device)
+            device.notify(event_type)
+
+    def notify_switched(self: Self, devices: List[SmartDevice]) -> None:
+        # Used when devices are switched by the columnar store, without
+        # going through their toggle_switch method
+        for device in devices:
+            self.notify(DeviceEventTypes.SWITCHED, device)
+            device.notify(DeviceEventTypes.SWITCHED)
+
+    # Stats methods, the update methods are called by the devices with their
+    # device lock held, update_stats and update_indexes with stats held
+    def update_stats(self: Self, device: SmartDevice, change: int) -> None:
+        # change is 1 when the device is added and -1 when it is removed
+        device_type = type(device).__name__
+        self.device_counts[device_type] = (
+            self.device_counts.get(device_type, 0) + change
+        )
+        self.switched_on_counts.setdefault(device_type, 0)
+
+        switched_on = device.get_switched_on()
+        if switched_on:
+            self.switched_on_counts[device_type] += change
+        if isinstance(device, SmartPlug):
+            consumption_rate = device.get_consumption_rate()
+            self.total_consumption_rate += change * consumption_rate
+            if switched_on:
+                self.total_consumption += change * consumption_rate
+                if change == 1:
+                    self.push_shed_heap(device)
+                else:
+                    self.shed_orders.pop(device.get_id(), None)
+
+        if self.device_counts[device_type] == 0:
+            del self.device_counts[device_type]
+            del self.switched_on_counts[device_type]
+
+    def update_switched_on(self: Self, device: SmartDevice) -> None:
+        switched_on = device.get_switched_on()
+        device_id = device.get_id()
+        with self.stats:
+            del self.switched_on_index[not switched_on][device_id]
+            self.switched_on_index[switched_on][device_id] = device
+
+            change = 1 if switched_on else -1
+            self.switched_on_counts[type(device).__name__] += change
+            if isinstance(device, SmartPlug):
+                self.total_consumption += (
+                    change * device.get_consumption_rate()
+                )
+                if switched_on:
+                    self.push_shed_heap(device)
+                else:
+                    self.shed_orders.pop(device_id, None)
+
+    def update_consumption_rate(
+        self: Self, smart_plug: SmartPlug, old_rate: int
+    ) -> None:
+        rate = smart_plug.get_consumption_rate()
+        change = rate - old_rate
+        with self.stats:
+            self.total_consumption_rate += change
+            if smart_plug.get_switched_on():
+                self.total_consumption += change
+                if (rate == 0) != (old_rate == 0):
+                    self.push_shed_heap(smart_plug)
+
+    def update_cooking_mode(
+        self: Self, smart_air_fryer: SmartAirFryer
+    ) -> None:
+        device_id = smart_air_fryer.get_id()
+        with self.stats:
+            for devices in self.cooking_mode_index.values():
+                devices.pop(device_id, None)
+            self.cooking_mode_index[smart_air_fryer.get_cooking_mode()][
+                device_id
+            ] = smart_air_fryer
+
+    # Index methods
+    def update_indexes(self: Self, device: SmartDevice, change: int) -> None:
+        # change is 1 when the device is added and -1 when it is removed
+        device_id = device.get_id()
+        indexes = [
+            self.type_index.setdefault(type(device), {}),
+            self.switched_on_index[device.get_switched_on()],
+        ]
+        if isinstance(device, SmartAirFryer):
+            indexes.append(self.cooking_mode_index[device.get_cooking_mode()])
+
+        for index in indexes:
+            if change > 0:
+                index[device_id] = device
+            else:
+                del index[device_id]
+
+    def check_indexes(self: Self) -> bool:
+        # Checks the indexes against the devices, used in tests
+        for device_id, device in self.devices.items():
+            if device_id not in self.type_index.get(type(device), {}):
+                return False
+            if (
+                device_id
+                not in self.switched_on_index[device.get_switched_on()]
+            ):
+                return False
+            if isinstance(device, SmartAirFryer) and (
+                device_id
+                not in self.cooking_mode_index[device.get_cooking_mode()]
+            ):
+                return False
+        device_count = len(self.devices)
+        return (
+            sum(len(index) for index in self.type_index.values())
+            == device_count
+            and sum(len(index) for index in self.switched_on_index.values())
+            == device_count
+            and sum(len(index) for index in self.cooking_mode_index.values())
+            == len(self.query(SmartAirFryer))
+        )
+
+    def query(
+        self: Self,
+        device_type: type[SmartDevice] | None = None,
+        switched_on: bool | None = None,
+        cooking_mode: str | None = None,
+    ) -> List[SmartDevice]:
+        # Returns the devices that match every filter that is given
+        if cooking_mode is not None and cooking_mode not in COOKING_MODE_CODES:
+            raise ValueError("invalid cooking mode.")
+        return self.stats.read(
+            lambda: self.query_indexes(device_type, switched_on, cooking_mode)
+        )
+
+    def query_indexes(
+        self: Self,
+        device_type: type[SmartDevice] | None,
+        switched_on: bool | None,
+        cooking_mode: str | None,
+    ) -> List[SmartDevice]:
+        indexes: List[Dict[int, SmartDevice]] = []
+        if device_type is not None:
+            type_indexes = [
+                index
+                for index_type, index in self.type_index.items()
+                if issubclass(index_type, device_type)
+            ]
+            if len(type_indexes) == 1:
+                indexes.append(type_indexes[0])
+            else:
+                type_index: Dict[int, SmartDevice] = {}
+                for index in type_indexes:
+                    type_index.update(index)
+                indexes.append(type_index)
+        if switched_on is not None:
+            indexes.append(self.switched_on_index[switched_on])
+        if cooking_mode is not None:
+            indexes.append(self.cooking_mode_index[cooking_mode])
+
+        if len(indexes) == 0:
+            return self.get_devices()
+
+        if len(indexes) == 1:
+            return list(indexes[0].values())
+
+        # Intersect starting from the smallest index, so that the larger
+        # indexes are only checked against its ids
+        indexes.sort(key=len)
+        smallest_index = indexes[0]
+        device_ids = smallest_index.keys() & indexes[1].keys()
+        for index in indexes[2:]:
+            device_ids &= index.keys()
+        return [smallest_index[device_id] for device_id in device_ids]
+
+    def get_switched_on_count(self: Self) -> int:
+        return self.stats.read(lambda: sum(self.switched_on_counts.values()))
+
+    def get_total_consumption(self: Self) -> int:
+        return self.total_consumption
+
+    def get_stats(self: Self) -> Dict[str, int | Dict[str, int]]:
+        return self.stats.read(self.read_stats)
+
+    def read_stats(self: Self) -> Dict[str, int | Dict[str, int]]:
+        return {
+            "total_consumption": self.total_consumption,
+            "switched_on": dict(self.switched_on_counts),
+            "switched_off": {
+                device_type: device_count
+                - self.switched_on_counts[device_type]
+                for device_type, device_count in self.device_counts.items()
+            },
+        }
+
+    def calculate_stats(self: Self) -> Dict[str, int | Dict[str, int]]:
+        # Calculates the stats from every device, get_stats should be
+        # used instead, this is used to check that they are consistent
+        total_consumption = 0
+        switched_on_counts: Dict[str, int] = {}
+        switched_off_counts: Dict[str, int] = {}
+        for device in self.get_devices():
+            device_type = type(device).__name__
+            switched_on_counts.setdefault(device_type, 0)
+            switched_off_counts.setdefault(device_type, 0)
+            if device.get_switched_on():
+                switched_on_counts[device_type] += 1
+                if isinstance(device, SmartPlug):
+                    total_consumption += device.get_consumption_rate()
+            else:
+                switched_off_counts[device_type] += 1
+
+        return {
+            "total_consumption": total_consumption,
+            "switched_on": switched_on_counts,
+            "switched_off": switched_off_counts,
+        }
+
+    def check_stats(self: Self) -> bool:
+        if self.get_stats() != self.calculate_stats():
+            return False
+        if self.store is not None:
+            return (
+                self.store.get_total_consumption() == self.total_consumption
+                and self.store.get_switched_on_count()
+                == self.get_switched_on_count()
+            )
+        return True
 
 
 def test_smart_home() -> None:
@@ -169,4 +1817,7 @@ def test_smart_home() -> None:
     print(smart_home)
 
 
-test_smart_home()
+if __name__ == "__main__":
+    test_smart_plug()
+    test_smart_air_fryer()
+    test_smart_home()
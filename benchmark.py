@@ -0,0 +1,783 @@
+import argparse
+import asyncio
+import compileall
+import gc
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from tkinter import TclError
+from typing import Callable, Dict, List
+
+from backend import (
+    CookingModes,
+    PowerBudgetModes,
+    SmartAirFryer,
+    SmartDevice,
+    SmartHome,
+    SmartPlug,
+)
+from cooking import CookPrograms, CookStep
+from drivers import DeviceController, DeviceServer, TcpDeviceDriver
+from frontend import SmartHomeSystem
+from frontendChallenge import (
+    MappedSmartDeviceFile,
+    SmartDeviceFile,
+    convert_binary_to_csv,
+    convert_csv_to_binary,
+)
+from loadtest import run_load_test
+from recorder import Recorder, Resolutions
+from rules import Condition, RuleAttributes, RulesEngine, turn_off
+from scheduler import DAY_SECONDS, ScheduleActions, Scheduler
+from server import SmartHomeServer
+from sharding import ShardedSimulation
+from simulation import HOUR_SECONDS, Simulation
+
+DEVICE_FACTORIES: Dict[str, Callable[[int], SmartDevice]] = {
+    "SmartDevice": lambda _: SmartDevice(),
+    "SmartPlug": lambda index: SmartPlug(index % 151),
+    "SmartAirFryer": lambda _: SmartAirFryer(),
+}
+
+
+def create_devices(
+    factory: Callable[[int], SmartDevice], size: int
+) -> List[SmartDevice]:
+    return [factory(index) for index in range(size)]
+
+
+def benchmark_device_memory(sizes: List[int]) -> None:
+    print("Device memory:")
+    for name, factory in DEVICE_FACTORIES.items():
+        for size in sizes:
+            # Time the construction without tracemalloc as it slows down
+            # every allocation
+            gc.collect()
+            start = time.perf_counter()
+            devices = create_devices(factory, size)
+            construction_time = time.perf_counter() - start
+            del devices
+
+            gc.collect()
+            tracemalloc.start()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            devices = create_devices(factory, size)
+            memory = tracemalloc.get_traced_memory()[0] - start_memory
+            tracemalloc.stop()
+            del devices
+
+            print(
+                f"  {name} x {size}: {memory / size:.1f} bytes/device "
+                f"(including the list), {construction_time:.3f}s to create"
+            )
+
+
+def benchmark_batch_load(size: int) -> None:
+    print(f"Loading {size} devices:")
+    for columnar in (False, True):
+        smart_home = SmartHome(columnar)
+        devices = create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+        start = time.perf_counter()
+        for device in devices:
+            smart_home.add_device(device)
+        add_device_time = time.perf_counter() - start
+
+        smart_home = SmartHome(columnar)
+        devices = create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+        start = time.perf_counter()
+        smart_home.add_devices(devices)
+        add_devices_time = time.perf_counter() - start
+
+        rates = {
+            device.get_id(): 150 - index % 151
+            for index, device in enumerate(devices)
+        }
+        start = time.perf_counter()
+        smart_home.set_consumption_rates(rates)
+        set_rates_time = time.perf_counter() - start
+
+        print(
+            f"  {'columnar' if columnar else 'list'}: "
+            f"add_device {add_device_time:.3f}s, "
+            f"add_devices {add_devices_time:.3f}s, "
+            f"set_consumption_rates {set_rates_time:.3f}s"
+        )
+
+
+def create_mixed_home(size: int) -> SmartHome:
+    # 9 in 10 devices are smart plugs, a third of the devices are on and
+    # the air fryers are spread over the cooking modes
+    cooking_modes = [cooking_mode.value for cooking_mode in CookingModes]
+    devices: List[SmartDevice] = []
+    for index in range(size):
+        if index % 10 == 0:
+            device: SmartDevice = SmartAirFryer()
+            device.set_cooking_mode(cooking_modes[index % 3])
+        else:
+            device = SmartPlug(index % 151)
+        if index % 3 == 0:
+            device.toggle_switch()
+        devices.append(device)
+    smart_home = SmartHome()
+    smart_home.add_devices(devices)
+    return smart_home
+
+
+def benchmark_query(size: int, repeat: int) -> None:
+    print(f"Querying {size} devices ({repeat} times):")
+    smart_home = create_mixed_home(size)
+    queries: Dict[str, tuple[Callable[[], object], Callable[[], object]]] = {
+        "smart plugs": (
+            lambda: smart_home.query(SmartPlug),
+            lambda: [
+                device
+                for device in smart_home.get_devices()
+                if isinstance(device, SmartPlug)
+            ],
+        ),
+        "switched on": (
+            lambda: smart_home.query(switched_on=True),
+            lambda: [
+                device
+                for device in smart_home.get_devices()
+                if device.get_switched_on()
+            ],
+        ),
+        "crispy air fryers": (
+            lambda: smart_home.query(
+                SmartAirFryer, cooking_mode=CookingModes.CRISPY.value
+            ),
+            lambda: [
+                device
+                for device in smart_home.get_devices()
+                if isinstance(device, SmartAirFryer)
+                and device.get_cooking_mode() == CookingModes.CRISPY.value
+            ],
+        ),
+        "switched on crispy air fryers": (
+            lambda: smart_home.query(
+                SmartAirFryer, True, CookingModes.CRISPY.value
+            ),
+            lambda: [
+                device
+                for device in smart_home.get_devices()
+                if isinstance(device, SmartAirFryer)
+                and device.get_switched_on()
+                and device.get_cooking_mode() == CookingModes.CRISPY.value
+            ],
+        ),
+    }
+    for name, (query, scan) in queries.items():
+        times = []
+        for function in (query, scan):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                function()
+            times.append((time.perf_counter() - start) / repeat)
+        print(
+            f"  {name}: query {times[0] * 1000:.3f}ms, "
+            f"linear scan {times[1] * 1000:.3f}ms"
+        )
+
+
+def time_python(code: str, repeat: int) -> float:
+    # The median wall clock time of starting Python and running the code
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark_startup(repeat: int) -> None:
+    print(f"Startup (median of {repeat} runs, without the interpreter):")
+    # Compile the modules first so that compiling them is not measured
+    for module in ("backend.py", "frontendChallenge.py", "frontend.py"):
+        compileall.compile_file(module, quiet=1)
+    interpreter_time = time_python("pass", repeat)
+    startups = {
+        "import backend": "import backend",
+        "import frontendChallenge": "import frontendChallenge",
+        "import frontend": "import frontend",
+        "headless worker": (
+            "import backend; "
+            "backend.SmartHome().add_devices("
+            "backend.SmartPlug(150) for _ in range(10_000))"
+        ),
+    }
+    for name, code in startups.items():
+        startup_time = time_python(code, repeat) - interpreter_time
+        print(f"  {name}: {startup_time * 1000:.1f}ms")
+
+
+def benchmark_scheduler(size: int, events: int) -> None:
+    print(f"Scheduler with {size} pending schedules:")
+    smart_home = SmartHome()
+    devices = create_devices(DEVICE_FACTORIES["SmartPlug"], 1_000)
+    smart_home.add_devices(devices)
+    now = 0.0
+    scheduler = Scheduler(smart_home, lambda: now)
+
+    actions = list(ScheduleActions)
+    start = time.perf_counter()
+    schedule_ids = [
+        scheduler.add_schedule(
+            devices[index % len(devices)].get_id(),
+            actions[index % len(actions)],
+            index % 86_400,
+            86_400 if index % 2 == 0 else None,
+        )
+        for index in range(size)
+    ]
+    add_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for schedule_id in schedule_ids[: size // 4]:
+        scheduler.cancel_schedule(schedule_id)
+    cancel_time = time.perf_counter() - start
+
+    # Run the schedules a second at a time until enough have been run
+    run_count = 0
+    start = time.perf_counter()
+    while run_count < events:
+        now += 1
+        run_count += scheduler.run_pending()
+    run_time = time.perf_counter() - start
+
+    print(
+        f"  add {add_time / size * 1e6:.2f}us, "
+        f"cancel {cancel_time / (size // 4) * 1e6:.2f}us, "
+        f"run {run_time / run_count * 1e6:.2f}us per schedule "
+        f"({len(scheduler)} pending)"
+    )
+
+
+def benchmark_simulation(size: int, days: int) -> None:
+    print(f"Simulating {size} smart plugs for {days} days:")
+    smart_home = SmartHome()
+    devices = create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+    smart_home.add_devices(devices)
+    simulation = Simulation(smart_home)
+    scheduler = simulation.get_scheduler()
+
+    # Every plug is on for part of each day and has its consumption rate
+    # changed once a week
+    for index, device in enumerate(devices):
+        on_time = (index % 24) * HOUR_SECONDS
+        scheduler.add_schedule(
+            device.get_id(), ScheduleActions.TURN_ON, on_time, DAY_SECONDS
+        )
+        scheduler.add_schedule(
+            device.get_id(),
+            ScheduleActions.TURN_OFF,
+            on_time + 8 * HOUR_SECONDS,
+            DAY_SECONDS,
+        )
+    for day in range(0, days, 7):
+        for index, device in enumerate(devices):
+            simulation.add_event(
+                day * DAY_SECONDS + index,
+                lambda _, device=device, rate=(index + day) % 151: (
+                    device.set_consumption_rate(rate)
+                ),
+            )
+
+    start = time.perf_counter()
+    event_count = simulation.run_until(days * DAY_SECONDS)
+    total_energy = simulation.get_total_energy()
+    run_time = time.perf_counter() - start
+
+    device_hours = size * days * 24
+    print(
+        f"  {event_count} events in {run_time:.3f}s, "
+        f"{device_hours / run_time:,.0f} device-hours/s, "
+        f"{total_energy / 1000:,.1f}kWh used"
+    )
+
+
+def benchmark_recorder(size: int, samples: int) -> None:
+    print(f"Recording {size} devices {samples} times:")
+    smart_home = create_mixed_home(size)
+
+    gc.collect()
+    tracemalloc.start()
+    recorder = Recorder(smart_home)
+    recorder.sample(0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    devices = smart_home.get_devices()
+    start = time.perf_counter()
+    for sample_time in range(1, samples):
+        # Change one device a second so the history is not constant
+        devices[sample_time % size].toggle_switch()
+        recorder.sample(sample_time)
+    sample_time = time.perf_counter() - start
+
+    device_id = devices[0].get_id()
+    start = time.perf_counter()
+    for resolution in Resolutions:
+        for _ in range(1_000):
+            recorder.get_range(device_id, samples / 4, samples / 2, resolution)
+    range_time = (time.perf_counter() - start) / (1_000 * len(Resolutions))
+
+    print(
+        f"  {memory / size / 1024:.1f}KiB/device, "
+        f"{sample_time / (size * (samples - 1)) * 1e6:.2f}us per sample, "
+        f"{range_time * 1e6:.2f}us per range query"
+    )
+
+
+def benchmark_rules(size: int, events: int) -> None:
+    print(f"Rules over {size} smart plugs, one rule each:")
+    smart_home = SmartHome()
+    devices = create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+    smart_home.add_devices(devices)
+
+    # Toggles every device, with and without the rules engine
+    start = time.perf_counter()
+    for index in range(events):
+        devices[index % size].toggle_switch()
+    toggle_time = (time.perf_counter() - start) / events
+
+    rules_engine = RulesEngine(smart_home)
+    for index, device in enumerate(devices):
+        rules_engine.add_rule(
+            [
+                Condition(
+                    RuleAttributes.SWITCHED_ON, "==", True, device.get_id()
+                )
+            ],
+            turn_off(devices[(index + 1) % size].get_id()),
+        )
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.TOTAL_CONSUMPTION, ">", 150 * size)],
+        lambda home: home.turn_off_all(),
+    )
+    start = time.perf_counter()
+    for index in range(events):
+        devices[index % size].toggle_switch()
+    rules_time = (time.perf_counter() - start) / events
+
+    rules = rules_engine.get_rules()
+    start = time.perf_counter()
+    for rule in rules:
+        rule.evaluate()
+    evaluate_all_time = time.perf_counter() - start
+
+    print(
+        f"  toggle {toggle_time * 1e6:.2f}us, "
+        f"toggle with rules {rules_time * 1e6:.2f}us, "
+        f"evaluating every rule {evaluate_all_time * 1e6:.0f}us"
+    )
+
+
+def benchmark_power_budget(size: int, events: int) -> None:
+    print(f"Power budget over {size} smart plugs:")
+    for mode in PowerBudgetModes:
+        smart_home = SmartHome()
+        devices = create_devices(lambda _: SmartPlug(50), size)
+        smart_home.add_devices(devices)
+        for index, device in enumerate(devices):
+            smart_home.set_device_priority(device.get_id(), index % 100)
+        smart_home.set_power_budget(50 * size, mode)
+        smart_home.turn_on_all()
+
+        # Raising the rate of a high priority device sheds lower priority
+        # ones to stay within the budget
+        high_priority_devices = sorted(
+            devices,
+            key=lambda device: smart_home.get_device_priority(device.get_id()),
+            reverse=True,
+        )[:events]
+        start = time.perf_counter()
+        for device in high_priority_devices:
+            device.set_consumption_rate(150)
+        event_time = (time.perf_counter() - start) / events
+        print(
+            f"  {mode.value}: {event_time * 1e6:.2f}us per rate raised, "
+            f"{len(smart_home.get_shed_log())} decisions in the log"
+        )
+
+
+def benchmark_cook_programs(size: int) -> None:
+    print(f"Cook programs on {size} air fryers, one event loop:")
+    smart_home = SmartHome()
+    devices = create_devices(DEVICE_FACTORIES["SmartAirFryer"], size)
+    smart_home.add_devices(devices)
+    cook_programs = CookPrograms(smart_home)
+    steps = [
+        CookStep(CookingModes.DEFROST.value, 0.2),
+        CookStep(CookingModes.CRISPY.value, 0.1),
+    ]
+
+    start = time.perf_counter()
+    for device in devices:
+        cook_programs.start(device.get_id(), steps)
+    start_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cook_programs.run_until_complete()
+    run_time = time.perf_counter() - start
+    cook_programs.close()
+
+    print(
+        f"  start {start_time / size * 1e6:.2f}us per program, "
+        f"{run_time:.3f}s to run programs of "
+        f"{sum(step.get_duration() for step in steps):.3f}s"
+    )
+
+
+async def run_driver_benchmark(
+    size: int, latency: float, max_concurrencies: List[int]
+) -> None:
+    device_server = DeviceServer(latency)
+    port = await device_server.start()
+    for max_concurrency in max_concurrencies:
+        smart_home = SmartHome()
+        smart_home.add_devices(
+            create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+        )
+        driver = TcpDeviceDriver("127.0.0.1", port, max_concurrency)
+        device_controller = DeviceController(
+            smart_home, driver, max_concurrency
+        )
+        report = await device_controller.turn_on_all()
+        await driver.close()
+        print(
+            f"  max concurrency {max_concurrency}: "
+            f"{len(report.get_succeeded())} switched on "
+            f"in {report.get_elapsed():.3f}s"
+        )
+    await device_server.close()
+
+
+def benchmark_drivers(size: int, latency: float) -> None:
+    print(
+        f"Switching on {size} devices over TCP "
+        f"({latency * 1000:.0f}ms per command):"
+    )
+    asyncio.run(run_driver_benchmark(size, latency, [1, 16, 128]))
+
+
+def run_thread_benchmark(
+    smart_home: SmartHome, thread_count: int, operations: int
+) -> tuple[float, int]:
+    # Each thread toggles and sets the rate of random smart plugs while
+    # one more thread reads the stats, returns the seconds taken by the
+    # writers and how many times the stats were read
+    devices = smart_home.get_devices()
+    barrier = threading.Barrier(thread_count + 1)
+    writing = threading.Event()
+    writing.set()
+    reads = 0
+
+    def write(seed: int) -> None:
+        generator = random.Random(seed)
+        barrier.wait()
+        for _ in range(operations):
+            device = generator.choice(devices)
+            if generator.random() < 0.5:
+                device.toggle_switch()
+            elif isinstance(device, SmartPlug):
+                device.set_consumption_rate(generator.randint(0, 150))
+
+    def read() -> None:
+        nonlocal reads
+        barrier.wait()
+        while writing.is_set():
+            smart_home.get_stats()
+            smart_home.query(switched_on=True)
+            reads += 1
+
+    writers = [
+        threading.Thread(target=write, args=(seed,))
+        for seed in range(thread_count)
+    ]
+    reader = threading.Thread(target=read)
+    for thread in [*writers, reader]:
+        thread.start()
+    start = time.perf_counter()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - start
+    writing.clear()
+    reader.join()
+    return elapsed, reads
+
+
+def benchmark_threads(size: int, operations: int) -> None:
+    print(
+        f"Changes from several threads to {size} smart plugs "
+        f"({operations} per thread, one more thread reading the stats):"
+    )
+    for columnar in (False, True):
+        print(f"  {'columnar' if columnar else 'objects'}:")
+        for thread_count in (1, 2, 4, 8):
+            smart_home = SmartHome(columnar)
+            smart_home.add_devices(
+                create_devices(DEVICE_FACTORIES["SmartPlug"], size)
+            )
+            elapsed, reads = run_thread_benchmark(
+                smart_home, thread_count, operations
+            )
+            consistent = (
+                smart_home.check_stats() and smart_home.check_indexes()
+            )
+            print(
+                f"    {thread_count} threads: "
+                f"{thread_count * operations / elapsed:,.0f} changes/s, "
+                f"{reads / elapsed:,.0f} reads/s, "
+                f"{'consistent' if consistent else 'NOT CONSISTENT'}"
+            )
+
+
+async def run_server_benchmark(
+    size: int, request_count: int, pipelines: List[int]
+) -> None:
+    smart_home = SmartHome()
+    smart_home.add_devices(create_devices(DEVICE_FACTORIES["SmartPlug"], size))
+    server = SmartHomeServer(smart_home)
+    port = await server.start()
+    for pipeline in pipelines:
+        report = await run_load_test(
+            port=port, request_count=request_count, pipeline=pipeline
+        )
+        print(f"  pipeline {pipeline}: {report}")
+    print(f"  {server.get_mean_batch_size():.1f} commands applied per batch")
+    await server.close()
+
+
+def benchmark_server(size: int, request_count: int) -> None:
+    print(
+        f"HTTP server with {size} smart plugs, 32 keep-alive connections "
+        "(toggles, bulk switches and stats):"
+    )
+    asyncio.run(run_server_benchmark(size, request_count, [1, 16]))
+
+
+def benchmark_sharding(
+    home_count: int, devices_per_home: int, steps: int
+) -> None:
+    # 1, 2, 4... shards up to the number of cores, and that number
+    core_count = os.cpu_count() or 1
+    shard_counts = [1]
+    while shard_counts[-1] * 2 <= core_count:
+        shard_counts.append(shard_counts[-1] * 2)
+    if shard_counts[-1] != core_count:
+        shard_counts.append(core_count)
+
+    print(
+        f"Sharded simulation of {home_count} homes of {devices_per_home} "
+        f"devices, {steps} steps ({core_count} cores):"
+    )
+    single_shard_time: float | None = None
+    for shard_count in shard_counts:
+        start = time.perf_counter()
+        simulation = ShardedSimulation(
+            home_count, devices_per_home, shard_count
+        )
+        setup_time = time.perf_counter() - start
+        start = time.perf_counter()
+        simulation.run(steps)
+        run_time = time.perf_counter() - start
+        simulation.close()
+        if single_shard_time is None:
+            single_shard_time = run_time
+        print(
+            f"  {shard_count} shards: {steps / run_time:.1f} steps/s, "
+            f"{simulation.get_device_count() * steps / run_time:,.0f} "
+            f"device steps/s, {single_shard_time / run_time:.2f}x "
+            f"(set up in {setup_time:.2f}s)"
+        )
+
+
+def create_csv_file(path: str, rows: int) -> None:
+    cooking_modes = [cooking_mode.value for cooking_mode in CookingModes]
+    with open(path, mode="w") as csv_file:
+        for index in range(rows):
+            switched_on = index % 2 == 0
+            if index % 10 == 0:
+                cooking_mode = cooking_modes[index % len(cooking_modes)]
+                csv_file.write(
+                    f"smart_air_fryer,{switched_on},{cooking_mode}\n"
+                )
+            else:
+                csv_file.write(f"smart_plug,{switched_on},{index % 151}\n")
+
+
+def benchmark_upload(rows: int) -> None:
+    print(f"Uploading a file of {rows} devices:")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "devices.csv")
+        create_csv_file(path, rows)
+        smart_device_file = SmartDeviceFile([])
+
+        start = time.perf_counter()
+        record_count = sum(1 for _ in smart_device_file.read_csv(path))
+        parse_time = time.perf_counter() - start
+        start = time.perf_counter()
+        smart_devices = smart_device_file.read_smart_devices(path)
+        read_time = time.perf_counter() - start
+        print(
+            f"  parse {record_count} rows {parse_time * 1000:.1f}ms, "
+            f"parse and create the devices {read_time * 1000:.1f}ms"
+        )
+
+        old_devices = create_devices(DEVICE_FACTORIES["SmartPlug"], rows)
+        for columnar in (False, True):
+            # Replacing the devices one at a time, and in one operation
+            smart_home = SmartHome(columnar)
+            smart_home.add_devices(old_devices)
+            start = time.perf_counter()
+            smart_home.delete_all_devices()
+            for smart_device in smart_devices:
+                smart_home.add_device(smart_device)
+            one_at_a_time = time.perf_counter() - start
+            smart_home.replace_devices(old_devices)
+            start = time.perf_counter()
+            smart_home.replace_devices(smart_devices)
+            replace_time = time.perf_counter() - start
+            smart_home.delete_all_devices()
+            print(
+                f"  {'columnar' if columnar else 'list'}: one at a time "
+                f"{one_at_a_time * 1000:.1f}ms, replace_devices "
+                f"{replace_time * 1000:.1f}ms"
+            )
+
+    benchmark_upload_widgets(smart_devices)
+
+
+def benchmark_upload_widgets(smart_devices: List[SmartDevice]) -> None:
+    # Needs a display, the widgets are created a chunk at a time when Tk
+    # is idle, the longest chunk is how long the window stops responding
+    try:
+        smart_home_system = SmartHomeSystem(SmartHome())
+    except TclError:
+        print("  widgets: skipped (no display)")
+        return
+    smart_home_system.create_widgets()
+    smart_home_system.win.update()
+    start = time.perf_counter()
+    smart_home_system.upload_smart_devices(smart_devices)
+    longest_chunk = time.perf_counter() - start
+    while smart_home_system.pending_smart_devices_gui:
+        chunk_start = time.perf_counter()
+        smart_home_system.win.update()
+        longest_chunk = max(longest_chunk, time.perf_counter() - chunk_start)
+    widgets_time = time.perf_counter() - start
+    smart_home_system.win.destroy()
+    print(
+        f"  widgets: {widgets_time:.2f}s in total, the window responds "
+        f"at least every {longest_chunk * 1000:.1f}ms"
+    )
+
+
+def benchmark_storage(rows: int, random_reads: int) -> None:
+    print(f"Loading a file of {rows} devices:")
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "storage.csv")
+        binary_path = os.path.join(directory, "storage.bin")
+        create_csv_file(csv_path, rows)
+        start = time.perf_counter()
+        convert_csv_to_binary(csv_path, binary_path)
+        to_binary_time = time.perf_counter() - start
+        start = time.perf_counter()
+        convert_binary_to_csv(binary_path, csv_path)
+        to_csv_time = time.perf_counter() - start
+        print(
+            f"  size: CSV {os.path.getsize(csv_path):,} bytes, binary "
+            f"{os.path.getsize(binary_path):,} bytes"
+        )
+        print(
+            f"  convert: to binary {to_binary_time * 1000:.1f}ms, "
+            f"to CSV {to_csv_time * 1000:.1f}ms"
+        )
+
+        # Reading the records is the parsing, loading also creates the
+        # devices from them
+        smart_device_file = SmartDeviceFile([])
+        start = time.perf_counter()
+        for _ in smart_device_file.read_csv(csv_path):
+            pass
+        csv_read_time = time.perf_counter() - start
+        start = time.perf_counter()
+        with MappedSmartDeviceFile(binary_path) as mapped_file:
+            for _ in mapped_file.get_records():
+                pass
+        binary_read_time = time.perf_counter() - start
+        for name, path, read_time in (
+            ("CSV", csv_path, csv_read_time),
+            ("binary", binary_path, binary_read_time),
+        ):
+            start = time.perf_counter()
+            smart_device_file.read_smart_devices(path)
+            load_time = time.perf_counter() - start
+            print(
+                f"  {name}: read the records {read_time * 1000:.1f}ms, "
+                f"load the devices {load_time * 1000:.1f}ms"
+            )
+
+        # Only the header is read to open the file, and each read only
+        # decodes its own record
+        generator = random.Random(0)
+        indexes = [generator.randrange(rows) for _ in range(random_reads)]
+        start = time.perf_counter()
+        mapped_file = MappedSmartDeviceFile(binary_path)
+        open_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for index in indexes:
+            mapped_file.get_smart_device(index)
+        random_time = time.perf_counter() - start
+        mapped_file.close()
+        print(
+            f"  binary: open {open_time * 1_000_000:.0f}us, "
+            f"{random_reads} random devices {random_time * 1000:.2f}ms"
+        )
+
+
+def main() -> None:
+    benchmarks: Dict[str, Callable[[], None]] = {
+        "memory": lambda: benchmark_device_memory([1_000, 100_000, 1_000_000]),
+        "batch": lambda: benchmark_batch_load(100_000),
+        "query": lambda: benchmark_query(100_000, 10),
+        "startup": lambda: benchmark_startup(20),
+        "scheduler": lambda: benchmark_scheduler(100_000, 100_000),
+        "simulation": lambda: benchmark_simulation(1_000, 30),
+        "recorder": lambda: benchmark_recorder(1_000, 7_200),
+        "rules": lambda: benchmark_rules(10_000, 100_000),
+        "budget": lambda: benchmark_power_budget(50_000, 10_000),
+        "cooking": lambda: benchmark_cook_programs(10_000),
+        "drivers": lambda: benchmark_drivers(500, 0.005),
+        "threads": lambda: benchmark_threads(10_000, 50_000),
+        "server": lambda: benchmark_server(1_000, 50_000),
+        "sharding": lambda: benchmark_sharding(2_000, 100, 20),
+        "upload": lambda: benchmark_upload(10_000),
+        "storage": lambda: benchmark_storage(200_000, 1_000),
+    }
+
+    parser = argparse.ArgumentParser(description="Smart home benchmarks.")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"the benchmarks to run: {', '.join(benchmarks)} (default: all)",
+    )
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f"invalid benchmark: {name}")
+
+    for name in args.benchmarks or benchmarks:
+        benchmarks[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import asyncio
+from enum import Enum
+from typing import Dict, Iterable, List, Self, Set
+
+from backend import (
+    COOKING_MODE_CODES,
+    DeviceEvent,
+    DeviceEventTypes,
+    SmartAirFryer,
+    SmartHome,
+)
+
+
+class CookProgramStates(Enum):
+    RUNNING = "running"
+    PAUSED = "paused"
+    FINISHED = "finished"
+    CANCELLED = "cancelled"
+
+
+class CookStep:
+    __slots__ = ("cooking_mode", "duration")
+
+    def __init__(self: Self, cooking_mode: str, duration: float) -> None:
+        if cooking_mode not in COOKING_MODE_CODES:
+            raise ValueError("invalid cooking mode.")
+        if duration <= 0:
+            raise ValueError("invalid duration (> 0).")
+        self.cooking_mode: str = cooking_mode
+        # In seconds
+        self.duration: float = duration
+
+    def get_cooking_mode(self: Self) -> str:
+        return self.cooking_mode
+
+    def get_duration(self: Self) -> float:
+        return self.duration
+
+
+class CookProgram:
+    # Runs the steps of a program on an air fryer, pausing switches it off and
+    # keeps the time left in the step
+    def __init__(
+        self: Self,
+        smart_air_fryer: SmartAirFryer,
+        steps: List[CookStep],
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        self.smart_air_fryer: SmartAirFryer = smart_air_fryer
+        self.steps: List[CookStep] = steps
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.state: CookProgramStates = CookProgramStates.RUNNING
+        self.step_index: int = 0
+        # The time left in the step when it is paused, and the loop time
+        # the step ends at while it is running
+        self.step_remaining: float = steps[0].duration
+        self.step_end: float | None = None
+        self.resumed: asyncio.Event = asyncio.Event()
+        self.resumed.set()
+        # Set to True when the step ends and False when it is paused
+        self.step_wakeup: asyncio.Future[bool] | None = None
+        self.task: asyncio.Task[None] | None = None
+        self.error: BaseException | None = None
+
+    def get_smart_air_fryer(self: Self) -> SmartAirFryer:
+        return self.smart_air_fryer
+
+    def get_steps(self: Self) -> List[CookStep]:
+        return self.steps
+
+    def get_state(self: Self) -> CookProgramStates:
+        return self.state
+
+    def get_error(self: Self) -> BaseException | None:
+        return self.error
+
+    def get_current_step(self: Self) -> CookStep:
+        return self.steps[self.step_index]
+
+    def get_step_remaining_time(self: Self) -> float:
+        if (
+            self.state is CookProgramStates.RUNNING
+            and self.step_end is not None
+        ):
+            return max(0.0, self.step_end - self.loop.time())
+        if self.state in (CookProgramStates.RUNNING, CookProgramStates.PAUSED):
+            return self.step_remaining
+        return 0.0
+
+    def get_remaining_time(self: Self) -> float:
+        if self.state not in (
+            CookProgramStates.RUNNING,
+            CookProgramStates.PAUSED,
+        ):
+            return 0.0
+        return self.get_step_remaining_time() + sum(
+            step.duration for step in self.steps[self.step_index + 1 :]
+        )
+
+    def set_switched_on(self: Self, switched_on: bool) -> None:
+        if self.smart_air_fryer.get_switched_on() != switched_on:
+            self.smart_air_fryer.toggle_switch()
+
+    async def run(self: Self) -> None:
+        try:
+            for step_index, step in enumerate(self.steps):
+                self.step_index = step_index
+                self.step_remaining = step.duration
+                self.smart_air_fryer.set_cooking_mode(step.cooking_mode)
+                while self.step_remaining > 0:
+                    await self.resumed.wait()
+                    self.set_switched_on(True)
+                    self.step_end = self.loop.time() + self.step_remaining
+                    # A timer instead of asyncio.sleep so that pause can
+                    # wake the program up
+                    self.step_wakeup = self.loop.create_future()
+                    timer = self.loop.call_at(
+                        self.step_end, self.wake_up, True
+                    )
+                    try:
+                        step_ended = await self.step_wakeup
+                    finally:
+                        timer.cancel()
+                    if step_ended:
+                        self.step_remaining = 0
+                    # Otherwise pause has kept the time left in the step
+                    self.step_end = None
+            self.state = CookProgramStates.FINISHED
+        finally:
+            if self.state is not CookProgramStates.FINISHED:
+                self.state = CookProgramStates.CANCELLED
+            self.set_switched_on(False)
+
+    def wake_up(self: Self, step_ended: bool) -> None:
+        if self.step_wakeup is not None and not self.step_wakeup.done():
+            self.step_wakeup.set_result(step_ended)
+
+    def pause(self: Self) -> None:
+        if self.state is not CookProgramStates.RUNNING:
+            raise ValueError("cook program is not running.")
+        self.step_remaining = self.get_step_remaining_time()
+        self.step_end = None
+        self.state = CookProgramStates.PAUSED
+        self.resumed.clear()
+        self.wake_up(False)
+        self.set_switched_on(False)
+
+    def resume(self: Self) -> None:
+        if self.state is not CookProgramStates.PAUSED:
+            raise ValueError("cook program is not paused.")
+        self.state = CookProgramStates.RUNNING
+        self.resumed.set()
+
+    def cancel(self: Self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        if self.state in (CookProgramStates.RUNNING, CookProgramStates.PAUSED):
+            self.state = CookProgramStates.CANCELLED
+
+
+class CookPrograms:
+    # Runs the cook programs as tasks on one event loop, which pump runs from
+    # the Tk main loop, only the active programs are kept
+    def __init__(
+        self: Self,
+        home: SmartHome,
+        loop: asyncio.AbstractEventLoop | None = None,
+    ) -> None:
+        self.home: SmartHome = home
+        self.loop: asyncio.AbstractEventLoop = (
+            loop if loop is not None else asyncio.new_event_loop()
+        )
+        # The running and paused programs by air fryer id, and the ids of
+        # the air fryers whose program has ended since they were last asked
+        # for
+        self.programs: Dict[int, CookProgram] = {}
+        self.ended_device_ids: Set[int] = set()
+        home.subscribe(self.handle_device_event)
+
+    def close(self: Self) -> None:
+        self.home.unsubscribe(self.handle_device_event)
+        for program in list(self.programs.values()):
+            program.cancel()
+        self.pump()
+        self.loop.close()
+
+    def get_loop(self: Self) -> asyncio.AbstractEventLoop:
+        return self.loop
+
+    def get_program(self: Self, device_id: int) -> CookProgram | None:
+        return self.programs.get(device_id)
+
+    def get_programs(self: Self) -> Dict[int, CookProgram]:
+        return dict(self.programs)
+
+    def get_active_program(self: Self, device_id: int) -> CookProgram:
+        program = self.programs.get(device_id)
+        if program is None:
+            raise ValueError("no cook program for the device.")
+        return program
+
+    def pop_ended_device_ids(self: Self) -> Set[int]:
+        ended_device_ids = self.ended_device_ids
+        self.ended_device_ids = set()
+        return ended_device_ids
+
+    def start(
+        self: Self, device_id: int, steps: Iterable[CookStep]
+    ) -> CookProgram:
+        smart_air_fryer = self.home.get_device(device_id)
+        if not isinstance(smart_air_fryer, SmartAirFryer):
+            raise ValueError(
+                "device is not a SmartAirFryer in the smart home."
+            )
+        steps = list(steps)
+        if len(steps) == 0:
+            raise ValueError("invalid cook program (no steps).")
+
+        existing_program = self.programs.get(device_id)
+        if existing_program is not None:
+            existing_program.cancel()
+
+        program = CookProgram(smart_air_fryer, steps, self.loop)
+        program.task = self.loop.create_task(program.run())
+        program.task.add_done_callback(
+            lambda task: self.end(device_id, program, task)
+        )
+        self.programs[device_id] = program
+        return program
+
+    def end(
+        self: Self,
+        device_id: int,
+        program: CookProgram,
+        task: asyncio.Task[None],
+    ) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            program.error = task.exception()
+            program.state = CookProgramStates.CANCELLED
+        # A program replaced by a new one has already been removed
+        if self.programs.get(device_id) is program:
+            del self.programs[device_id]
+            self.ended_device_ids.add(device_id)
+
+    def pause(self: Self, device_id: int) -> None:
+        self.get_active_program(device_id).pause()
+
+    def resume(self: Self, device_id: int) -> None:
+        self.get_active_program(device_id).resume()
+
+    def cancel(self: Self, device_id: int) -> None:
+        self.get_active_program(device_id).cancel()
+
+    def handle_device_event(self: Self, event: DeviceEvent) -> None:
+        if event.get_event_type() == DeviceEventTypes.REMOVED:
+            program = self.programs.get(event.get_device().get_id())
+            if program is not None:
+                program.cancel()
+
+    def get_next_time(self: Self) -> float | None:
+        # Seconds until the next running step ends
+        step_remaining_times = [
+            program.get_step_remaining_time()
+            for program in self.programs.values()
+            if program.state is CookProgramStates.RUNNING
+        ]
+        if len(step_remaining_times) == 0:
+            return None
+        return min(step_remaining_times)
+
+    def pump(self: Self) -> None:
+        # Runs the callbacks that are ready and the timers that are due,
+        # without waiting, a program woken up by them runs on the next pump
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def run_until_complete(self: Self) -> None:
+        # Runs the loop until every program has ended, for use without Tk,
+        # a paused program has to be resumed or cancelled by another task
+        while len(self.programs) > 0:
+            tasks = [
+                program.task
+                for program in self.programs.values()
+                if program.task is not None
+            ]
+            self.loop.run_until_complete(asyncio.wait(tasks))
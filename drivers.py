@@ -0,0 +1,351 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Mapping, Self, Set
+
+from backend import SmartAirFryer, SmartDevice, SmartHome, SmartPlug
+
+# The commands understood by the device server, each with the value to set
+DRIVER_COMMANDS = (
+    "set_switched_on",
+    "set_consumption_rate",
+    "set_cooking_mode",
+)
+
+
+# Raised by a driver when a device reports that a command failed
+class DriverError(Exception):
+    pass
+
+
+class DeviceDriver:
+    # The base driver has no devices behind it, every command succeeds straight
+    # away
+    async def send(
+        self: Self, device_id: int, command: str, value: bool | int | str
+    ) -> None:
+        if command not in DRIVER_COMMANDS:
+            raise DriverError("invalid command.")
+
+    async def close(self: Self) -> None:
+        pass
+
+
+class TcpDeviceDriver(DeviceDriver):
+    # Sends commands as JSON lines over at most pool_size TCP connections
+    def __init__(
+        self: Self, host: str, port: int, pool_size: int = 64
+    ) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.pool_size: int = pool_size
+        self.connections: List[
+            tuple[asyncio.StreamReader, asyncio.StreamWriter]
+        ] = []
+        self.connection_count: int = 0
+        self.connection_available: asyncio.Condition = asyncio.Condition()
+
+    async def get_connection(
+        self: Self,
+    ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        async with self.connection_available:
+            while (
+                len(self.connections) == 0
+                and self.connection_count >= self.pool_size
+            ):
+                await self.connection_available.wait()
+            if len(self.connections) > 0:
+                return self.connections.pop()
+            self.connection_count += 1
+        try:
+            return await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            await self.release_connection(None)
+            raise
+
+    async def release_connection(
+        self: Self,
+        connection: tuple[asyncio.StreamReader, asyncio.StreamWriter] | None,
+    ) -> None:
+        # None when the connection was closed, making room for a new one
+        async with self.connection_available:
+            if connection is None:
+                self.connection_count -= 1
+            else:
+                self.connections.append(connection)
+            self.connection_available.notify()
+
+    async def send(
+        self: Self, device_id: int, command: str, value: bool | int | str
+    ) -> None:
+        await super().send(device_id, command, value)
+        request = {"device_id": device_id, "command": command, "value": value}
+        connection = await self.get_connection()
+        reader, writer = connection
+        try:
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+            if line == b"":
+                raise DriverError("connection closed.")
+        except BaseException:
+            # The reply may still come, so the connection can't be reused
+            writer.close()
+            await self.release_connection(None)
+            raise
+        await self.release_connection(connection)
+
+        response = json.loads(line)
+        if response.get("ok") is not True:
+            raise DriverError(response.get("error", "command failed."))
+
+    async def close(self: Self) -> None:
+        for _, writer in self.connections:
+            writer.close()
+        self.connections = []
+        self.connection_count = 0
+
+
+class DeviceServer:
+    # Simulates devices behind a network, for tests and benchmarks, every
+    # command takes latency seconds (plus up to jitter seconds)
+    def __init__(
+        self: Self,
+        latency: float = 0.01,
+        jitter: float = 0.0,
+    ) -> None:
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.device_states: Dict[int, Dict[str, Any]] = {}
+        self.failing_device_ids: Set[int] = set()
+        self.unresponsive_device_ids: Set[int] = set()
+        self.server: asyncio.Server | None = None
+        self.client_tasks: Set[asyncio.Task[Any]] = set()
+
+    def get_device_state(self: Self, device_id: int) -> Dict[str, Any]:
+        return self.device_states.setdefault(device_id, {})
+
+    def set_failing(self: Self, device_id: int, failing: bool = True) -> None:
+        if failing:
+            self.failing_device_ids.add(device_id)
+        else:
+            self.failing_device_ids.discard(device_id)
+
+    def set_unresponsive(
+        self: Self, device_id: int, unresponsive: bool = True
+    ) -> None:
+        if unresponsive:
+            self.unresponsive_device_ids.add(device_id)
+        else:
+            self.unresponsive_device_ids.discard(device_id)
+
+    async def start(self: Self, host: str = "127.0.0.1", port: int = 0) -> int:
+        # Returns the port, a free one is used when port is 0
+        # A large backlog so that a burst of new connections isn't dropped
+        self.server = await asyncio.start_server(
+            self.handle_client, host, port, backlog=1024
+        )
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self: Self) -> None:
+        if self.server is not None:
+            self.server.close()
+            for task in list(self.client_tasks):
+                task.cancel()
+            await asyncio.gather(*self.client_tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_client(
+        self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.client_tasks.add(task)
+        try:
+            # Requests on one connection are handled one at a time
+            while line := await reader.readline():
+                response = await self.handle_request(json.loads(line))
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            if task is not None:
+                self.client_tasks.discard(task)
+
+    async def handle_request(
+        self: Self, request: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        device_id = request.get("device_id")
+        command = request.get("command")
+        if not isinstance(device_id, int) or command not in DRIVER_COMMANDS:
+            return {"ok": False, "error": "invalid request."}
+
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if device_id in self.unresponsive_device_ids:
+            await asyncio.Future()
+        if device_id in self.failing_device_ids:
+            return {"ok": False, "error": "device failed."}
+        state = self.get_device_state(device_id)
+        state[command.removeprefix("set_")] = request.get("value")
+        return {"ok": True}
+
+
+class BulkReport:
+    def __init__(
+        self: Self, errors: Dict[int, str | None], elapsed: float
+    ) -> None:
+        # The error of each device, None if the command succeeded
+        self.errors: Dict[int, str | None] = errors
+        # Wall clock seconds for the whole operation
+        self.elapsed: float = elapsed
+
+    def __str__(self: Self) -> str:
+        output = f"{len(self.get_succeeded())} succeeded, "
+        output += f"{len(self.get_failed())} failed "
+        output += f"in {self.elapsed:.3f}s"
+        for device_id, error in self.get_failed().items():
+            output += f"\n  - {device_id}: {error}"
+        return output
+
+    def get_errors(self: Self) -> Dict[int, str | None]:
+        return self.errors
+
+    def get_succeeded(self: Self) -> List[int]:
+        return [
+            device_id
+            for device_id, error in self.errors.items()
+            if error is None
+        ]
+
+    def get_failed(self: Self) -> Dict[int, str]:
+        return {
+            device_id: error
+            for device_id, error in self.errors.items()
+            if error is not None
+        }
+
+    def get_elapsed(self: Self) -> float:
+        return self.elapsed
+
+
+class DeviceController:
+    # Only applies a change to the SmartHome once the device has confirmed it,
+    # with at most max_concurrency commands in flight
+    def __init__(
+        self: Self,
+        home: SmartHome,
+        driver: DeviceDriver,
+        max_concurrency: int = 64,
+        timeout: float = 1.0,
+    ) -> None:
+        if max_concurrency <= 0:
+            raise ValueError("invalid max concurrency (> 0).")
+        self.home: SmartHome = home
+        self.driver: DeviceDriver = driver
+        self.max_concurrency: int = max_concurrency
+        self.timeout: float = timeout
+
+    def get_driver(self: Self) -> DeviceDriver:
+        return self.driver
+
+    async def send(
+        self: Self,
+        semaphore: asyncio.Semaphore,
+        device: SmartDevice,
+        command: str,
+        value: bool | int | str,
+    ) -> str | None:
+        # Returns the error, or None once the change has been applied
+        async with semaphore:
+            try:
+                await asyncio.wait_for(
+                    self.driver.send(device.get_id(), command, value),
+                    self.timeout,
+                )
+            except TimeoutError:
+                return "timed out."
+            except (DriverError, OSError) as error:
+                return str(error) or type(error).__name__
+        try:
+            match command:
+                case "set_switched_on":
+                    if device.get_switched_on() != value:
+                        device.toggle_switch()
+                case "set_consumption_rate" if isinstance(device, SmartPlug):
+                    device.set_consumption_rate(int(value))
+                case "set_cooking_mode" if isinstance(device, SmartAirFryer):
+                    device.set_cooking_mode(str(value))
+        except ValueError as error:
+            return str(error)
+        return None
+
+    async def send_all(
+        self: Self,
+        command: str,
+        values: Mapping[SmartDevice, bool | int | str],
+    ) -> BulkReport:
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        devices = list(values)
+        errors = await asyncio.gather(
+            *(
+                self.send(semaphore, device, command, values[device])
+                for device in devices
+            )
+        )
+        return BulkReport(
+            {
+                device.get_id(): error
+                for device, error in zip(devices, errors, strict=True)
+            },
+            time.perf_counter() - start,
+        )
+
+    async def set_switched_on(
+        self: Self, switched_on: Mapping[int, bool]
+    ) -> BulkReport:
+        devices: Dict[SmartDevice, bool | int | str] = {}
+        for device_id, device_switched_on in switched_on.items():
+            device = self.home.get_device(device_id)
+            if device is None:
+                raise ValueError("device is not in the smart home.")
+            devices[device] = device_switched_on
+        return await self.send_all("set_switched_on", devices)
+
+    async def set_consumption_rates(
+        self: Self, rates: Mapping[int, int]
+    ) -> BulkReport:
+        devices: Dict[SmartDevice, bool | int | str] = {}
+        for device_id, rate in rates.items():
+            device = self.home.get_device(device_id)
+            if not isinstance(device, SmartPlug):
+                raise ValueError(
+                    "device is not a SmartPlug in the smart home."
+                )
+            if rate < 0 or rate > 150:
+                raise ValueError(SmartPlug.error_message)
+            devices[device] = rate
+        return await self.send_all("set_consumption_rate", devices)
+
+    async def turn_on_all(self: Self) -> BulkReport:
+        return await self.send_all(
+            "set_switched_on",
+            dict.fromkeys(self.home.query(switched_on=False), True),
+        )
+
+    async def turn_off_all(self: Self) -> BulkReport:
+        return await self.send_all(
+            "set_switched_on",
+            dict.fromkeys(self.home.query(switched_on=True), False),
+        )
+
+    async def toggle_switch_all(self: Self) -> BulkReport:
+        if self.home.get_switch_all_state() is False:
+            self.home.set_switch_all_state(True)
+            return await self.turn_on_all()
+        self.home.set_switch_all_state(False)
+        return await self.turn_off_all()
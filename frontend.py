@@ -1,4 +1,8 @@
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
+from threading import Event
 from tkinter import (
     LEFT,
     RIGHT,
@@ -6,6 +10,7 @@ from tkinter import (
     Button,
     Checkbutton,
     E,
+    Entry,
     Frame,
     Label,
     OptionMenu,
@@ -17,17 +22,46 @@ from tkinter import (
     W,
     colorchooser,
     filedialog,
+    ttk,
 )
-from typing import List, Self
+from typing import Any, Callable, Dict, Iterable, List, Self
 
 from backend import (
     CookingModes,
+    DeviceEvent,
+    DeviceEventTypes,
     SmartAirFryer,
     SmartDevice,
     SmartHome,
     SmartPlug,
 )
-from frontendChallenge import FontInfo, Images, SmartDeviceFile, Themes
+from cooking import CookProgram, CookPrograms, CookProgramStates, CookStep
+from frontendChallenge import (
+    FILE_PROGRESS_TYPE,
+    FileCancelledError,
+    FontInfo,
+    Images,
+    SmartDeviceFile,
+    Themes,
+)
+from replication import ReplicationFollower, ReplicationPrimary
+from scheduler import Scheduler
+
+# The longest time between runs of the scheduler, so new schedules are
+# picked up
+SCHEDULER_MAX_DELAY_MS = 1000
+
+# How often the time left of the cook programs is shown
+COOK_PROGRAMS_MAX_DELAY_MS = 1000
+
+# How often the progress of a file being downloaded or uploaded is shown
+FILE_TASK_POLL_MS = 50
+
+# How often the changes from the primary are applied to a follower
+REPLICATION_POLL_MS = 50
+
+# How many smart devices have their widgets created each time Tk is idle
+WIDGETS_CHUNK_SIZE = 100
 
 
 class SmartDeviceNums(Enum):
@@ -87,6 +121,22 @@ def get_smart_devices() -> List[SmartDevice]:
     return smart_devices
 
 
+def get_cook_steps(text_cook_steps: str) -> List[CookStep]:
+    # Steps such as "Defrost 10, Crispy 8", a cooking mode and the minutes
+    # it is cooked for
+    cook_steps: List[CookStep] = []
+    for text_cook_step in text_cook_steps.split(","):
+        parts = text_cook_step.split()
+        if len(parts) != 2:
+            raise ValueError("invalid cook step (cooking mode and minutes).")
+        try:
+            minutes = float(parts[1])
+        except ValueError as error:
+            raise ValueError("invalid cook step minutes.") from error
+        cook_steps.append(CookStep(parts[0].capitalize(), minutes * 60))
+    return cook_steps
+
+
 def set_up_home() -> SmartHome:
     smart_home: SmartHome = SmartHome()
     smart_devices = get_smart_devices()
@@ -95,7 +145,9 @@ def set_up_home() -> SmartHome:
     return smart_home
 
 
-WIDGETS_TYPE = Frame | Button | Checkbutton | Label | OptionMenu | Spinbox
+WIDGETS_TYPE = (
+    Frame | Button | Checkbutton | Entry | Label | OptionMenu | Spinbox
+)
 
 
 class SmartDeviceGui:
@@ -183,18 +235,6 @@ class SmartPlugGui(SmartDeviceGui):
         except Exception as error:
             raise error
 
-    # This is needed for the Spinbox bind on return, because
-    # I am raising an error in set_smart_plug_consumption_rate to ensure
-    # that a device is not added, even when the validation fails
-    def set_smart_plug_consumption_rate_validate(
-        self: Self,
-        text_spinbox_consumption_rate: StringVar,
-    ) -> None:
-        try:
-            self.set_smart_plug_consumption_rate(text_spinbox_consumption_rate)
-        except Exception as error:
-            print("Error:", error)
-
     def set_smart_plug(
         self: Self,
         bool_checkbutton_switched_on: BooleanVar,
@@ -208,10 +248,29 @@ class SmartAirFryerGui(SmartDeviceGui):
     def __init__(self: Self, smart_air_fryer: SmartAirFryer) -> None:
         super().__init__(smart_air_fryer)
         self.smart_air_fryer: SmartAirFryer = smart_air_fryer
+        # cook_program_var is used to show the time left of the cook
+        # program on the GUI
+        self.cook_program_var: StringVar | None = None
 
     def get_smart_device(self: Self) -> SmartAirFryer:
         return self.smart_air_fryer
 
+    def set_cook_program_var(self: Self, cook_program_var: StringVar) -> None:
+        self.cook_program_var = cook_program_var
+
+    def set_cook_program(self: Self, cook_program: CookProgram | None) -> None:
+        if self.cook_program_var is None:
+            return
+        if cook_program is None:
+            self.cook_program_var.set("")
+            return
+        minutes, seconds = divmod(int(cook_program.get_remaining_time()), 60)
+        text = f"{cook_program.get_current_step().get_cooking_mode()}, "
+        text += f"{minutes}:{seconds:02d} left"
+        if cook_program.get_state() is CookProgramStates.PAUSED:
+            text += " (paused)"
+        self.cook_program_var.set(text)
+
     def set_smart_air_fryer_cooking_mode(
         self: Self,
         text_option_menu_cooking_mode: StringVar,
@@ -231,34 +290,102 @@ class SmartAirFryerGui(SmartDeviceGui):
 class SmartDevicesStateManager:
     def __init__(self: Self, home: SmartHome) -> None:
         self.home: SmartHome = home
-        self.smart_devices_gui: List[SmartDeviceGui] = []
+        # Keyed by the smart device id, the same as in the SmartHome
+        self.smart_devices_gui: Dict[int, SmartDeviceGui] = {}
 
         for smart_device in self.home.get_devices():
-            if isinstance(smart_device, SmartPlug):
-                smart_plug_gui: SmartPlugGui = SmartPlugGui(smart_device)
-                self.smart_devices_gui.append(smart_plug_gui)
-            elif isinstance(smart_device, SmartAirFryer):
-                smart_air_fryer_gui: SmartAirFryerGui = SmartAirFryerGui(
-                    smart_device
-                )
-                self.smart_devices_gui.append(smart_air_fryer_gui)
+            self.add_smart_device_gui(smart_device)
+
+        # Ids of the smart devices that have changed since their GUI was
+        # last updated, so that only those are updated
+        self.dirty_smart_device_ids: set[int] = set()
+        self.home.subscribe(self.mark_smart_device_dirty)
+
+        # The frame (and title Label) of each group section in the smart
+        # devices list, None is the section for devices without a group
+        self.group_sections: Dict[str | None, List[WIDGETS_TYPE]] = {}
+
+    def mark_smart_device_dirty(self: Self, event: DeviceEvent) -> None:
+        smart_device_id = event.get_device().get_id()
+        if event.get_event_type() == DeviceEventTypes.REMOVED:
+            self.dirty_smart_device_ids.discard(smart_device_id)
+        elif event.get_event_type() != DeviceEventTypes.ADDED:
+            self.dirty_smart_device_ids.add(smart_device_id)
 
     def get_smart_devices_gui(self: Self) -> List[SmartDeviceGui]:
+        return list(self.smart_devices_gui.values())
+
+    def get_smart_devices_gui_by_id(self: Self) -> Dict[int, SmartDeviceGui]:
         return self.smart_devices_gui
 
+    def get_group_section(
+        self: Self, group_name: str | None
+    ) -> List[WIDGETS_TYPE] | None:
+        return self.group_sections.get(group_name)
+
+    def get_group_sections_widgets(self: Self) -> List[WIDGETS_TYPE]:
+        return [
+            widget
+            for group_section in self.group_sections.values()
+            for widget in group_section
+        ]
+
+    def add_group_section(
+        self: Self, group_name: str | None, widgets: List[WIDGETS_TYPE]
+    ) -> None:
+        self.group_sections[group_name] = widgets
+
+    def get_smart_device_group(
+        self: Self, smart_device_gui: SmartDeviceGui
+    ) -> str | None:
+        # A device is shown in the section of the first group it was added to
+        smart_device_id = smart_device_gui.get_smart_device().get_id()
+        group_names = self.home.get_device_groups(smart_device_id)
+        if len(group_names) > 0:
+            return group_names[0]
+        return None
+
+    def add_smart_device_to_group(
+        self: Self, group_name: str, smart_device_gui: SmartDeviceGui
+    ) -> None:
+        group_name = group_name.strip()
+        if group_name not in self.home.get_groups():
+            self.home.add_group(group_name)
+        self.home.add_device_to_group(
+            group_name, smart_device_gui.get_smart_device().get_id()
+        )
+
     def add_smart_device(self: Self, smart_device_gui: SmartDeviceGui) -> None:
         smart_device = smart_device_gui.get_smart_device()
         self.home.add_device(smart_device)
-        self.smart_devices_gui.append(smart_device_gui)
+        self.smart_devices_gui[smart_device.get_id()] = smart_device_gui
+
+    def add_smart_device_gui(
+        self: Self, smart_device: SmartDevice
+    ) -> SmartDeviceGui | None:
+        # For a smart device that is already in the SmartHome
+        smart_device_gui: SmartDeviceGui | None = None
+        if isinstance(smart_device, SmartPlug):
+            smart_device_gui = SmartPlugGui(smart_device)
+        elif isinstance(smart_device, SmartAirFryer):
+            smart_device_gui = SmartAirFryerGui(smart_device)
+        if smart_device_gui is not None:
+            self.smart_devices_gui[smart_device.get_id()] = smart_device_gui
+        return smart_device_gui
+
+    def delete_smart_device_gui(self: Self, smart_device_id: int) -> None:
+        # For a smart device that is already out of the SmartHome
+        smart_device_gui = self.smart_devices_gui.pop(smart_device_id, None)
+        if smart_device_gui is not None:
+            smart_device_gui.delete_widgets()
 
     def delete_smart_device(
         self: Self, smart_device_gui: SmartDeviceGui
     ) -> None:
-        smart_device = smart_device_gui.get_smart_device()
-        smart_device_index = self.home.get_devices().index(smart_device)
-        self.home.remove_device_at(smart_device_index)
+        smart_device_id = smart_device_gui.get_smart_device().get_id()
+        self.home.remove_device(smart_device_id)
 
-        self.smart_devices_gui.remove(smart_device_gui)
+        self.smart_devices_gui.pop(smart_device_id, None)
         smart_device_gui.delete_widgets()
 
     def toggle_all_smart_devices(
@@ -268,23 +395,71 @@ class SmartDevicesStateManager:
         image_on: PhotoImage,
     ) -> None:
         self.home.toggle_switch_all()
-        self.update_all_smart_devices_gui()
+        self.update_dirty_smart_devices_gui()
 
         if self.home.get_switch_all_state() is False:
             button_toggle_all.config(image=image_off)
         elif self.home.get_switch_all_state() is True:
             button_toggle_all.config(image=image_on)
 
-    def update_all_smart_devices_gui(self: Self) -> None:
-        for smart_device_gui in self.smart_devices_gui:
+    def set_smart_device_switched_on(
+        self: Self,
+        smart_device_gui: SmartDeviceGui,
+        bool_checkbutton_switched_on: BooleanVar,
+    ) -> None:
+        try:
+            smart_device_gui.set_smart_device_switched_on(
+                bool_checkbutton_switched_on
+            )
+        except Exception as error:
+            print("Error:", error)
+            # Show the state the smart device has kept
             smart_device_gui.update_smart_device()
+        # Devices shed to stay within the power budget
+        self.update_dirty_smart_devices_gui()
+
+    def set_smart_plug_consumption_rate(
+        self: Self,
+        smart_plug_gui: SmartPlugGui,
+        text_spinbox_consumption_rate: StringVar,
+    ) -> None:
+        try:
+            smart_plug_gui.set_smart_plug_consumption_rate(
+                text_spinbox_consumption_rate
+            )
+        except Exception as error:
+            print("Error:", error)
+            smart_plug_gui.update_smart_device()
+        self.update_dirty_smart_devices_gui()
 
-    def delete_all_smart_devices(self: Self) -> None:
-        for smart_device_gui in self.smart_devices_gui:
+    def update_all_smart_devices_gui(self: Self) -> None:
+        for smart_device_gui in self.smart_devices_gui.values():
+            smart_device_gui.update_smart_device()
+        self.dirty_smart_device_ids.clear()
+
+    def update_dirty_smart_devices_gui(self: Self) -> None:
+        for smart_device_id in self.dirty_smart_device_ids:
+            smart_device_gui = self.smart_devices_gui.get(smart_device_id)
+            if smart_device_gui is not None:
+                smart_device_gui.update_smart_device()
+        self.dirty_smart_device_ids.clear()
+
+    def replace_smart_devices(
+        self: Self, smart_devices: List[SmartDevice]
+    ) -> List[SmartDeviceGui]:
+        # Swaps the smart devices of the SmartHome in one operation, and
+        # returns the GUIs of the new ones, which have no widgets yet
+        self.home.replace_devices(smart_devices)
+        for smart_device_gui in self.smart_devices_gui.values():
             smart_device_gui.delete_widgets()
+        self.smart_devices_gui = {}
 
-        self.smart_devices_gui = []
-        self.home.delete_all_devices()
+        smart_devices_gui: List[SmartDeviceGui] = []
+        for smart_device in smart_devices:
+            smart_device_gui = self.add_smart_device_gui(smart_device)
+            if smart_device_gui is not None:
+                smart_devices_gui.append(smart_device_gui)
+        return smart_devices_gui
 
 
 class Utilities:
@@ -293,6 +468,7 @@ class Utilities:
     def create_checkbox_smart_device_switched_on(
         frame: Frame,
         smart_device_gui: SmartDeviceGui,
+        smart_devices_state_manager: SmartDevicesStateManager,
         themes: Themes,
     ) -> tuple[BooleanVar, Checkbutton]:
         smart_device = smart_device_gui.get_smart_device()
@@ -311,8 +487,10 @@ class Utilities:
             bg=themes.get_current().get_background(),
             activeforeground=themes.get_current().get_foreground(),
             activebackground=themes.get_current().get_activebackground(),
-            command=lambda: smart_device_gui.set_smart_device_switched_on(
-                bool_checkbutton_switched_on
+            command=lambda: (
+                smart_devices_state_manager.set_smart_device_switched_on(
+                    smart_device_gui, bool_checkbutton_switched_on
+                )
             ),
         )
 
@@ -322,6 +500,7 @@ class Utilities:
     def create_spinbox_smart_plug_consumption_rate(
         frame: Frame,
         smart_plug_gui: SmartPlugGui,
+        smart_devices_state_manager: SmartDevicesStateManager,
         themes: Themes,
     ) -> tuple[StringVar, Spinbox]:
         smart_plug = smart_plug_gui.get_smart_device()
@@ -337,14 +516,18 @@ class Utilities:
             width=9,
             fg=themes.get_current().get_foreground(),
             bg=themes.get_current().get_background(),
-            command=lambda: smart_plug_gui.set_smart_plug_consumption_rate(
-                text_spinbox_consumption_rate
+            command=lambda: (
+                smart_devices_state_manager.set_smart_plug_consumption_rate(
+                    smart_plug_gui, text_spinbox_consumption_rate
+                )
             ),
         )
         spinbox_consumption_rate.bind(
             "<Return>",
-            lambda _: smart_plug_gui.set_smart_plug_consumption_rate_validate(
-                text_spinbox_consumption_rate
+            lambda _: (
+                smart_devices_state_manager.set_smart_plug_consumption_rate(
+                    smart_plug_gui, text_spinbox_consumption_rate
+                )
             ),
         )
 
@@ -380,11 +563,45 @@ class Utilities:
 
         return text_option_menu_cooking_mode, option_menu_cooking_mode
 
+    @staticmethod
+    def add_create_widgets_group(
+        frame: Frame,
+        group_name: str,
+        font_info: FontInfo,
+        themes: Themes,
+    ) -> tuple[StringVar, list[Frame | Label | Entry]]:
+        frame_group = Frame(frame)
+        frame_group.configure(bg=themes.get_current().get_background())
+
+        label_group = Label(
+            frame_group,
+            text="Group: ",
+            font=(font_info.get_family(), font_info.get_size_body()),
+            fg=themes.get_current().get_foreground(),
+            bg=themes.get_current().get_background(),
+        )
+
+        text_entry_group = StringVar(frame_group, group_name)
+        entry_group = Entry(
+            frame_group,
+            textvariable=text_entry_group,
+            width=11,
+            fg=themes.get_current().get_foreground(),
+            bg=themes.get_current().get_background(),
+        )
+
+        label_group.pack(side=LEFT, anchor=W)
+        entry_group.pack(side=RIGHT, anchor=E)
+        frame_group.pack(fill="both")
+
+        return text_entry_group, [frame_group, label_group, entry_group]
+
     # Add & edit create widgets methods
     @staticmethod
     def add_edit_create_widgets_smart_device(
         frame: Frame,
         smart_device_gui: SmartDeviceGui,
+        smart_devices_state_manager: SmartDevicesStateManager,
         font_info: FontInfo,
         themes: Themes,
     ) -> tuple[BooleanVar, list[Frame | Label | Checkbutton]]:
@@ -403,7 +620,10 @@ class Utilities:
             bool_checkbutton_switched_on,
             checkbutton_switched_on,
         ) = Utilities.create_checkbox_smart_device_switched_on(
-            frame_switched_on, smart_device_gui, themes
+            frame_switched_on,
+            smart_device_gui,
+            smart_devices_state_manager,
+            themes,
         )
 
         label_switched_on.pack(side=LEFT, anchor=W)
@@ -423,6 +643,7 @@ class Utilities:
     def add_edit_create_widgets_smart_plug(
         frame: Frame,
         smart_plug_gui: SmartPlugGui,
+        smart_devices_state_manager: SmartDevicesStateManager,
         font_info: FontInfo,
         themes: Themes,
     ) -> tuple[StringVar, list[Frame | Label | Spinbox]]:
@@ -443,7 +664,10 @@ class Utilities:
             text_spinbox_consumption_rate,
             spinbox_consumption_rate,
         ) = Utilities.create_spinbox_smart_plug_consumption_rate(
-            frame_consumption_rate, smart_plug_gui, themes
+            frame_consumption_rate,
+            smart_plug_gui,
+            smart_devices_state_manager,
+            themes,
         )
 
         label_consumption_rate.pack(side=LEFT, anchor=W)
@@ -498,8 +722,51 @@ class Utilities:
         )
 
 
+class FileTask:
+    # The worker thread only sets the progress, the Tk main loop polls it and
+    # is given the result, as Tk can only be used from the main thread
+    def __init__(
+        self: Self,
+        description: str,
+        run: Callable[[FILE_PROGRESS_TYPE, Event], Any],
+        on_done: Callable[[Any], None],
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        self.description: str = description
+        self.on_done: Callable[[Any], None] = on_done
+        self.cancelled: Event = Event()
+        # (done, total), replaced as a whole so it is never read half set
+        self.progress: tuple[int, int] = (0, 0)
+        self.future: Future[Any] = executor.submit(
+            run, self.set_progress, self.cancelled
+        )
+
+    def get_description(self: Self) -> str:
+        return self.description
+
+    def get_progress(self: Self) -> float:
+        # From 0 to 1
+        done, total = self.progress
+        if total == 0:
+            return 0.0
+        return min(done / total, 1.0)
+
+    def set_progress(self: Self, done: int, total: int) -> None:
+        self.progress = (done, total)
+
+    def cancel(self: Self) -> None:
+        self.cancelled.set()
+
+    def done(self: Self) -> bool:
+        return self.future.done()
+
+
 class SmartHomeSystem:
-    def __init__(self: Self, home: SmartHome) -> None:
+    def __init__(
+        self: Self,
+        home: SmartHome,
+        replication_follower: ReplicationFollower | None = None,
+    ) -> None:
         self.win: Tk = Tk()
         self.win.title("Smart Home System")
         self.win.resizable(False, False)
@@ -523,6 +790,29 @@ class SmartHomeSystem:
 
         self.images: Images = Images()
 
+        self.scheduler: Scheduler = Scheduler(home)
+
+        self.cook_programs: CookPrograms = CookPrograms(home)
+
+        # Keeps the home the same as the home of a primary, if given
+        self.replication_follower: ReplicationFollower | None = (
+            replication_follower
+        )
+
+        # Downloads and uploads run one at a time on a worker thread, with
+        # their progress shown in file_task_frame
+        self.file_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1
+        )
+        self.file_task: FileTask | None = None
+        self.file_task_frame: Frame | None = None
+        self.file_task_progressbar: ttk.Progressbar | None = None
+
+        # The smart devices whose widgets are still to be created, a chunk
+        # at a time when Tk is idle so that the window keeps responding
+        self.pending_smart_devices_gui: deque[SmartDeviceGui] = deque()
+        self.pending_widgets_id: str | None = None
+
         # To access the widgets and set the theme for them
         self.non_smart_device_buttons: List[Button] = []
 
@@ -539,8 +829,132 @@ class SmartHomeSystem:
 
     def run(self: Self) -> None:
         self.create_widgets()
+        self.run_scheduler()
+        self.run_cook_programs()
+        if self.replication_follower is not None:
+            self.replication_follower.start()
+            self.run_replication()
         self.win.mainloop()
 
+    def run_scheduler(self: Self) -> None:
+        self.scheduler.run_pending()
+        for _, error in self.scheduler.pop_errors():
+            print("Error:", error)
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
+
+        # Wake up when the next schedule is due
+        delay_ms = SCHEDULER_MAX_DELAY_MS
+        next_time = self.scheduler.get_next_time()
+        if next_time is not None:
+            delay_ms = int((next_time - self.scheduler.get_clock()()) * 1000)
+            delay_ms = max(0, min(delay_ms, SCHEDULER_MAX_DELAY_MS))
+        self.win.after(delay_ms, self.run_scheduler)
+
+    def run_cook_programs(self: Self) -> None:
+        self.cook_programs.pump()
+
+        # Only the air fryers with a cook program are shown, and the ones
+        # whose program has just ended are cleared
+        smart_devices_gui = (
+            self.smart_devices_state_manager.get_smart_devices_gui_by_id()
+        )
+        cook_programs = self.cook_programs.get_programs()
+        for device_id, cook_program in cook_programs.items():
+            smart_air_fryer_gui = smart_devices_gui.get(device_id)
+            if isinstance(smart_air_fryer_gui, SmartAirFryerGui):
+                smart_air_fryer_gui.set_cook_program(cook_program)
+        for device_id in self.cook_programs.pop_ended_device_ids():
+            smart_air_fryer_gui = smart_devices_gui.get(device_id)
+            if isinstance(smart_air_fryer_gui, SmartAirFryerGui):
+                smart_air_fryer_gui.set_cook_program(None)
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
+
+        # Wake up when the next step ends, a step that has ended wakes its
+        # program up on the next pump
+        delay_ms = COOK_PROGRAMS_MAX_DELAY_MS
+        next_time = self.cook_programs.get_next_time()
+        if next_time is not None:
+            delay_ms = max(0, min(int(next_time * 1000), delay_ms))
+        self.win.after(delay_ms, self.run_cook_programs)
+
+    def run_replication(self: Self) -> None:
+        if self.replication_follower is None:
+            return
+        try:
+            added_smart_devices, removed_smart_devices = (
+                self.replication_follower.apply_pending()
+            )
+        except ValueError as error:
+            print("Error:", error)
+        else:
+            for smart_device in removed_smart_devices:
+                self.smart_devices_state_manager.delete_smart_device_gui(
+                    smart_device.get_id()
+                )
+            for smart_device in added_smart_devices:
+                smart_device_gui = (
+                    self.smart_devices_state_manager.add_smart_device_gui(
+                        smart_device
+                    )
+                )
+                if smart_device_gui is not None:
+                    self.create_widgets_smart_devices([smart_device_gui])
+            # Only the smart devices changed by the primary are updated
+            self.smart_devices_state_manager.update_dirty_smart_devices_gui()
+        self.win.after(REPLICATION_POLL_MS, self.run_replication)
+
+    def start_file_task(
+        self: Self,
+        description: str,
+        run: Callable[[FILE_PROGRESS_TYPE, Event], Any],
+        on_done: Callable[[Any], None],
+    ) -> None:
+        if self.file_task is not None:
+            print("Error: a file is already being downloaded or uploaded.")
+            return
+        self.file_task = FileTask(
+            description, run, on_done, self.file_executor
+        )
+        self.create_widgets_file_task(self.file_task)
+        self.run_file_task()
+
+    def run_file_task(self: Self) -> None:
+        file_task = self.file_task
+        if file_task is None:
+            return
+        if not file_task.done():
+            if self.file_task_progressbar is not None:
+                self.file_task_progressbar["value"] = (
+                    file_task.get_progress() * 100
+                )
+            self.win.after(FILE_TASK_POLL_MS, self.run_file_task)
+            return
+
+        self.file_task = None
+        if self.file_task_frame is not None:
+            self.file_task_frame.destroy()
+            self.file_task_frame = None
+            self.file_task_progressbar = None
+        try:
+            result = file_task.future.result()
+        except FileCancelledError:
+            return
+        except Exception as error:
+            print("Error:", error)
+            return
+        file_task.on_done(result)
+
+    def button_cancel_file_task(self: Self) -> None:
+        if self.file_task is not None:
+            self.file_task.cancel()
+
+    # Get methods
+    def get_scheduler(self: Self) -> Scheduler:
+        return self.scheduler
+
+    def get_cook_programs(self: Self) -> CookPrograms:
+        return self.cook_programs
+
     # Set methods
     def set_theme(self: Self, theme_name: str) -> None:
         self.themes.set_current(theme_name)
@@ -560,6 +974,11 @@ class SmartHomeSystem:
             for widget in device.get_widgets():
                 self.set_widget_specific_theme(widget)
 
+        for widget in (
+            self.smart_devices_state_manager.get_group_sections_widgets()
+        ):
+            self.set_widget_specific_theme(widget)
+
     def set_widget_specific_theme(self: Self, widget: WIDGETS_TYPE) -> None:
         current_theme = self.themes.get_current()
         if isinstance(widget, Frame):
@@ -585,7 +1004,12 @@ class SmartHomeSystem:
 
     # Widget submit methods
     def button_toggle(self: Self, smart_device_gui: SmartDeviceGui) -> None:
-        smart_device_gui.toggle_smart_device()
+        try:
+            smart_device_gui.toggle_smart_device()
+        except Exception as error:
+            print("Error:", error)
+        # Devices shed to stay within the power budget
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
 
     def button_delete(self: Self, smart_device_gui: SmartDeviceGui) -> None:
         self.smart_devices_state_manager.delete_smart_device(smart_device_gui)
@@ -599,7 +1023,12 @@ class SmartHomeSystem:
 
     def button_edit(self: Self, smart_device_gui: SmartDeviceGui) -> None:
         smart_home_system_edit = SmartHomeSystemEdit(
-            self.win, self.font_info, self.themes, self.images
+            self.win,
+            self.smart_devices_state_manager,
+            self.cook_programs,
+            self.font_info,
+            self.themes,
+            self.images,
         )
         smart_home_system_edit.edit_create_widgets(smart_device_gui)
 
@@ -629,55 +1058,147 @@ class SmartHomeSystem:
         smart_home_system_accessibility.accessibility_create_widgets()
 
     def button_download(self: Self) -> None:
-        smart_device_file = SmartDeviceFile(self.home.get_devices())
-        smart_device_file.create_csv()
+        # The snapshot is taken now, so the devices are written as they are
+        # when the button is pressed
+        smart_device_file = SmartDeviceFile(self.home.snapshot())
+        self.start_file_task(
+            "Downloading...", smart_device_file.create_csv, lambda _: None
+        )
 
     def button_upload(self: Self) -> None:
         smart_device_file = SmartDeviceFile(self.home.get_devices())
         file = filedialog.askopenfile()
         if file is not None:
-            self.smart_devices_state_manager.delete_all_smart_devices()
-            smart_device_rows = smart_device_file.read_csv(file.name)
+            file_name = file.name
+            file.close()
+            self.start_file_task(
+                "Uploading...",
+                lambda progress, cancelled: (
+                    smart_device_file.read_smart_devices(
+                        file_name,
+                        progress,
+                        cancelled,
+                        # Invalid rows are skipped
+                        lambda error: print("Error:", error),
+                    )
+                ),
+                self.upload_smart_devices,
+            )
 
-            for smart_device_row in smart_device_rows:
-                device_type = smart_device_row[0]
-                if device_type == "smart_plug":
-                    switched_on = smart_device_row[1]
-                    consumption_rate = int(smart_device_row[2])
+    def upload_smart_devices(
+        self: Self, smart_devices: List[SmartDevice]
+    ) -> None:
+        # Called on the main thread once the file has been read
+        try:
+            smart_devices_gui = (
+                self.smart_devices_state_manager.replace_smart_devices(
+                    smart_devices
+                )
+            )
+        except ValueError as error:
+            print("Error:", error)
+            return
+        self.pending_smart_devices_gui.clear()
+        self.create_widgets_smart_devices(smart_devices_gui)
 
-                    smart_plug = SmartPlug(consumption_rate)
-                    if switched_on is True:
-                        smart_plug.toggle_switch()
+    # Create widgets methods
+    def create_widgets_smart_devices(
+        self: Self, smart_devices_gui: Iterable[SmartDeviceGui]
+    ) -> None:
+        self.pending_smart_devices_gui.extend(smart_devices_gui)
+        if self.pending_widgets_id is None and self.pending_smart_devices_gui:
+            self.pending_widgets_id = self.win.after_idle(
+                self.create_widgets_pending_smart_devices
+            )
 
-                    smart_plug_gui = SmartPlugGui(smart_plug)
+    def create_widgets_pending_smart_devices(self: Self) -> None:
+        smart_devices_gui = (
+            self.smart_devices_state_manager.get_smart_devices_gui_by_id()
+        )
+        for _ in range(
+            min(WIDGETS_CHUNK_SIZE, len(self.pending_smart_devices_gui))
+        ):
+            smart_device_gui = self.pending_smart_devices_gui.popleft()
+            # Deleted before its widgets were created
+            smart_device_id = smart_device_gui.get_smart_device().get_id()
+            if smart_devices_gui.get(smart_device_id) is not smart_device_gui:
+                continue
+            if isinstance(smart_device_gui, SmartPlugGui):
+                self.create_widgets_smart_plug(smart_device_gui)
+            elif isinstance(smart_device_gui, SmartAirFryerGui):
+                self.create_widgets_smart_air_fryer(smart_device_gui)
 
-                    self.smart_devices_state_manager.add_smart_device(
-                        smart_plug_gui
-                    )
-                elif device_type == "smart_air_fryer":
-                    switched_on = smart_device_row[1]
-                    cooking_mode = smart_device_row[2]
+        # The next chunk waits until the events that came in meanwhile
+        # have been handled
+        self.pending_widgets_id = None
+        if self.pending_smart_devices_gui:
+            self.pending_widgets_id = self.win.after_idle(
+                self.create_widgets_pending_smart_devices
+            )
 
-                    smart_air_fryer = SmartAirFryer()
-                    if switched_on is True:
-                        smart_air_fryer.toggle_switch()
-                    smart_air_fryer.set_cooking_mode(cooking_mode)
+    def create_widgets_file_task(self: Self, file_task: FileTask) -> None:
+        self.file_task_frame = Frame(self.main_frame)
+        self.file_task_frame.configure(
+            bg=self.themes.get_current().get_background()
+        )
 
-                    smart_air_fryer_gui = SmartAirFryerGui(smart_air_fryer)
+        label_file_task = Label(
+            self.file_task_frame,
+            text=file_task.get_description(),
+            font=(self.font_info.get_family(), self.font_info.get_size_body()),
+            fg=self.themes.get_current().get_foreground(),
+            bg=self.themes.get_current().get_background(),
+        )
 
-                    self.smart_devices_state_manager.add_smart_device(
-                        smart_air_fryer_gui
-                    )
+        self.file_task_progressbar = ttk.Progressbar(
+            self.file_task_frame, mode="determinate", maximum=100
+        )
 
-            for (
-                smart_device_gui
-            ) in self.smart_devices_state_manager.get_smart_devices_gui():
-                if isinstance(smart_device_gui, SmartPlugGui):
-                    self.create_widgets_smart_plug(smart_device_gui)
-                elif isinstance(smart_device_gui, SmartAirFryerGui):
-                    self.create_widgets_smart_air_fryer(smart_device_gui)
+        button_cancel = Button(
+            self.file_task_frame,
+            text="Cancel",
+            command=self.button_cancel_file_task,
+        )
+        self.themes.get_current().configure_widget_theme(button_cancel)
+
+        label_file_task.pack(side=LEFT)
+        self.file_task_progressbar.pack(side=LEFT, padx=(5, 5))
+        button_cancel.pack(side=RIGHT)
+        self.file_task_frame.pack(fill="both", after=self.button_top_frame)
+
+    def create_widgets_group_section(
+        self: Self, group_name: str | None
+    ) -> Frame:
+        group_section = self.smart_devices_state_manager.get_group_section(
+            group_name
+        )
+        if group_section is not None:
+            return group_section[0]
+
+        group_frame: Frame = Frame(self.smart_devices_frame)
+        group_frame.configure(bg=self.themes.get_current().get_background())
+        group_frame.pack(fill="both")
+        widgets: List[WIDGETS_TYPE] = [group_frame]
+
+        if group_name is not None:
+            label_group_title: Label = Label(
+                group_frame,
+                text=group_name,
+                font=(
+                    self.font_info.get_family(),
+                    self.font_info.get_size_title(),
+                    "bold",
+                    "underline",
+                ),
+                fg=self.themes.get_current().get_foreground(),
+                bg=self.themes.get_current().get_background(),
+            )
+            label_group_title.pack(anchor=W, pady=(5, 0))
+            widgets.append(label_group_title)
+
+        self.smart_devices_state_manager.add_group_section(group_name, widgets)
+        return group_frame
 
-    # Create widgets methods
     def create_widgets_buttons_smart_device(
         self: Self, frame: Frame, smart_device_gui: SmartDeviceGui
     ) -> tuple[Button, Button, Button]:
@@ -723,7 +1244,12 @@ class SmartHomeSystem:
         smart_device_image: PhotoImage,
         smart_device_text_title: str,
     ) -> None:
-        smart_device_frame: Frame = Frame(self.smart_devices_frame)
+        group_frame = self.create_widgets_group_section(
+            self.smart_devices_state_manager.get_smart_device_group(
+                smart_device_gui
+            )
+        )
+        smart_device_frame: Frame = Frame(group_frame)
         smart_device_frame.configure(
             background=self.themes.get_current().get_background()
         )
@@ -756,7 +1282,10 @@ class SmartHomeSystem:
             bool_checkbutton_switched_on,
             checkbutton_switched_on,
         ) = Utilities.create_checkbox_smart_device_switched_on(
-            smart_device_frame, smart_device_gui, self.themes
+            smart_device_frame,
+            smart_device_gui,
+            self.smart_devices_state_manager,
+            self.themes,
         )
         smart_device_gui.set_bool_var(bool_checkbutton_switched_on)
 
@@ -781,7 +1310,10 @@ class SmartHomeSystem:
                 text_spinbox_consumption_rate,
                 spinbox_consumption_rate,
             ) = Utilities.create_spinbox_smart_plug_consumption_rate(
-                smart_device_frame, smart_device_gui, self.themes
+                smart_device_frame,
+                smart_device_gui,
+                self.smart_devices_state_manager,
+                self.themes,
             )
             smart_device_gui.set_string_var(text_spinbox_consumption_rate)
             label_smart_plug_consumption_rate.pack(side=LEFT, anchor=W)
@@ -815,8 +1347,26 @@ class SmartHomeSystem:
                 anchor=W,
             )
             option_menu_cooking_mode.pack(side=LEFT, anchor=W)
+
+            text_cook_program = StringVar(smart_device_frame, "")
+            smart_device_gui.set_cook_program_var(text_cook_program)
+            label_smart_air_fryer_cook_program = Label(
+                smart_device_frame,
+                textvariable=text_cook_program,
+                font=(
+                    self.font_info.get_family(),
+                    self.font_info.get_size_body(),
+                ),
+                fg=self.themes.get_current().get_foreground(),
+                bg=self.themes.get_current().get_background(),
+            )
+            label_smart_air_fryer_cook_program.pack(side=LEFT, anchor=W)
             smart_device_gui.add_widgets(
-                [label_smart_air_fryer_cooking_mode, option_menu_cooking_mode]
+                [
+                    label_smart_air_fryer_cooking_mode,
+                    option_menu_cooking_mode,
+                    label_smart_air_fryer_cook_program,
+                ]
             )
 
         (
@@ -910,6 +1460,8 @@ class SmartHomeSystem:
         button_upload.pack(side=RIGHT, padx=(5, 0))
         self.button_top_frame.pack(fill="both")
 
+        # Devices without a group are shown first
+        self.create_widgets_group_section(None)
         for (
             smart_device_gui
         ) in self.smart_devices_state_manager.get_smart_devices_gui():
@@ -926,10 +1478,16 @@ class SmartHomeSystemEdit(SmartHomeSystem):
     def __init__(
         self: Self,
         win: Tk,
+        smart_devices_state_manager: SmartDevicesStateManager,
+        cook_programs: CookPrograms,
         font_info: FontInfo,
         themes: Themes,
         images: Images,
     ) -> None:
+        self.smart_devices_state_manager: SmartDevicesStateManager = (
+            smart_devices_state_manager
+        )
+        self.cook_programs: CookPrograms = cook_programs
         self.edit_window: Toplevel = Toplevel(win)
         self.edit_window.title("Edit")
         self.edit_window.resizable(False, False)
@@ -960,9 +1518,11 @@ class SmartHomeSystemEdit(SmartHomeSystem):
                 bool_checkbutton_switched_on,
                 text_spinbox_consumption_rate,
             )
-            smart_plug_gui.update_smart_device()
         except Exception as error:
             print("Error:", error)
+        smart_plug_gui.update_smart_device()
+        # Devices shed to stay within the power budget
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
 
     def edit_button_submit_smart_air_fryer(
         self: Self,
@@ -970,11 +1530,39 @@ class SmartHomeSystemEdit(SmartHomeSystem):
         bool_checkbutton_switched_on: BooleanVar,
         text_option_menu_cooking_mode: StringVar,
     ) -> None:
-        smart_air_fryer_gui.set_smart_air_fryer(
-            bool_checkbutton_switched_on,
-            text_option_menu_cooking_mode,
-        )
+        try:
+            smart_air_fryer_gui.set_smart_air_fryer(
+                bool_checkbutton_switched_on,
+                text_option_menu_cooking_mode,
+            )
+        except Exception as error:
+            print("Error:", error)
         smart_air_fryer_gui.update_smart_device()
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
+
+    def edit_button_cook_program(
+        self: Self,
+        smart_air_fryer_gui: SmartAirFryerGui,
+        action: Callable[[int], object],
+    ) -> None:
+        # action is given the air fryer id, and starts, pauses, resumes or
+        # cancels its cook program
+        smart_air_fryer_id = smart_air_fryer_gui.get_smart_device().get_id()
+        try:
+            action(smart_air_fryer_id)
+        except Exception as error:
+            print("Error:", error)
+        # Lets a new program switch the air fryer on straight away
+        self.cook_programs.pump()
+
+        cook_program = self.cook_programs.get_program(smart_air_fryer_id)
+        if cook_program is not None and cook_program.get_state() not in (
+            CookProgramStates.RUNNING,
+            CookProgramStates.PAUSED,
+        ):
+            cook_program = None
+        smart_air_fryer_gui.set_cook_program(cook_program)
+        self.smart_devices_state_manager.update_dirty_smart_devices_gui()
 
     # Edit create widgets methods
     def edit_create_widgets_smart_plug(
@@ -987,6 +1575,7 @@ class SmartHomeSystemEdit(SmartHomeSystem):
             Utilities.add_edit_create_widgets_smart_plug(
                 self.edit_window_frame,
                 smart_plug_gui,
+                self.smart_devices_state_manager,
                 self.font_info,
                 self.themes,
             )[0]
@@ -1018,6 +1607,7 @@ class SmartHomeSystemEdit(SmartHomeSystem):
                 self.themes,
             )
         )[0]
+        self.edit_create_widgets_cook_program(smart_air_fryer_gui)
         edit_button_submit = Button(
             self.edit_window_frame,
             image=self.images.get_submit_button_image(),
@@ -1032,6 +1622,59 @@ class SmartHomeSystemEdit(SmartHomeSystem):
 
         edit_button_submit.pack(side=LEFT, anchor=W)
 
+    def edit_create_widgets_cook_program(
+        self: Self, smart_air_fryer_gui: SmartAirFryerGui
+    ) -> None:
+        frame_cook_program = Frame(self.edit_window_frame)
+        frame_cook_program.configure(
+            bg=self.themes.get_current().get_background()
+        )
+
+        label_cook_program = Label(
+            frame_cook_program,
+            text="Cook program: ",
+            font=(self.font_info.get_family(), self.font_info.get_size_body()),
+            fg=self.themes.get_current().get_foreground(),
+            bg=self.themes.get_current().get_background(),
+        )
+        text_entry_cook_steps = StringVar(frame_cook_program, "Defrost 10")
+        entry_cook_steps = Entry(
+            frame_cook_program,
+            textvariable=text_entry_cook_steps,
+            width=16,
+            fg=self.themes.get_current().get_foreground(),
+            bg=self.themes.get_current().get_background(),
+        )
+        label_cook_program.pack(side=LEFT, anchor=W)
+        entry_cook_steps.pack(side=RIGHT, anchor=E)
+        frame_cook_program.pack(fill="both")
+
+        frame_cook_program_buttons = Frame(self.edit_window_frame)
+        frame_cook_program_buttons.configure(
+            bg=self.themes.get_current().get_background()
+        )
+        actions: Dict[str, Callable[[int], object]] = {
+            "Start": lambda smart_air_fryer_id: self.cook_programs.start(
+                smart_air_fryer_id, get_cook_steps(text_entry_cook_steps.get())
+            ),
+            "Pause": self.cook_programs.pause,
+            "Resume": self.cook_programs.resume,
+            "Cancel": self.cook_programs.cancel,
+        }
+        for text, action in actions.items():
+            button_cook_program = Button(
+                frame_cook_program_buttons,
+                text=text,
+                command=lambda action=action: self.edit_button_cook_program(
+                    smart_air_fryer_gui, action
+                ),
+            )
+            self.themes.get_current().configure_widget_theme(
+                button_cook_program
+            )
+            button_cook_program.pack(side=LEFT, anchor=W)
+        frame_cook_program_buttons.pack(fill="both")
+
     def edit_create_widgets(
         self: Self, smart_device_gui: SmartDeviceGui
     ) -> None:
@@ -1039,6 +1682,7 @@ class SmartHomeSystemEdit(SmartHomeSystem):
             Utilities.add_edit_create_widgets_smart_device(
                 self.edit_window_frame,
                 smart_device_gui,
+                self.smart_devices_state_manager,
                 self.font_info,
                 self.themes,
             )[0]
@@ -1092,6 +1736,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
             "smart_plug_consumption_rate": 150,
             "smart_air_fryer_switched_on": False,
             "smart_air_fryer_cooking_mode": CookingModes.HEALTHY.value,
+            "group": "",
         }
 
         self.widgets = []
@@ -1132,6 +1777,18 @@ class SmartHomeSystemAdd(SmartHomeSystem):
             text_option_menu_cooking_mode.get()
         )
 
+    def add_smart_device_to_group(
+        self: Self,
+        smart_device_gui: SmartDeviceGui,
+        text_entry_group: StringVar,
+    ) -> None:
+        group_name = text_entry_group.get().strip()
+        if group_name != "":
+            self.smart_devices_state_manager.add_smart_device_to_group(
+                group_name, smart_device_gui
+            )
+        self.smart_device_states["group"] = group_name
+
     # Add widget submit methods
     def add_option_menu_submit(
         self: Self, selected_smart_device: StringVar | str
@@ -1161,6 +1818,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
         smart_plug_gui: SmartPlugGui,
         bool_checkbutton_switched_on: BooleanVar,
         text_spinbox_consumption_rate: StringVar,
+        text_entry_group: StringVar,
     ) -> None:
         try:
             smart_plug_gui.set_smart_plug(
@@ -1168,6 +1826,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
                 text_spinbox_consumption_rate,
             )
             self.smart_devices_state_manager.add_smart_device(smart_plug_gui)
+            self.add_smart_device_to_group(smart_plug_gui, text_entry_group)
             self.create_widgets_smart_plug(smart_plug_gui)
 
             # Save the options of the last selected smart device
@@ -1191,12 +1850,14 @@ class SmartHomeSystemAdd(SmartHomeSystem):
         smart_air_fryer_gui: SmartAirFryerGui,
         bool_checkbutton_switched_on: BooleanVar,
         text_option_menu_cooking_mode: StringVar,
+        text_entry_group: StringVar,
     ) -> None:
         smart_air_fryer_gui.set_smart_air_fryer(
             bool_checkbutton_switched_on,
             text_option_menu_cooking_mode,
         )
         self.smart_devices_state_manager.add_smart_device(smart_air_fryer_gui)
+        self.add_smart_device_to_group(smart_air_fryer_gui, text_entry_group)
         self.create_widgets_smart_air_fryer(smart_air_fryer_gui)
         # Save the options of the last selected smart device
         self.set_selected_smart_air_fryer(
@@ -1237,6 +1898,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
         ) = Utilities.add_edit_create_widgets_smart_device(
             self.add_window_frame,
             smart_plug_gui,
+            self.smart_devices_state_manager,
             self.font_info,
             self.themes,
         )
@@ -1246,9 +1908,18 @@ class SmartHomeSystemAdd(SmartHomeSystem):
         ) = Utilities.add_edit_create_widgets_smart_plug(
             self.add_window_frame,
             smart_plug_gui,
+            self.smart_devices_state_manager,
             self.font_info,
             self.themes,
         )
+        text_entry_group, gui_objects_group = (
+            Utilities.add_create_widgets_group(
+                self.add_window_frame,
+                str(self.smart_device_states["group"]),
+                self.font_info,
+                self.themes,
+            )
+        )
 
         button_add_submit_smart_plug = Button(
             self.add_window_frame,
@@ -1257,6 +1928,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
                 smart_plug_gui,
                 text_option_menu_switched_on,
                 text_spinbox_consumption_rate,
+                text_entry_group,
             ),
         )
         self.themes.get_current().configure_widget_theme(
@@ -1268,6 +1940,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
             [
                 *gui_objects_smart_device,
                 *gui_objects_smart_plug,
+                *gui_objects_group,
                 button_add_submit_smart_plug,
             ]
         )
@@ -1293,6 +1966,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
         ) = Utilities.add_edit_create_widgets_smart_device(
             self.add_window_frame,
             smart_air_fryer_gui,
+            self.smart_devices_state_manager,
             self.font_info,
             self.themes,
         )
@@ -1306,6 +1980,14 @@ class SmartHomeSystemAdd(SmartHomeSystem):
             self.font_info,
             self.themes,
         )
+        text_entry_group, gui_objects_group = (
+            Utilities.add_create_widgets_group(
+                self.add_window_frame,
+                str(self.smart_device_states["group"]),
+                self.font_info,
+                self.themes,
+            )
+        )
 
         button_add_submit_smart_air_fryer = Button(
             self.add_window_frame,
@@ -1315,6 +1997,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
                 smart_air_fryer_gui,
                 text_option_menu_switched_on,
                 text_option_menu_cooking_mode,
+                text_entry_group,
             ),
         )
         self.themes.get_current().configure_widget_theme(
@@ -1326,6 +2009,7 @@ class SmartHomeSystemAdd(SmartHomeSystem):
             [
                 *gui_objects_smart_device,
                 *gui_objects_smart_air_fryer,
+                *gui_objects_group,
                 button_add_submit_smart_air_fryer,
             ]
         )
@@ -1444,6 +2128,18 @@ class SmartHomeSystemAccessibility(SmartHomeSystem):
                             widget.config(
                                 font=(self.font_info.get_family(), font_size)
                             )
+            for (
+                widget
+            ) in self.smart_devices_state_manager.get_group_sections_widgets():
+                if isinstance(widget, Label):
+                    widget.config(
+                        font=(
+                            self.font_info.get_family(),
+                            font_size + 2,
+                            "bold",
+                            "underline",
+                        )
+                    )
         else:
             print(
                 f"Error: font size must be >= {self.minimum_font_size} \
@@ -1641,9 +2337,44 @@ and <= {self.maximum_font_size}"
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Smart home controls.")
+    parser.add_argument("--host", default="127.0.0.1")
+    replication_group = parser.add_mutually_exclusive_group()
+    replication_group.add_argument(
+        "--replicate",
+        type=int,
+        metavar="PORT",
+        help="send the changes of this home to followers on this port",
+    )
+    replication_group.add_argument(
+        "--follow",
+        type=int,
+        metavar="PORT",
+        help="show the home of the primary on this port",
+    )
+    args = parser.parse_args()
+
+    if args.follow is not None:
+        # The devices come from the primary
+        home = SmartHome()
+        replication_follower = ReplicationFollower(
+            home, args.host, args.follow
+        )
+        smart_home_system = SmartHomeSystem(home, replication_follower)
+        smart_home_system.run()
+        replication_follower.close()
+        return
+
     home = set_up_home()
+    replication_primary: ReplicationPrimary | None = None
+    if args.replicate is not None:
+        replication_primary = ReplicationPrimary(home)
+        replication_primary.start(args.host, args.replicate)
     smart_home_system = SmartHomeSystem(home)
     smart_home_system.run()
+    if replication_primary is not None:
+        replication_primary.close()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,32 @@
 import csv
-from tkinter import Button, Checkbutton, OptionMenu, PhotoImage
-from typing import List, Self
-
-from backend import SmartAirFryer, SmartDevice, SmartPlug
+import mmap
+import os
+import struct
+from threading import Event
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Self,
+)
+
+from backend import (
+    COOKING_MODE_CODES,
+    COOKING_MODE_VALUES,
+    DeviceTypeCodes,
+    HomeSnapshot,
+    SmartAirFryer,
+    SmartDevice,
+    SmartPlug,
+)
+
+# tkinter is only imported once an image is loaded, so that SmartDeviceFile
+# can be used without it
+if TYPE_CHECKING:
+    from tkinter import Button, Checkbutton, OptionMenu, PhotoImage
 
 
 class Theme:
@@ -23,7 +47,7 @@ class Theme:
         return self.activebackground
 
     def configure_widget_theme(
-        self: Self, widget: Checkbutton | Button
+        self: Self, widget: "Checkbutton | Button"
     ) -> None:
         widget.configure(
             fg=self.foreground,
@@ -33,7 +57,7 @@ class Theme:
         )
 
     def configure_options_menu_theme(
-        self: Self, option_menu: OptionMenu
+        self: Self, option_menu: "OptionMenu"
     ) -> None:
         option_menu.configure(
             fg=self.foreground,
@@ -88,67 +112,69 @@ class Themes:
 class Images:
     def __init__(self: Self) -> None:
         theme_dir = "./images/"
-        self.images = {
-            "smart_plug_image": PhotoImage(file=f"{theme_dir}plug.png"),
-            "smart_air_fryer_image": PhotoImage(file=f"{theme_dir}pot.png"),
-            "toggle_button_image": PhotoImage(file=f"{theme_dir}toggle.png"),
-            "edit_button_image": PhotoImage(file=f"{theme_dir}edit.png"),
-            "delete_button_image": PhotoImage(file=f"{theme_dir}delete.png"),
-            "add_button_image": PhotoImage(file=f"{theme_dir}add.png"),
-            "accessibility_button_image": PhotoImage(
-                file=f"{theme_dir}settings.png"
-            ),
-            "submit_button_image": PhotoImage(file=f"{theme_dir}check.png"),
-            "toggle_all_button_off": PhotoImage(
-                file=f"{theme_dir}toggle-off.png"
-            ),
-            "toggle_all_button_on": PhotoImage(
-                file=f"{theme_dir}toggle-on.png"
-            ),
-            "download_button_image": PhotoImage(
-                file=f"{theme_dir}download.png"
-            ),
-            "upload_button_image": PhotoImage(file=f"{theme_dir}upload.png"),
+        self.image_files = {
+            "smart_plug_image": f"{theme_dir}plug.png",
+            "smart_air_fryer_image": f"{theme_dir}pot.png",
+            "toggle_button_image": f"{theme_dir}toggle.png",
+            "edit_button_image": f"{theme_dir}edit.png",
+            "delete_button_image": f"{theme_dir}delete.png",
+            "add_button_image": f"{theme_dir}add.png",
+            "accessibility_button_image": f"{theme_dir}settings.png",
+            "submit_button_image": f"{theme_dir}check.png",
+            "toggle_all_button_off": f"{theme_dir}toggle-off.png",
+            "toggle_all_button_on": f"{theme_dir}toggle-on.png",
+            "download_button_image": f"{theme_dir}download.png",
+            "upload_button_image": f"{theme_dir}upload.png",
         }
+        # Each image is loaded the first time it is used, which has to be
+        # after the Tk window is created
+        self.images: Dict[str, "PhotoImage"] = {}
+
+    def get_image(self: Self, image_name: str) -> "PhotoImage":
+        image = self.images.get(image_name)
+        if image is None:
+            from tkinter import PhotoImage
 
-        for image in self.images:
-            self.images[image] = self.images[image].subsample(8, 8)
+            image = PhotoImage(file=self.image_files[image_name])
+            image = image.subsample(8, 8)
+            self.images[image_name] = image
+        return image
 
-    def get_smart_plug_image(self: Self) -> PhotoImage:
-        return self.images["smart_plug_image"]
+    def get_smart_plug_image(self: Self) -> "PhotoImage":
+        return self.get_image("smart_plug_image")
 
-    def get_smart_air_fryer_image(self: Self) -> PhotoImage:
-        return self.images["smart_air_fryer_image"]
+    def get_smart_air_fryer_image(self: Self) -> "PhotoImage":
+        return self.get_image("smart_air_fryer_image")
 
-    def get_toggle_button_image(self: Self) -> PhotoImage:
-        return self.images["toggle_button_image"]
+    def get_toggle_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("toggle_button_image")
 
-    def get_edit_button_image(self: Self) -> PhotoImage:
-        return self.images["edit_button_image"]
+    def get_edit_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("edit_button_image")
 
-    def get_delete_button_image(self: Self) -> PhotoImage:
-        return self.images["delete_button_image"]
+    def get_delete_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("delete_button_image")
 
-    def get_add_button_image(self: Self) -> PhotoImage:
-        return self.images["add_button_image"]
+    def get_add_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("add_button_image")
 
-    def get_accessibility_button_image(self: Self) -> PhotoImage:
-        return self.images["accessibility_button_image"]
+    def get_accessibility_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("accessibility_button_image")
 
-    def get_submit_button_image(self: Self) -> PhotoImage:
-        return self.images["submit_button_image"]
+    def get_submit_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("submit_button_image")
 
-    def get_toggle_all_button_off(self: Self) -> PhotoImage:
-        return self.images["toggle_all_button_off"]
+    def get_toggle_all_button_off(self: Self) -> "PhotoImage":
+        return self.get_image("toggle_all_button_off")
 
-    def get_toggle_all_button_on(self: Self) -> PhotoImage:
-        return self.images["toggle_all_button_on"]
+    def get_toggle_all_button_on(self: Self) -> "PhotoImage":
+        return self.get_image("toggle_all_button_on")
 
-    def get_download_button_image(self: Self) -> PhotoImage:
-        return self.images["download_button_image"]
+    def get_download_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("download_button_image")
 
-    def get_upload_button_image(self: Self) -> PhotoImage:
-        return self.images["upload_button_image"]
+    def get_upload_button_image(self: Self) -> "PhotoImage":
+        return self.get_image("upload_button_image")
 
 
 class FontInfo:
@@ -171,40 +197,486 @@ class FontInfo:
         return self.family
 
 
+# Called with the work done so far and the total, in rows when writing
+# and in characters when reading
+FILE_PROGRESS_TYPE = Callable[[int, int], None]
+
+# How many rows are read or written between progress reports
+FILE_PROGRESS_ROWS = 1000
+
+
+# Raised by SmartDeviceFile when reading or writing is cancelled
+class FileCancelledError(Exception):
+    pass
+
+
+class FileRowError(ValueError):
+    # A row that could not be read, it is skipped and the rest of the file is
+    # still read
+    def __init__(
+        self: Self, line_number: int, message: str, unit: str = "line"
+    ) -> None:
+        # unit is record for a binary file, which has no lines
+        super().__init__(f"{unit} {line_number}: {message}")
+        self.line_number: int = line_number
+        self.message: str = message
+
+    def get_line_number(self: Self) -> int:
+        return self.line_number
+
+    def get_message(self: Self) -> str:
+        return self.message
+
+
+# Called with each row that is skipped
+FILE_ROW_ERROR_TYPE = Callable[[FileRowError], None]
+
+
+class SmartDeviceRecord:
+    # One validated row, with the line it ended on (or its record number in a
+    # binary file)
+    __slots__ = ("device_type", "line_number", "switched_on", "value")
+
+    def __init__(
+        self: Self,
+        line_number: int,
+        device_type: str,
+        switched_on: bool,
+        value: int | str,
+    ) -> None:
+        self.line_number: int = line_number
+        # smart_plug or smart_air_fryer
+        self.device_type: str = device_type
+        self.switched_on: bool = switched_on
+        # The consumption rate of a smart plug or the cooking mode of a
+        # smart air fryer
+        self.value: int | str = value
+
+    def get_line_number(self: Self) -> int:
+        return self.line_number
+
+    def get_device_type(self: Self) -> str:
+        return self.device_type
+
+    def get_switched_on(self: Self) -> bool:
+        return self.switched_on
+
+    def get_value(self: Self) -> int | str:
+        return self.value
+
+    def create_smart_device(self: Self) -> SmartDevice:
+        # The record is already validated and the device is not in a home
+        # yet, so its state is written directly
+        smart_device: SmartDevice
+        if isinstance(self.value, int):
+            smart_device = SmartPlug(self.value)
+        else:
+            smart_device = SmartAirFryer()
+            smart_device.write_cooking_mode_code(
+                COOKING_MODE_CODES[self.value]
+            )
+        if self.switched_on:
+            smart_device.flip_switch()
+        return smart_device
+
+
+def read_smart_device_record(
+    line_number: int, row: List[str]
+) -> SmartDeviceRecord:
+    # Raises FileRowError if the row is not a valid device
+    if len(row) != 3:
+        raise FileRowError(line_number, "invalid row (3 fields).")
+    device_type, switched_on, value = row
+    if switched_on not in ("True", "False"):
+        raise FileRowError(line_number, "invalid switched on (True or False).")
+    if device_type == "smart_plug":
+        try:
+            consumption_rate = int(value)
+        except ValueError:
+            consumption_rate = -1
+        if consumption_rate < 0 or consumption_rate > 150:
+            raise FileRowError(line_number, SmartPlug.error_message)
+        return SmartDeviceRecord(
+            line_number, device_type, switched_on == "True", consumption_rate
+        )
+    if device_type == "smart_air_fryer":
+        if value not in COOKING_MODE_CODES:
+            raise FileRowError(line_number, "invalid cooking mode.")
+        return SmartDeviceRecord(
+            line_number, device_type, switched_on == "True", value
+        )
+    raise FileRowError(line_number, "invalid device type.")
+
+
+# A binary file is a header then a fixed size record for each device, so
+# that any device can be read without reading the devices before it
+BINARY_MAGIC = b"SHD1"
+# (magic, number of records)
+BINARY_HEADER_STRUCT = struct.Struct("<4sI")
+# (device type code, switched on, consumption rate or cooking mode code)
+BINARY_RECORD_STRUCT = struct.Struct("<B?H")
+
+# How many records are decoded at once when a binary file is read in order
+BINARY_CHUNK_RECORDS = 65_536
+
+
+def pack_smart_device_record(smart_device_record: SmartDeviceRecord) -> bytes:
+    value = smart_device_record.get_value()
+    if isinstance(value, str):
+        return BINARY_RECORD_STRUCT.pack(
+            DeviceTypeCodes.SMART_AIR_FRYER.value,
+            smart_device_record.get_switched_on(),
+            COOKING_MODE_CODES[value],
+        )
+    return BINARY_RECORD_STRUCT.pack(
+        DeviceTypeCodes.SMART_PLUG.value,
+        smart_device_record.get_switched_on(),
+        value,
+    )
+
+
+def unpack_smart_device_record(
+    record_number: int, device_type_code: int, switched_on: bool, value: int
+) -> SmartDeviceRecord:
+    # Raises FileRowError if the record is not a valid device
+    if device_type_code == DeviceTypeCodes.SMART_PLUG.value:
+        if value > 150:
+            raise FileRowError(
+                record_number, SmartPlug.error_message, "record"
+            )
+        return SmartDeviceRecord(
+            record_number, "smart_plug", switched_on, value
+        )
+    if device_type_code == DeviceTypeCodes.SMART_AIR_FRYER.value:
+        if value >= len(COOKING_MODE_VALUES):
+            raise FileRowError(
+                record_number, "invalid cooking mode.", "record"
+            )
+        return SmartDeviceRecord(
+            record_number,
+            "smart_air_fryer",
+            switched_on,
+            COOKING_MODE_VALUES[value],
+        )
+    raise FileRowError(record_number, "invalid device type.", "record")
+
+
+def write_binary(
+    file: str,
+    smart_device_records: Iterable[SmartDeviceRecord],
+    progress: FILE_PROGRESS_TYPE | None = None,
+    cancelled: Event | None = None,
+    total: int = 0,
+) -> None:
+    # Written to a temporary file first, the number of records is only
+    # known once they have all been written, so the header is written last
+    with open(f"{file}.tmp", mode="wb") as binary_file:
+        binary_file.write(BINARY_HEADER_STRUCT.pack(BINARY_MAGIC, 0))
+        record_count = 0
+        chunk: List[bytes] = []
+        for smart_device_record in smart_device_records:
+            if cancelled is not None and cancelled.is_set():
+                break
+            if progress is not None and record_count % FILE_PROGRESS_ROWS == 0:
+                progress(record_count, total)
+            chunk.append(pack_smart_device_record(smart_device_record))
+            record_count += 1
+            if len(chunk) == BINARY_CHUNK_RECORDS:
+                binary_file.write(b"".join(chunk))
+                chunk = []
+        binary_file.write(b"".join(chunk))
+        binary_file.seek(0)
+        binary_file.write(
+            BINARY_HEADER_STRUCT.pack(BINARY_MAGIC, record_count)
+        )
+    if cancelled is not None and cancelled.is_set():
+        os.remove(f"{file}.tmp")
+        raise FileCancelledError("download cancelled.")
+    os.replace(f"{file}.tmp", file)
+    if progress is not None:
+        progress(record_count, record_count)
+
+
+class MappedSmartDeviceFile:
+    # Opening only reads the header, a record is only read and decoded when it
+    # is asked for, so pages that are never read are never loaded
+    def __init__(self: Self, file: str) -> None:
+        with open(file, mode="rb") as binary_file:
+            size = os.fstat(binary_file.fileno()).st_size
+            if size < BINARY_HEADER_STRUCT.size:
+                raise ValueError("invalid binary file.")
+            self.mapped: mmap.mmap = mmap.mmap(
+                binary_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, self.record_count = BINARY_HEADER_STRUCT.unpack_from(
+            self.mapped
+        )
+        if magic != BINARY_MAGIC or size != (
+            BINARY_HEADER_STRUCT.size
+            + self.record_count * BINARY_RECORD_STRUCT.size
+        ):
+            self.mapped.close()
+            raise ValueError("invalid binary file.")
+
+    def __len__(self: Self) -> int:
+        return self.record_count
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *args: object) -> None:
+        self.close()
+
+    def close(self: Self) -> None:
+        self.mapped.close()
+
+    def get_record(self: Self, index: int) -> SmartDeviceRecord:
+        # Raises FileRowError if the record is not a valid device
+        if index < 0 or index >= self.record_count:
+            raise IndexError("invalid record index.")
+        return unpack_smart_device_record(
+            index + 1,
+            *BINARY_RECORD_STRUCT.unpack_from(
+                self.mapped,
+                BINARY_HEADER_STRUCT.size + index * BINARY_RECORD_STRUCT.size,
+            ),
+        )
+
+    def get_smart_device(self: Self, index: int) -> SmartDevice:
+        return self.get_record(index).create_smart_device()
+
+    def get_records(
+        self: Self,
+        progress: FILE_PROGRESS_TYPE | None = None,
+        cancelled: Event | None = None,
+        row_error: FILE_ROW_ERROR_TYPE | None = None,
+    ) -> Iterator[SmartDeviceRecord]:
+        # Yields the records in order, decoding a chunk at a time
+        smart_plug_code = DeviceTypeCodes.SMART_PLUG.value
+        record_number = 0
+        for start in range(0, self.record_count, BINARY_CHUNK_RECORDS):
+            if cancelled is not None and cancelled.is_set():
+                raise FileCancelledError("upload cancelled.")
+            if progress is not None:
+                progress(start, self.record_count)
+            end = min(start + BINARY_CHUNK_RECORDS, self.record_count)
+            for fields in BINARY_RECORD_STRUCT.iter_unpack(
+                self.mapped[
+                    BINARY_HEADER_STRUCT.size
+                    + start * BINARY_RECORD_STRUCT.size : (
+                        BINARY_HEADER_STRUCT.size
+                        + end * BINARY_RECORD_STRUCT.size
+                    )
+                ]
+            ):
+                record_number += 1
+                # Most records are valid smart plugs, which are checked here
+                # instead of by a call for every record
+                device_type_code, switched_on, value = fields
+                if device_type_code == smart_plug_code and value <= 150:
+                    yield SmartDeviceRecord(
+                        record_number, "smart_plug", switched_on, value
+                    )
+                    continue
+                try:
+                    yield unpack_smart_device_record(record_number, *fields)
+                except FileRowError as error:
+                    if row_error is not None:
+                        row_error(error)
+        if progress is not None:
+            progress(self.record_count, self.record_count)
+
+
 class SmartDeviceFile:
-    def __init__(self: Self, smart_devices: List[SmartDevice]) -> None:
-        self.smart_devices: List[SmartDevice] = smart_devices
+    # A HomeSnapshot can be used to write the devices as they were at one
+    # point in time, even if the home is changed while they are written
+    def __init__(
+        self: Self, smart_devices: List[SmartDevice] | HomeSnapshot
+    ) -> None:
+        self.smart_devices: List[SmartDevice] | HomeSnapshot = smart_devices
 
-    def create_csv(self: Self) -> None:
-        with open("storage.csv", mode="w") as smart_devices:
+    def get_smart_device_states(
+        self: Self,
+    ) -> Iterator[tuple[SmartDevice, bool, int | str | None]]:
+        if isinstance(self.smart_devices, HomeSnapshot):
+            yield from self.smart_devices.get_states()
+        else:
+            for smart_device in self.smart_devices:
+                switched_on, value = smart_device.get_state()
+                yield smart_device, switched_on, value
+
+    # The progress and cancelled arguments are for running these on a
+    # worker thread, cancelling raises FileCancelledError
+    def create_csv(
+        self: Self,
+        progress: FILE_PROGRESS_TYPE | None = None,
+        cancelled: Event | None = None,
+    ) -> None:
+        # Written to a temporary file first, so storage.csv is only
+        # replaced once it has all of the devices
+        total = len(self.smart_devices)
+        with open("storage.csv.tmp", mode="w") as smart_devices:
             smart_devices_writer = csv.writer(
                 smart_devices,
                 delimiter=",",
                 quotechar='"',
                 quoting=csv.QUOTE_MINIMAL,
             )
-            for smart_device in self.smart_devices:
+            for index, (
+                smart_device,
+                switched_on,
+                value,
+            ) in enumerate(self.get_smart_device_states()):
+                if cancelled is not None and cancelled.is_set():
+                    break
+                if progress is not None and index % FILE_PROGRESS_ROWS == 0:
+                    progress(index, total)
                 if isinstance(smart_device, SmartPlug):
                     smart_devices_writer.writerow(
-                        [
-                            "smart_plug",
-                            f"{smart_device.get_switched_on()}",
-                            f"{smart_device.get_consumption_rate()}",
-                        ]
+                        ["smart_plug", f"{switched_on}", f"{value}"]
                     )
                 elif isinstance(smart_device, SmartAirFryer):
                     smart_devices_writer.writerow(
-                        [
-                            "smart_air_fryer",
-                            f"{smart_device.get_switched_on()}",
-                            f"{smart_device.get_cooking_mode()}",
-                        ]
+                        ["smart_air_fryer", f"{switched_on}", f"{value}"]
                     )
+        if cancelled is not None and cancelled.is_set():
+            os.remove("storage.csv.tmp")
+            raise FileCancelledError("download cancelled.")
+        os.replace("storage.csv.tmp", "storage.csv")
+        if progress is not None:
+            progress(total, total)
+
+    def create_binary(
+        self: Self,
+        file: str = "storage.bin",
+        progress: FILE_PROGRESS_TYPE | None = None,
+        cancelled: Event | None = None,
+    ) -> None:
+        # Only smart plugs and smart air fryers are written, as in a CSV
+        # file
+        smart_device_records = (
+            SmartDeviceRecord(
+                index + 1,
+                "smart_plug"
+                if isinstance(smart_device, SmartPlug)
+                else "smart_air_fryer",
+                switched_on,
+                value,
+            )
+            for index, (smart_device, switched_on, value) in enumerate(
+                self.get_smart_device_states()
+            )
+            if isinstance(value, int | str)
+        )
+        write_binary(
+            file,
+            smart_device_records,
+            progress,
+            cancelled,
+            len(self.smart_devices),
+        )
 
-    def read_csv(self: Self, file: str) -> list[str]:
-        rows = []
-        with open(file, mode="r") as csv_file:
-            csv_reader = csv.reader(csv_file)
-            for row in csv_reader:
-                rows.append(row)
-        return rows
+    def read_csv(
+        self: Self,
+        file: str,
+        progress: FILE_PROGRESS_TYPE | None = None,
+        cancelled: Event | None = None,
+        row_error: FILE_ROW_ERROR_TYPE | None = None,
+    ) -> Iterator[SmartDeviceRecord]:
+        # Yields the rows one at a time as they are read, so the memory
+        # used does not grow with the file. Invalid rows are passed to
+        # row_error (if given) and skipped, blank lines are skipped
+        total = os.path.getsize(file)
+        done = 0
+        with open(file, mode="r", newline="") as csv_file:
+
+            def read_lines() -> Iterator[str]:
+                nonlocal done
+                for line in csv_file:
+                    done += len(line)
+                    yield line
+
+            csv_reader = csv.reader(read_lines())
+            for row_count, row in enumerate(csv_reader):
+                if cancelled is not None and cancelled.is_set():
+                    raise FileCancelledError("upload cancelled.")
+                if (
+                    progress is not None
+                    and row_count % FILE_PROGRESS_ROWS == 0
+                ):
+                    progress(done, total)
+                if len(row) == 0:
+                    continue
+                try:
+                    yield read_smart_device_record(csv_reader.line_num, row)
+                except FileRowError as error:
+                    if row_error is not None:
+                        row_error(error)
+        if progress is not None:
+            progress(total, total)
+
+    def read_smart_devices(
+        self: Self,
+        file: str,
+        progress: FILE_PROGRESS_TYPE | None = None,
+        cancelled: Event | None = None,
+        row_error: FILE_ROW_ERROR_TYPE | None = None,
+    ) -> List[SmartDevice]:
+        # The devices are created here and added to a home by the caller,
+        # so this can run on a worker thread. A .bin file is read as a
+        # binary file, any other file as a CSV file
+        if file.endswith(".bin"):
+            with MappedSmartDeviceFile(file) as mapped_file:
+                return [
+                    smart_device_record.create_smart_device()
+                    for smart_device_record in mapped_file.get_records(
+                        progress, cancelled, row_error
+                    )
+                ]
+        return [
+            smart_device_record.create_smart_device()
+            for smart_device_record in self.read_csv(
+                file, progress, cancelled, row_error
+            )
+        ]
+
+
+def convert_csv_to_binary(
+    csv_file: str,
+    binary_file: str,
+    row_error: FILE_ROW_ERROR_TYPE | None = None,
+) -> None:
+    # Invalid rows are passed to row_error (if given) and left out
+    write_binary(
+        binary_file,
+        SmartDeviceFile([]).read_csv(csv_file, row_error=row_error),
+    )
+
+
+def convert_binary_to_csv(
+    binary_file: str,
+    csv_file: str,
+    row_error: FILE_ROW_ERROR_TYPE | None = None,
+) -> None:
+    # Invalid records are passed to row_error (if given) and left out
+    with (
+        MappedSmartDeviceFile(binary_file) as mapped_file,
+        open(f"{csv_file}.tmp", mode="w", newline="") as smart_devices,
+    ):
+        smart_devices_writer = csv.writer(
+            smart_devices,
+            delimiter=",",
+            quotechar='"',
+            quoting=csv.QUOTE_MINIMAL,
+        )
+        smart_devices_writer.writerows(
+            [
+                smart_device_record.get_device_type(),
+                f"{smart_device_record.get_switched_on()}",
+                f"{smart_device_record.get_value()}",
+            ]
+            for smart_device_record in mapped_file.get_records(
+                row_error=row_error
+            )
+        )
+    os.replace(f"{csv_file}.tmp", csv_file)
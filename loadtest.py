@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import List, Self
+
+# The share of each kind of request, the rest read the stats
+TOGGLE_SHARE = 0.45
+BULK_SHARE = 0.45
+
+
+class LoadTestReport:
+    def __init__(
+        self: Self, latencies: List[float], errors: int, elapsed: float
+    ) -> None:
+        # Seconds from sending each request to reading its response
+        self.latencies: List[float] = latencies
+        # Responses with a status that is not 2xx
+        self.errors: int = errors
+        # Wall clock seconds for the whole test
+        self.elapsed: float = elapsed
+
+    def __str__(self: Self) -> str:
+        output = f"{len(self.latencies)} requests in {self.elapsed:.2f}s: "
+        output += f"{self.get_requests_per_second():,.0f} req/s, "
+        output += f"p50 {self.get_percentile(50) * 1000:.2f}ms, "
+        output += f"p99 {self.get_percentile(99) * 1000:.2f}ms, "
+        output += f"{self.errors} errors"
+        return output
+
+    def get_latencies(self: Self) -> List[float]:
+        return self.latencies
+
+    def get_errors(self: Self) -> int:
+        return self.errors
+
+    def get_elapsed(self: Self) -> float:
+        return self.elapsed
+
+    def get_requests_per_second(self: Self) -> float:
+        if self.elapsed == 0:
+            return 0.0
+        return len(self.latencies) / self.elapsed
+
+    def get_percentile(self: Self, percentile: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100)[percentile - 1]
+
+
+def encode_request(method: str, path: str, body: object = None) -> bytes:
+    request = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+    data = b""
+    if body is not None:
+        data = json.dumps(body).encode()
+        request += "Content-Type: application/json\r\n"
+        request += f"Content-Length: {len(data)}\r\n"
+    return request.encode() + b"\r\n" + data
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    status_line = await reader.readline()
+    if status_line == b"":
+        raise ConnectionError("connection closed.")
+    status = int(status_line.split()[1])
+    content_length = 0
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+    return status, await reader.readexactly(content_length)
+
+
+async def open_connection(
+    host: str, port: int, unix_path: str | None
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+def create_requests(
+    device_ids: List[int], count: int, seed: int
+) -> List[bytes]:
+    generator = random.Random(seed)
+    requests: List[bytes] = []
+    for _ in range(count):
+        share = generator.random()
+        if share < TOGGLE_SHARE:
+            device_id = generator.choice(device_ids)
+            requests.append(
+                encode_request("POST", f"/devices/{device_id}/toggle")
+            )
+        elif share < TOGGLE_SHARE + BULK_SHARE:
+            switched_on = {
+                str(generator.choice(device_ids)): generator.random() < 0.5
+                for _ in range(4)
+            }
+            requests.append(
+                encode_request(
+                    "POST", "/devices/bulk", {"switched_on": switched_on}
+                )
+            )
+        else:
+            requests.append(encode_request("GET", "/stats"))
+    return requests
+
+
+async def run_connection(
+    host: str,
+    port: int,
+    unix_path: str | None,
+    requests: List[bytes],
+    pipeline: int,
+    latencies: List[float],
+) -> int:
+    # Keeps up to pipeline requests in flight on one connection, returns
+    # how many responses were errors
+    reader, writer = await open_connection(host, port, unix_path)
+    in_flight = asyncio.Semaphore(pipeline)
+    send_times: asyncio.Queue[float] = asyncio.Queue()
+
+    async def send() -> None:
+        for request in requests:
+            await in_flight.acquire()
+            send_times.put_nowait(time.perf_counter())
+            writer.write(request)
+            await writer.drain()
+
+    errors = 0
+    send_task = asyncio.create_task(send())
+    try:
+        for _ in range(len(requests)):
+            status, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - await send_times.get())
+            in_flight.release()
+            if status // 100 != 2:
+                errors += 1
+        await send_task
+    finally:
+        send_task.cancel()
+        writer.close()
+    return errors
+
+
+async def get_device_ids(
+    host: str, port: int, unix_path: str | None
+) -> List[int]:
+    reader, writer = await open_connection(host, port, unix_path)
+    try:
+        writer.write(encode_request("GET", "/devices"))
+        status, body = await read_response(reader)
+    finally:
+        writer.close()
+    if status != 200:
+        raise ValueError("could not list the devices.")
+    return [device["id"] for device in json.loads(body)]
+
+
+async def run_load_test(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_path: str | None = None,
+    connections: int = 32,
+    request_count: int = 50_000,
+    pipeline: int = 16,
+) -> LoadTestReport:
+    # Toggles, bulk switches and stats reads of the devices of the server,
+    # split between keep-alive connections
+    device_ids = await get_device_ids(host, port, unix_path)
+    if len(device_ids) == 0:
+        raise ValueError("the smart home has no devices.")
+    connection_requests = [
+        create_requests(device_ids, request_count // connections, seed)
+        for seed in range(connections)
+    ]
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(
+        *(
+            run_connection(
+                host, port, unix_path, requests, pipeline, latencies
+            )
+            for requests in connection_requests
+        )
+    )
+    return LoadTestReport(latencies, sum(errors), time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test a smart home server."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--unix", metavar="PATH", help="connect to a Unix socket instead"
+    )
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument(
+        "--pipeline",
+        type=int,
+        default=16,
+        help="requests in flight on each connection",
+    )
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run_load_test(
+            args.host,
+            args.port,
+            args.unix,
+            args.connections,
+            args.requests,
+            args.pipeline,
+        )
+    )
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
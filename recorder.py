@@ -0,0 +1,334 @@
+import time
+from array import array
+from bisect import bisect_left
+from enum import Enum
+from typing import Callable, Dict, List, Self
+
+from backend import DeviceEvent, DeviceEventTypes, SmartHome, SmartPlug
+
+
+class Resolutions(Enum):
+    # The length of a sample in seconds, raw samples are as they are taken
+    RAW = 0
+    MINUTE = 60
+    HOUR = 60 * 60
+
+
+# How many samples are kept at each resolution: an hour of samples taken
+# every second, a day of minutes and a month of hours
+DEFAULT_CAPACITIES: Dict[Resolutions, int] = {
+    Resolutions.RAW: 60 * 60,
+    Resolutions.MINUTE: 24 * 60,
+    Resolutions.HOUR: 30 * 24,
+}
+
+HISTORY_RANGE_TYPE = tuple[memoryview, memoryview, memoryview]
+
+
+class TimeRing:
+    # The times of the samples at one resolution, shared by every device as
+    # they are all sampled at once. Every time is written to both halves of
+    # an array twice the capacity, so the last capacity samples are one
+    # contiguous run that memoryviews can return without copying
+    __slots__ = ("capacity", "end", "period", "period_start", "times")
+
+    def __init__(self: Self, capacity: int, period: int) -> None:
+        if capacity <= 0:
+            raise ValueError("invalid capacity (> 0).")
+        self.capacity: int = capacity
+        self.times: array = array("d", bytes(8 * 2 * capacity))
+        # How many samples have been added, the next one goes at
+        # end % capacity
+        self.end: int = 0
+        # The period being averaged, for the resolutions other than raw
+        self.period: int = period
+        self.period_start: float | None = None
+
+    def __len__(self: Self) -> int:
+        return min(self.end, self.capacity)
+
+    def get_capacity(self: Self) -> int:
+        return self.capacity
+
+    def append(self: Self, sample_time: float) -> None:
+        index = self.end % self.capacity
+        self.times[index] = self.times[index + self.capacity] = sample_time
+        self.end += 1
+
+    def get_bounds(self: Self, first: int, end: int) -> tuple[int, int]:
+        # The indexes in the doubled arrays of the samples from first to
+        # before end that are still kept
+        first = max(first, self.end - self.capacity)
+        if first >= end:
+            return 0, 0
+        low = first % self.capacity
+        return low, low + end - first
+
+    def get_latest_time(self: Self) -> float | None:
+        if self.end == 0:
+            return None
+        return self.times[(self.end - 1) % self.capacity]
+
+
+class RingBuffer:
+    # The switched on states and consumption rates of a device at one
+    # resolution, at the same indexes as the times in its TimeRing
+    __slots__ = ("consumption_rates", "end", "first", "switched_on")
+
+    def __init__(
+        self: Self,
+        capacity: int,
+        switched_on_typecode: str,
+        consumption_rate_typecode: str,
+    ) -> None:
+        if capacity <= 0:
+            raise ValueError("invalid capacity (> 0).")
+        self.switched_on: array = array(switched_on_typecode, [0]) * (
+            2 * capacity
+        )
+        self.consumption_rates: array = array(
+            consumption_rate_typecode, [0]
+        ) * (2 * capacity)
+        # The numbers in the TimeRing of the first sample of the device and
+        # of the sample after its newest
+        self.first: int = 0
+        self.end: int = 0
+
+    def clear(self: Self) -> None:
+        # The old samples are left in the arrays, out of the bounds
+        self.first = 0
+        self.end = 0
+
+    def append(
+        self: Self,
+        time_ring: TimeRing,
+        switched_on: float,
+        consumption_rate: float,
+    ) -> None:
+        # Written before the time is appended to the TimeRing
+        if self.first == self.end:
+            self.first = time_ring.end
+        capacity = time_ring.capacity
+        index = time_ring.end % capacity
+        mirror_index = index + capacity
+        self.switched_on[index] = self.switched_on[mirror_index] = switched_on
+        self.consumption_rates[index] = self.consumption_rates[
+            mirror_index
+        ] = consumption_rate
+        self.end = time_ring.end + 1
+
+    def get_range(
+        self: Self, time_ring: TimeRing, start_time: float, end_time: float
+    ) -> HISTORY_RANGE_TYPE:
+        # The samples with start_time <= time < end_time, in time order
+        low, high = time_ring.get_bounds(self.first, self.end)
+        times = time_ring.times
+        low, high = (
+            bisect_left(times, start_time, low, high),
+            bisect_left(times, end_time, low, high),
+        )
+        return (
+            memoryview(times)[low:high],
+            memoryview(self.switched_on)[low:high],
+            memoryview(self.consumption_rates)[low:high],
+        )
+
+    def get_all(self: Self, time_ring: TimeRing) -> HISTORY_RANGE_TYPE:
+        low, high = time_ring.get_bounds(self.first, self.end)
+        return (
+            memoryview(time_ring.times)[low:high],
+            memoryview(self.switched_on)[low:high],
+            memoryview(self.consumption_rates)[low:high],
+        )
+
+
+class Downsampler:
+    # Averages the samples of a device into a RingBuffer, once a sample from
+    # the next period comes in
+    __slots__ = (
+        "buffer",
+        "consumption_rate_total",
+        "sample_count",
+        "switched_on_total",
+    )
+
+    def __init__(self: Self, capacity: int) -> None:
+        self.buffer: RingBuffer = RingBuffer(capacity, "f", "f")
+        self.switched_on_total: int = 0
+        self.consumption_rate_total: int = 0
+        self.sample_count: int = 0
+
+    def add(self: Self, switched_on: int, consumption_rate: int) -> None:
+        self.switched_on_total += switched_on
+        self.consumption_rate_total += consumption_rate
+        self.sample_count += 1
+
+    def flush(self: Self, time_ring: TimeRing) -> bool:
+        if self.sample_count == 0:
+            return False
+        self.buffer.append(
+            time_ring,
+            self.switched_on_total / self.sample_count,
+            self.consumption_rate_total / self.sample_count,
+        )
+        self.switched_on_total = 0
+        self.consumption_rate_total = 0
+        self.sample_count = 0
+        return True
+
+    def clear(self: Self) -> None:
+        self.buffer.clear()
+        self.switched_on_total = 0
+        self.consumption_rate_total = 0
+        self.sample_count = 0
+
+
+class DeviceHistory:
+    __slots__ = ("downsamplers", "raw")
+
+    def __init__(self: Self, capacities: Dict[Resolutions, int]) -> None:
+        self.raw: RingBuffer = RingBuffer(
+            capacities[Resolutions.RAW], "B", "H"
+        )
+        self.downsamplers: Dict[Resolutions, Downsampler] = {
+            resolution: Downsampler(capacities[resolution])
+            for resolution in Resolutions
+            if resolution is not Resolutions.RAW
+        }
+
+    def add(
+        self: Self,
+        time_ring: TimeRing,
+        switched_on: int,
+        consumption_rate: int,
+    ) -> None:
+        self.raw.append(time_ring, switched_on, consumption_rate)
+        for downsampler in self.downsamplers.values():
+            downsampler.add(switched_on, consumption_rate)
+
+    def get_buffer(self: Self, resolution: Resolutions) -> RingBuffer:
+        if resolution is Resolutions.RAW:
+            return self.raw
+        return self.downsamplers[resolution].buffer
+
+    def clear(self: Self) -> None:
+        self.raw.clear()
+        for downsampler in self.downsamplers.values():
+            downsampler.clear()
+
+
+class Recorder:
+    # The history of a removed device is dropped and its buffers are reused, so
+    # memory only grows with the most devices the home has had at once
+    def __init__(
+        self: Self,
+        home: SmartHome,
+        capacities: Dict[Resolutions, int] | None = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.home: SmartHome = home
+        self.capacities: Dict[Resolutions, int] = dict(DEFAULT_CAPACITIES)
+        if capacities is not None:
+            self.capacities.update(capacities)
+        self.clock: Callable[[], float] = clock
+        # The times are kept once for every device, which only keep their
+        # states and rates
+        self.time_rings: Dict[Resolutions, TimeRing] = {
+            resolution: TimeRing(self.capacities[resolution], resolution.value)
+            for resolution in Resolutions
+        }
+        self.histories: Dict[int, DeviceHistory] = {}
+        # The histories of removed devices, reused for the devices added
+        # after them instead of allocating new buffers
+        self.free_histories: List[DeviceHistory] = []
+        self.last_time: float | None = None
+        home.subscribe(self.handle_device_event)
+
+    def close(self: Self) -> None:
+        self.home.unsubscribe(self.handle_device_event)
+
+    def handle_device_event(self: Self, event: DeviceEvent) -> None:
+        if event.get_event_type() is DeviceEventTypes.REMOVED:
+            self.remove_history(event.get_device().get_id())
+
+    def get_history(self: Self, device_id: int) -> DeviceHistory | None:
+        return self.histories.get(device_id)
+
+    def get_device_ids(self: Self) -> List[int]:
+        return list(self.histories)
+
+    def remove_history(self: Self, device_id: int) -> None:
+        history = self.histories.pop(device_id, None)
+        if history is not None:
+            history.clear()
+            self.free_histories.append(history)
+
+    def sample(self: Self, now: float | None = None) -> None:
+        if now is None:
+            now = self.clock()
+        if self.last_time is not None and now <= self.last_time:
+            raise ValueError("invalid sample time (not after the last).")
+        self.last_time = now
+
+        # The periods that have ended are averaged before the sample is added
+        for resolution, time_ring in self.time_rings.items():
+            if resolution is Resolutions.RAW:
+                continue
+            period_start = now - now % time_ring.period
+            if period_start != time_ring.period_start:
+                self.flush_resolution(resolution)
+                time_ring.period_start = period_start
+
+        histories = self.histories
+        capacities = self.capacities
+        raw_ring = self.time_rings[Resolutions.RAW]
+        for device in self.home.get_devices():
+            device_id = device.get_id()
+            history = histories.get(device_id)
+            if history is None:
+                if len(self.free_histories) > 0:
+                    history = self.free_histories.pop()
+                else:
+                    history = DeviceHistory(capacities)
+                histories[device_id] = history
+            consumption_rate = 0
+            if isinstance(device, SmartPlug):
+                consumption_rate = device.get_consumption_rate()
+            history.add(
+                raw_ring, int(device.get_switched_on()), consumption_rate
+            )
+        raw_ring.append(now)
+
+    def flush_resolution(self: Self, resolution: Resolutions) -> None:
+        time_ring = self.time_rings[resolution]
+        if time_ring.period_start is None:
+            return
+        flushed = False
+        for history in self.histories.values():
+            if history.downsamplers[resolution].flush(time_ring):
+                flushed = True
+        if flushed:
+            time_ring.append(time_ring.period_start)
+
+    def flush(self: Self) -> None:
+        # Adds the averages of the periods that are still in progress, only
+        # needed once sampling has stopped
+        for resolution in self.time_rings:
+            if resolution is not Resolutions.RAW:
+                self.flush_resolution(resolution)
+
+    def get_range(
+        self: Self,
+        device_id: int,
+        start_time: float,
+        end_time: float,
+        resolution: Resolutions = Resolutions.RAW,
+    ) -> HISTORY_RANGE_TYPE:
+        # Views of the times, switched on states and consumption rates, the
+        # time of an average being the start of its period
+        history = self.histories.get(device_id)
+        if history is None:
+            raise ValueError("invalid device id.")
+        return history.get_buffer(resolution).get_range(
+            self.time_rings[resolution], start_time, end_time
+        )
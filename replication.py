@@ -0,0 +1,417 @@
+import queue
+import random
+import socket
+import struct
+import threading
+from collections import deque
+from typing import BinaryIO, Dict, List, Self
+
+from backend import (
+    COOKING_MODE_VALUES,
+    DeviceEvent,
+    DeviceEventTypes,
+    DeviceTypeCodes,
+    SmartAirFryer,
+    SmartDevice,
+    SmartHome,
+    SmartPlug,
+)
+
+# How many deltas the primary keeps for followers catching up, a follower
+# that is further behind is sent the whole state again
+REPLICATION_LOG_SIZE = 100_000
+
+# Seconds a follower waits before connecting again
+RECONNECT_DELAY = 1.0
+
+# The operation of a delta is stored as a code, which is the index of its
+# event type in this tuple
+DELTA_OPERATIONS: tuple[DeviceEventTypes, ...] = tuple(DeviceEventTypes)
+DELTA_OPERATION_CODES: Dict[DeviceEventTypes, int] = {
+    event_type: code for code, event_type in enumerate(DELTA_OPERATIONS)
+}
+
+# (sequence, operation code, device type code, device id, switched on,
+# consumption rate or cooking mode code), 21 bytes
+DELTA_STRUCT = struct.Struct("!QBBQ?H")
+# Sent by a follower when it connects: (session id, last sequence)
+HELLO_STRUCT = struct.Struct("!QQ")
+# The reply of the primary: (session id, sequence, whether the whole state
+# is sent again)
+REPLY_STRUCT = struct.Struct("!QQ?")
+
+
+class Delta:
+    # Has the whole state of the device, so applying it twice or out of date is
+    # harmless
+    __slots__ = (
+        "device_id",
+        "device_type_code",
+        "operation",
+        "sequence",
+        "switched_on",
+        "value",
+    )
+
+    def __init__(
+        self: Self,
+        sequence: int,
+        operation: DeviceEventTypes,
+        device_type_code: int,
+        device_id: int,
+        switched_on: bool,
+        value: int,
+    ) -> None:
+        self.sequence: int = sequence
+        self.operation: DeviceEventTypes = operation
+        self.device_type_code: int = device_type_code
+        self.device_id: int = device_id
+        self.switched_on: bool = switched_on
+        # The consumption rate of a smart plug or the cooking mode code of
+        # a smart air fryer
+        self.value: int = value
+
+    def get_sequence(self: Self) -> int:
+        return self.sequence
+
+    def get_operation(self: Self) -> DeviceEventTypes:
+        return self.operation
+
+    def get_device_type_code(self: Self) -> int:
+        return self.device_type_code
+
+    def get_device_id(self: Self) -> int:
+        return self.device_id
+
+    def get_switched_on(self: Self) -> bool:
+        return self.switched_on
+
+    def get_value(self: Self) -> int:
+        return self.value
+
+
+def encode_delta(
+    sequence: int, operation: DeviceEventTypes, device: SmartDevice
+) -> bytes:
+    device_type_code = DeviceTypeCodes.SMART_DEVICE.value
+    value = 0
+    if isinstance(device, SmartPlug):
+        device_type_code = DeviceTypeCodes.SMART_PLUG.value
+        value = device.get_consumption_rate()
+    elif isinstance(device, SmartAirFryer):
+        device_type_code = DeviceTypeCodes.SMART_AIR_FRYER.value
+        value = device.get_cooking_mode_code()
+    return DELTA_STRUCT.pack(
+        sequence,
+        DELTA_OPERATION_CODES[operation],
+        device_type_code,
+        device.get_id(),
+        device.get_switched_on(),
+        value,
+    )
+
+
+def decode_delta(data: bytes) -> Delta:
+    (
+        sequence,
+        operation_code,
+        device_type_code,
+        device_id,
+        switched_on,
+        value,
+    ) = DELTA_STRUCT.unpack(data)
+    if operation_code >= len(DELTA_OPERATIONS):
+        raise ValueError("invalid delta operation.")
+    return Delta(
+        sequence,
+        DELTA_OPERATIONS[operation_code],
+        device_type_code,
+        device_id,
+        switched_on,
+        value,
+    )
+
+
+def read_exactly(reader: BinaryIO, size: int) -> bytes:
+    data = reader.read(size)
+    if len(data) < size:
+        raise ConnectionError("connection closed.")
+    return data
+
+
+class ReplicationPrimary:
+    # A follower that connects again is only sent the deltas after the sequence
+    # it got to, or the whole state if it is further behind than the log, each
+    # follower has its own thread and queue
+    def __init__(
+        self: Self, home: SmartHome, log_size: int = REPLICATION_LOG_SIZE
+    ) -> None:
+        if log_size <= 0:
+            raise ValueError("invalid log size (> 0).")
+        self.home: SmartHome = home
+        # Changes with every primary, so a follower of an old one is reset
+        self.session_id: int = random.getrandbits(63) + 1
+        self.sequence: int = 0
+        self.log: deque[bytes] = deque(maxlen=log_size)
+        # Held while a delta is logged and queued, so that every follower
+        # gets the deltas in sequence order
+        self.lock: threading.Lock = threading.Lock()
+        self.followers: Dict[
+            socket.socket, queue.SimpleQueue[bytes | None]
+        ] = {}
+        self.server: socket.socket | None = None
+        self.home.subscribe(self.record)
+
+    def get_sequence(self: Self) -> int:
+        return self.sequence
+
+    def get_follower_count(self: Self) -> int:
+        return len(self.followers)
+
+    def start(self: Self, host: str = "127.0.0.1", port: int = 0) -> int:
+        # Returns the port, a free one is used when port is 0
+        self.server = socket.create_server((host, port))
+        threading.Thread(
+            target=self.accept_followers, args=(self.server,), daemon=True
+        ).start()
+        return self.server.getsockname()[1]
+
+    def close(self: Self) -> None:
+        self.home.unsubscribe(self.record)
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        with self.lock:
+            for follower_queue in self.followers.values():
+                follower_queue.put(None)
+
+    def record(self: Self, event: DeviceEvent) -> None:
+        # Called by the home after every change, from any thread
+        device = event.get_device()
+        removed = event.get_event_type() == DeviceEventTypes.REMOVED
+        with self.lock:
+            # The state is read now, so the last delta of a device always
+            # has its latest state even when changes race to be recorded,
+            # and a change recorded after the device has left (or before
+            # it is back in) the home is dropped
+            in_home = device.home is self.home
+            if in_home == removed:
+                return
+            self.sequence += 1
+            data = encode_delta(self.sequence, event.get_event_type(), device)
+            self.log.append(data)
+            for follower_queue in self.followers.values():
+                follower_queue.put(data)
+
+    def get_catch_up(self: Self, session_id: int, sequence: int) -> bytes:
+        # Called with the lock held, returns the reply and the deltas that
+        # bring the follower up to date
+        behind = self.sequence - sequence
+        if session_id == self.session_id and 0 <= behind <= len(self.log):
+            log = list(self.log)
+            reply = REPLY_STRUCT.pack(self.session_id, self.sequence, False)
+            return reply + b"".join(log[len(log) - behind :])
+        data = [REPLY_STRUCT.pack(self.session_id, self.sequence, True)]
+        for device in self.home.get_devices():
+            data.append(
+                encode_delta(self.sequence, DeviceEventTypes.ADDED, device)
+            )
+        return b"".join(data)
+
+    def accept_followers(self: Self, server: socket.socket) -> None:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self.serve_follower, args=(connection,), daemon=True
+            ).start()
+
+    def serve_follower(self: Self, connection: socket.socket) -> None:
+        follower_queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        try:
+            with connection, connection.makefile("rb") as reader:
+                session_id, sequence = HELLO_STRUCT.unpack(
+                    read_exactly(reader, HELLO_STRUCT.size)
+                )
+                with self.lock:
+                    data = self.get_catch_up(session_id, sequence)
+                    self.followers[connection] = follower_queue
+                while data is not None:
+                    # Everything queued since the last send goes at once
+                    chunks = [data]
+                    while not follower_queue.empty():
+                        chunk = follower_queue.get()
+                        if chunk is None:
+                            data = None
+                            break
+                        chunks.append(chunk)
+                    connection.sendall(b"".join(chunks))
+                    if data is not None:
+                        data = follower_queue.get()
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.followers.pop(connection, None)
+
+
+class ReplicationFollower:
+    # apply_pending applies the queued deltas on the thread that owns the home,
+    # the devices keep their own ids and are found by their id on the primary
+    def __init__(
+        self: Self,
+        home: SmartHome,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        reconnect_delay: float = RECONNECT_DELAY,
+    ) -> None:
+        self.home: SmartHome = home
+        self.host: str = host
+        self.port: int = port
+        self.reconnect_delay: float = reconnect_delay
+        self.session_id: int = 0
+        self.sequence: int = 0
+        # The deltas read but not applied yet, None when the devices from
+        # the primary have to be removed before the whole state is applied
+        # again
+        self.pending: queue.SimpleQueue[Delta | None] = queue.SimpleQueue()
+        # The devices by their id on the primary
+        self.devices: Dict[int, SmartDevice] = {}
+        self.connection: socket.socket | None = None
+        self.connected: threading.Event = threading.Event()
+        self.closed: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(
+            target=self.run, daemon=True
+        )
+
+    def get_sequence(self: Self) -> int:
+        return self.sequence
+
+    def get_connected(self: Self) -> threading.Event:
+        return self.connected
+
+    def start(self: Self) -> None:
+        self.thread.start()
+
+    def close(self: Self) -> None:
+        self.closed.set()
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join()
+
+    def run(self: Self) -> None:
+        while not self.closed.is_set():
+            try:
+                connection = socket.create_connection((self.host, self.port))
+                with connection:
+                    self.connection = connection
+                    if self.closed.is_set():
+                        return
+                    self.follow(connection)
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.connection = None
+                self.connected.clear()
+            self.closed.wait(self.reconnect_delay)
+
+    def follow(self: Self, connection: socket.socket) -> None:
+        connection.sendall(HELLO_STRUCT.pack(self.session_id, self.sequence))
+        with connection.makefile("rb") as reader:
+            session_id, sequence, reset = REPLY_STRUCT.unpack(
+                read_exactly(reader, REPLY_STRUCT.size)
+            )
+            if reset:
+                self.pending.put(None)
+                self.sequence = sequence
+            self.session_id = session_id
+            self.connected.set()
+            while True:
+                delta = decode_delta(read_exactly(reader, DELTA_STRUCT.size))
+                self.sequence = delta.get_sequence()
+                self.pending.put(delta)
+
+    def apply_pending(
+        self: Self,
+    ) -> tuple[List[SmartDevice], List[SmartDevice]]:
+        # Returns the devices added to and removed from the home, the new
+        # devices are added together once every delta has been applied
+        added: Dict[int, SmartDevice] = {}
+        removed: List[SmartDevice] = []
+        while not self.pending.empty():
+            delta = self.pending.get()
+            if delta is None:
+                # Only the devices from the primary are removed, the ones
+                # added to the follower are kept
+                for device in self.devices.values():
+                    if device.home is self.home:
+                        self.home.remove_device(device.get_id())
+                        removed.append(device)
+                self.devices.clear()
+                added = {}
+                continue
+
+            primary_id = delta.get_device_id()
+            new_device = added.get(primary_id)
+            device = self.devices.get(primary_id)
+            # A device removed from the home of the follower is added again
+            # by the next change to it
+            if device is not None and device.home is not self.home:
+                device = None
+            if delta.get_operation() == DeviceEventTypes.REMOVED:
+                added.pop(primary_id, None)
+                self.devices.pop(primary_id, None)
+                if device is not None:
+                    self.home.remove_device(device.get_id())
+                    removed.append(device)
+            elif new_device is not None:
+                self.write_device(new_device, delta)
+            elif device is not None:
+                self.set_device(device, delta)
+            else:
+                new_device = self.create_device(delta)
+                if new_device is not None:
+                    added[primary_id] = new_device
+                    self.devices[primary_id] = new_device
+
+        if len(added) > 0:
+            self.home.add_devices(added.values())
+        return list(added.values()), removed
+
+    def create_device(self: Self, delta: Delta) -> SmartDevice | None:
+        device: SmartDevice
+        match delta.get_device_type_code():
+            case DeviceTypeCodes.SMART_PLUG.value:
+                device = SmartPlug(delta.get_value())
+            case DeviceTypeCodes.SMART_AIR_FRYER.value:
+                device = SmartAirFryer()
+            case _:
+                return None
+        self.write_device(device, delta)
+        return device
+
+    def write_device(self: Self, device: SmartDevice, delta: Delta) -> None:
+        # For devices that are not in the home yet
+        if device.get_switched_on() != delta.get_switched_on():
+            device.flip_switch()
+        if isinstance(device, SmartPlug):
+            device.write_consumption_rate(delta.get_value())
+        elif isinstance(device, SmartAirFryer):
+            device.write_cooking_mode_code(delta.get_value())
+
+    def set_device(self: Self, device: SmartDevice, delta: Delta) -> None:
+        if device.get_switched_on() != delta.get_switched_on():
+            device.toggle_switch()
+        value = delta.get_value()
+        if isinstance(device, SmartPlug):
+            if device.get_consumption_rate() != value:
+                device.set_consumption_rate(value)
+        elif isinstance(device, SmartAirFryer):
+            if device.get_cooking_mode_code() != value:
+                device.set_cooking_mode(COOKING_MODE_VALUES[value])
@@ -0,0 +1,296 @@
+import operator
+from enum import Enum
+from itertools import count
+from typing import Any, Callable, Dict, List, Self, Set
+
+from backend import (
+    DeviceEvent,
+    DeviceEventTypes,
+    SmartAirFryer,
+    SmartDevice,
+    SmartHome,
+    SmartPlug,
+)
+
+# How many rules can trigger each other before the rest are skipped
+MAX_CASCADE_DEPTH = 16
+
+RULE_ACTION_TYPE = Callable[[SmartHome], None]
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class RuleAttributes(Enum):
+    SWITCHED_ON = "switched_on"
+    CONSUMPTION_RATE = "consumption_rate"
+    COOKING_MODE = "cooking_mode"
+    TOTAL_CONSUMPTION = "total_consumption"
+
+
+# (device id, attribute), the device id is None for total consumption
+RULE_KEY_TYPE = tuple[int | None, RuleAttributes]
+
+
+def get_device_value(
+    device: SmartDevice, attribute: RuleAttributes
+) -> bool | int | str | None:
+    # None when the device doesn't have the attribute
+    match attribute:
+        case RuleAttributes.SWITCHED_ON:
+            return device.get_switched_on()
+        case RuleAttributes.CONSUMPTION_RATE:
+            if isinstance(device, SmartPlug):
+                return device.get_consumption_rate()
+        case RuleAttributes.COOKING_MODE:
+            if isinstance(device, SmartAirFryer):
+                return device.get_cooking_mode()
+    return None
+
+
+class Condition:
+    __slots__ = ("attribute", "device_id", "operator", "value")
+
+    def __init__(
+        self: Self,
+        attribute: RuleAttributes,
+        operator: str,
+        value: bool | int | str,
+        device_id: int | None = None,
+    ) -> None:
+        if operator not in OPERATORS:
+            raise ValueError("invalid operator.")
+        if (attribute is RuleAttributes.TOTAL_CONSUMPTION) != (
+            device_id is None
+        ):
+            raise ValueError(
+                "invalid device id (only total consumption has no device)."
+            )
+        self.attribute: RuleAttributes = attribute
+        self.operator: str = operator
+        self.value: bool | int | str = value
+        self.device_id: int | None = device_id
+
+    def __str__(self: Self) -> str:
+        subject = self.attribute.value
+        if self.device_id is not None:
+            subject = f"device {self.device_id} {subject}"
+        return f"{subject} {self.operator} {self.value!r}"
+
+    def get_key(self: Self) -> RULE_KEY_TYPE:
+        return (self.device_id, self.attribute)
+
+    def compile(self: Self, home: SmartHome) -> Callable[[], bool]:
+        # Looks everything up once, so evaluating the condition is only a
+        # read and a comparison
+        compare = OPERATORS[self.operator]
+        value = self.value
+        if self.attribute is RuleAttributes.TOTAL_CONSUMPTION:
+            return lambda: compare(home.get_total_consumption(), value)
+
+        device_id = self.device_id
+        attribute = self.attribute
+
+        def condition() -> bool:
+            device = home.get_device(device_id)
+            if device is None:
+                return False
+            device_value = get_device_value(device, attribute)
+            return device_value is not None and compare(device_value, value)
+
+        return condition
+
+
+class Rule:
+    __slots__ = (
+        "action",
+        "compiled_conditions",
+        "conditions",
+        "matched",
+        "name",
+        "rule_id",
+    )
+
+    def __init__(
+        self: Self,
+        rule_id: int,
+        name: str,
+        conditions: List[Condition],
+        action: RULE_ACTION_TYPE,
+        home: SmartHome,
+    ) -> None:
+        self.rule_id: int = rule_id
+        self.name: str = name
+        self.conditions: List[Condition] = conditions
+        self.compiled_conditions: List[Callable[[], bool]] = [
+            condition.compile(home) for condition in conditions
+        ]
+        self.action: RULE_ACTION_TYPE = action
+        # Whether every condition was true when the rule was last evaluated,
+        # the action only runs when this becomes true
+        self.matched: bool = self.evaluate()
+
+    def __str__(self: Self) -> str:
+        conditions = " and ".join(
+            str(condition) for condition in self.conditions
+        )
+        return f"Rule {self.rule_id} ({self.name}): when {conditions}"
+
+    def get_id(self: Self) -> int:
+        return self.rule_id
+
+    def get_name(self: Self) -> str:
+        return self.name
+
+    def get_conditions(self: Self) -> List[Condition]:
+        return self.conditions
+
+    def get_matched(self: Self) -> bool:
+        return self.matched
+
+    def evaluate(self: Self) -> bool:
+        for condition in self.compiled_conditions:
+            if not condition():
+                return False
+        return True
+
+
+# Actions for rules
+def turn_on(device_id: int) -> RULE_ACTION_TYPE:
+    return lambda home: home.set_switched_on({device_id: True})
+
+
+def turn_off(device_id: int) -> RULE_ACTION_TYPE:
+    return lambda home: home.set_switched_on({device_id: False})
+
+
+def set_consumption_rate(device_id: int, rate: int) -> RULE_ACTION_TYPE:
+    return lambda home: home.set_consumption_rates({device_id: rate})
+
+
+def set_cooking_mode(device_id: int, cooking_mode: str) -> RULE_ACTION_TYPE:
+    return lambda home: home.set_cooking_modes({device_id: cooking_mode})
+
+
+class RulesEngine:
+    # Rules are indexed by the (device id, attribute) of their conditions, so a
+    # change only evaluates the rules that depend on it, a rule runs once per
+    # cascade
+    def __init__(self: Self, home: SmartHome) -> None:
+        self.home: SmartHome = home
+        self.rules: Dict[int, Rule] = {}
+        self.rule_ids = count()
+        self.rule_index: Dict[RULE_KEY_TYPE, Dict[int, Rule]] = {}
+        self.total_consumption: int = home.get_total_consumption()
+
+        # The rules run in the current cascade and how deep it is
+        self.cascade_rule_ids: Set[int] = set()
+        self.cascade_depth: int = 0
+        self.log: List[str] = []
+
+        home.subscribe(self.handle_device_event)
+
+    def close(self: Self) -> None:
+        self.home.unsubscribe(self.handle_device_event)
+
+    def get_rules(self: Self) -> List[Rule]:
+        return list(self.rules.values())
+
+    def get_rule(self: Self, rule_id: int) -> Rule | None:
+        return self.rules.get(rule_id)
+
+    def get_log(self: Self) -> List[str]:
+        return self.log
+
+    def add_rule(
+        self: Self,
+        conditions: List[Condition],
+        action: RULE_ACTION_TYPE,
+        name: str = "",
+    ) -> int:
+        if len(conditions) == 0:
+            raise ValueError("invalid rule (no conditions).")
+        rule = Rule(next(self.rule_ids), name, conditions, action, self.home)
+        self.rules[rule.rule_id] = rule
+        for condition in conditions:
+            self.rule_index.setdefault(condition.get_key(), {})[
+                rule.rule_id
+            ] = rule
+        return rule.rule_id
+
+    def remove_rule(self: Self, rule_id: int) -> None:
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            raise ValueError("invalid rule id.")
+        for condition in rule.conditions:
+            key = condition.get_key()
+            rules = self.rule_index[key]
+            rules.pop(rule_id, None)
+            if len(rules) == 0:
+                del self.rule_index[key]
+
+    def get_changed_keys(
+        self: Self, event: DeviceEvent
+    ) -> List[RULE_KEY_TYPE]:
+        device_id = event.get_device().get_id()
+        match event.get_event_type():
+            case DeviceEventTypes.SWITCHED:
+                keys = [(device_id, RuleAttributes.SWITCHED_ON)]
+            case DeviceEventTypes.RATE_CHANGED:
+                keys = [(device_id, RuleAttributes.CONSUMPTION_RATE)]
+            case DeviceEventTypes.MODE_CHANGED:
+                keys = [(device_id, RuleAttributes.COOKING_MODE)]
+            case _:
+                keys = [
+                    (device_id, attribute)
+                    for attribute in RuleAttributes
+                    if attribute is not RuleAttributes.TOTAL_CONSUMPTION
+                ]
+
+        total_consumption = self.home.get_total_consumption()
+        if total_consumption != self.total_consumption:
+            self.total_consumption = total_consumption
+            keys.append((None, RuleAttributes.TOTAL_CONSUMPTION))
+        return keys
+
+    def handle_device_event(self: Self, event: DeviceEvent) -> None:
+        rules: Dict[int, Rule] = {}
+        for key in self.get_changed_keys(event):
+            rules.update(self.rule_index.get(key, {}))
+
+        # The rules are evaluated before any actions run
+        triggered: List[Rule] = []
+        for rule in rules.values():
+            matched = rule.evaluate()
+            if matched and not rule.matched:
+                triggered.append(rule)
+            rule.matched = matched
+
+        if len(triggered) == 0:
+            return
+        if self.cascade_depth >= MAX_CASCADE_DEPTH:
+            for rule in triggered:
+                self.log.append(f"skipped (cascade too deep): {rule}")
+            return
+
+        self.cascade_depth += 1
+        try:
+            for rule in triggered:
+                if rule.rule_id in self.cascade_rule_ids:
+                    self.log.append(f"skipped (already run): {rule}")
+                    continue
+                self.cascade_rule_ids.add(rule.rule_id)
+                try:
+                    rule.action(self.home)
+                except Exception as error:
+                    self.log.append(f"error: {rule}: {error}")
+        finally:
+            self.cascade_depth -= 1
+            if self.cascade_depth == 0:
+                self.cascade_rule_ids.clear()
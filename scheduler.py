@@ -0,0 +1,215 @@
+import heapq
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from enum import Enum
+from itertools import count
+from typing import Callable, Dict, List, Self
+
+from backend import SmartHome
+
+DAY_SECONDS = 24 * 60 * 60
+# How many errors of actions are kept until they are popped, the oldest
+# are dropped after that
+MAX_ERRORS = 100
+
+
+class ScheduleActions(Enum):
+    TURN_ON = "turn_on"
+    TURN_OFF = "turn_off"
+    TOGGLE = "toggle"
+
+
+class Schedule:
+    __slots__ = (
+        "action",
+        "cancelled",
+        "device_id",
+        "interval",
+        "schedule_id",
+        "time",
+    )
+
+    def __init__(
+        self: Self,
+        schedule_id: int,
+        device_id: int,
+        action: ScheduleActions,
+        time: float,
+        interval: float | None,
+    ) -> None:
+        self.schedule_id: int = schedule_id
+        self.device_id: int = device_id
+        self.action: ScheduleActions = action
+        # When the action is next run, in the time of the scheduler clock
+        self.time: float = time
+        # Seconds between each run for a recurring schedule
+        self.interval: float | None = interval
+        self.cancelled: bool = False
+
+    def get_id(self: Self) -> int:
+        return self.schedule_id
+
+    def get_device_id(self: Self) -> int:
+        return self.device_id
+
+    def get_action(self: Self) -> ScheduleActions:
+        return self.action
+
+    def get_time(self: Self) -> float:
+        return self.time
+
+    def get_interval(self: Self) -> float | None:
+        return self.interval
+
+    def get_cancelled(self: Self) -> bool:
+        return self.cancelled
+
+
+def get_next_time_of_day(now: float, hour: int, minute: int) -> float:
+    # The next time (after now) that it is hour:minute in local time
+    if hour < 0 or hour > 23 or minute < 0 or minute > 59:
+        raise ValueError("invalid time of day.")
+    now_datetime = datetime.fromtimestamp(now)
+    next_datetime = now_datetime.replace(
+        hour=hour, minute=minute, second=0, microsecond=0
+    )
+    if next_datetime <= now_datetime:
+        next_datetime += timedelta(days=1)
+    return next_datetime.timestamp()
+
+
+class Scheduler:
+    # The schedules are in a heap by their next time, cancelled ones are
+    # skipped and the heap is rebuilt once most of it is cancelled
+    def __init__(
+        self: Self, home: SmartHome, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.home: SmartHome = home
+        self.clock: Callable[[], float] = clock
+        # (time, order added, schedule), the order keeps schedules with the
+        # same time in the order they were added
+        self.queue: List[tuple[float, int, Schedule]] = []
+        self.queue_order = count()
+        self.schedules: Dict[int, Schedule] = {}
+        self.schedule_ids = count()
+        self.cancelled_count: int = 0
+        # The errors raised by actions, with the id of their schedule, such
+        # as a device that can't be switched on within the power budget
+        self.errors: deque[tuple[int, Exception]] = deque(maxlen=MAX_ERRORS)
+
+    def __len__(self: Self) -> int:
+        return len(self.schedules)
+
+    def get_clock(self: Self) -> Callable[[], float]:
+        return self.clock
+
+    def get_schedule(self: Self, schedule_id: int) -> Schedule | None:
+        return self.schedules.get(schedule_id)
+
+    def get_schedules(self: Self) -> List[Schedule]:
+        return list(self.schedules.values())
+
+    def pop_errors(self: Self) -> List[tuple[int, Exception]]:
+        errors = list(self.errors)
+        self.errors.clear()
+        return errors
+
+    def push(self: Self, schedule: Schedule) -> None:
+        heapq.heappush(
+            self.queue, (schedule.time, next(self.queue_order), schedule)
+        )
+
+    def add_schedule(
+        self: Self,
+        device_id: int,
+        action: ScheduleActions,
+        at: float,
+        interval: float | None = None,
+    ) -> int:
+        if interval is not None and interval <= 0:
+            raise ValueError("invalid schedule interval.")
+        schedule = Schedule(
+            next(self.schedule_ids), device_id, action, at, interval
+        )
+        self.schedules[schedule.schedule_id] = schedule
+        self.push(schedule)
+        return schedule.schedule_id
+
+    def add_daily_schedule(
+        self: Self,
+        device_id: int,
+        action: ScheduleActions,
+        hour: int,
+        minute: int,
+    ) -> int:
+        at = get_next_time_of_day(self.clock(), hour, minute)
+        return self.add_schedule(device_id, action, at, DAY_SECONDS)
+
+    def cancel_schedule(self: Self, schedule_id: int) -> bool:
+        schedule = self.schedules.pop(schedule_id, None)
+        if schedule is None:
+            return False
+        schedule.cancelled = True
+        self.cancelled_count += 1
+        if self.cancelled_count > len(self.queue) // 2:
+            self.queue = [
+                queued for queued in self.queue if not queued[2].cancelled
+            ]
+            heapq.heapify(self.queue)
+            self.cancelled_count = 0
+        return True
+
+    def pop_cancelled(self: Self) -> None:
+        while len(self.queue) > 0 and self.queue[0][2].cancelled:
+            heapq.heappop(self.queue)
+            self.cancelled_count -= 1
+
+    def get_next_time(self: Self) -> float | None:
+        self.pop_cancelled()
+        if len(self.queue) > 0:
+            return self.queue[0][0]
+        return None
+
+    def run_action(self: Self, schedule: Schedule) -> None:
+        device = self.home.get_device(schedule.device_id)
+        if device is None:
+            return
+        match schedule.action:
+            case ScheduleActions.TURN_ON:
+                if device.get_switched_on() is False:
+                    device.toggle_switch()
+            case ScheduleActions.TURN_OFF:
+                if device.get_switched_on() is True:
+                    device.toggle_switch()
+            case ScheduleActions.TOGGLE:
+                device.toggle_switch()
+
+    def run_pending(self: Self, now: float | None = None) -> int:
+        # Runs every schedule that is due at now (the clock by default),
+        # in time order, and returns how many were run
+        if now is None:
+            now = self.clock()
+        run_count = 0
+        while True:
+            self.pop_cancelled()
+            if len(self.queue) == 0 or self.queue[0][0] > now:
+                return run_count
+            schedule = heapq.heappop(self.queue)[2]
+            # An action that fails doesn't stop the other schedules, and a
+            # recurring schedule still runs again
+            try:
+                self.run_action(schedule)
+            except Exception as error:
+                self.errors.append((schedule.schedule_id, error))
+            run_count += 1
+
+            # A recurring schedule is removed once its device is removed
+            if (
+                schedule.interval is not None
+                and self.home.get_device(schedule.device_id) is not None
+            ):
+                schedule.time += schedule.interval
+                self.push(schedule)
+            else:
+                del self.schedules[schedule.schedule_id]
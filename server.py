@@ -0,0 +1,594 @@
+import argparse
+import asyncio
+import json
+from enum import Enum
+from typing import Any, Dict, List, Self
+
+from backend import (
+    BatchError,
+    SmartAirFryer,
+    SmartDevice,
+    SmartHome,
+    SmartPlug,
+)
+from frontendChallenge import SmartDeviceFile
+
+# The largest request body and number of headers that are accepted
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 100
+
+# How many requests of one connection can be waiting for their response,
+# reading more requests waits once there are this many
+MAX_PIPELINE = 64
+
+HTTP_REASONS: Dict[int, str] = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Content Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+# The device types used in requests and responses, the same as in the CSV
+DEVICE_TYPE_NAMES: Dict[type[SmartDevice], str] = {
+    SmartDevice: "smart_device",
+    SmartPlug: "smart_plug",
+    SmartAirFryer: "smart_air_fryer",
+}
+
+# The status and the JSON payload of a response
+RESPONSE_TYPE = tuple[int, object]
+# The responses of a connection in the order of its requests, with whether
+# the connection is kept alive after each, None once there are no more
+RESPONSE_QUEUE_TYPE = asyncio.Queue[
+    tuple[asyncio.Future[RESPONSE_TYPE], bool] | None
+]
+# The changes of a bulk request by attribute, then by device id
+BULK_CHANGES_TYPE = Dict[str, Dict[int, Any]]
+# The attributes of a bulk request, applied in this order
+BULK_ATTRIBUTES = ("consumption_rates", "cooking_modes", "switched_on")
+
+
+class HttpError(Exception):
+    # Raised while a request is read or routed, with the status to reply with
+    def __init__(self: Self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status: int = status
+
+    def get_status(self: Self) -> int:
+        return self.status
+
+
+class HttpRequest:
+    __slots__ = ("body", "keep_alive", "method", "path")
+
+    def __init__(
+        self: Self, method: str, path: str, body: bytes, keep_alive: bool
+    ) -> None:
+        self.method: str = method
+        self.path: str = path
+        self.body: bytes = body
+        self.keep_alive: bool = keep_alive
+
+
+async def read_request(reader: asyncio.StreamReader) -> HttpRequest | None:
+    # None once the client has closed the connection
+    try:
+        line = await reader.readline()
+        if line == b"":
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            raise HttpError(400, "invalid request line.")
+        method, path, version = parts
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if line == b"":
+                raise HttpError(400, "incomplete headers.")
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(431, "too many headers.")
+            name, separator, value = line.decode("latin-1").partition(":")
+            if separator == "":
+                raise HttpError(400, "invalid header.")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", "0"))
+        except ValueError as error:
+            raise HttpError(400, "invalid content length.") from error
+        if content_length < 0:
+            raise HttpError(400, "invalid content length.")
+        if content_length > MAX_BODY_SIZE:
+            raise HttpError(413, "request body too large.")
+        body = b""
+        if content_length > 0:
+            body = await reader.readexactly(content_length)
+    except asyncio.IncompleteReadError as error:
+        raise HttpError(400, "incomplete body.") from error
+    except ValueError as error:
+        # A line longer than the limit of the reader
+        raise HttpError(400, "request line or header too long.") from error
+
+    # HTTP/1.1 connections are kept alive unless the client closes them
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        keep_alive = connection == "keep-alive"
+    else:
+        keep_alive = connection != "close"
+    return HttpRequest(method, path.split("?", 1)[0], body, keep_alive)
+
+
+def encode_response(status: int, payload: object, keep_alive: bool) -> bytes:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    head = f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Unknown')}\r\n"
+    head += "Content-Type: application/json\r\n"
+    head += f"Content-Length: {len(body)}\r\n"
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return head.encode() + b"\r\n" + body
+
+
+def device_to_json(device: SmartDevice) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "id": device.get_id(),
+        "type": DEVICE_TYPE_NAMES[type(device)],
+        "switched_on": device.get_switched_on(),
+    }
+    if isinstance(device, SmartPlug):
+        data["consumption_rate"] = device.get_consumption_rate()
+    elif isinstance(device, SmartAirFryer):
+        data["cooking_mode"] = device.get_cooking_mode()
+    return data
+
+
+def device_from_json(data: object) -> SmartDevice:
+    if not isinstance(data, dict):
+        raise ValueError("invalid device (not an object).")
+    match data.get("type"):
+        case "smart_plug":
+            consumption_rate = data.get("consumption_rate", 0)
+            # bool is a subclass of int
+            if not isinstance(consumption_rate, int) or isinstance(
+                consumption_rate, bool
+            ):
+                raise ValueError(SmartPlug.error_message)
+            device: SmartDevice = SmartPlug(consumption_rate)
+        case "smart_air_fryer":
+            device = SmartAirFryer()
+            cooking_mode = data.get("cooking_mode", device.get_cooking_mode())
+            if not isinstance(cooking_mode, str):
+                raise ValueError("invalid cooking mode.")
+            device.set_cooking_mode(cooking_mode)
+        case _:
+            raise ValueError("invalid device type.")
+    switched_on = data.get("switched_on", False)
+    if not isinstance(switched_on, bool):
+        raise ValueError("invalid switched on value.")
+    if switched_on:
+        device.toggle_switch()
+    return device
+
+
+def get_bulk_changes(data: object) -> BULK_CHANGES_TYPE:
+    # The device ids are ints instead of the strings they are in JSON
+    if not isinstance(data, dict):
+        raise ValueError("invalid bulk changes (not an object).")
+    changes: BULK_CHANGES_TYPE = {}
+    for attribute in BULK_ATTRIBUTES:
+        values = data.get(attribute, {})
+        if not isinstance(values, dict):
+            raise ValueError(f"invalid {attribute} (not an object).")
+        try:
+            changes[attribute] = {
+                int(device_id): value for device_id, value in values.items()
+            }
+        except ValueError as error:
+            raise ValueError(f"invalid device id in {attribute}.") from error
+    return changes
+
+
+class CommandActions(Enum):
+    LIST = "list"
+    GET = "get"
+    ADD = "add"
+    REMOVE = "remove"
+    TOGGLE = "toggle"
+    BULK = "bulk"
+    STATS = "stats"
+
+
+class Command:
+    __slots__ = ("action", "changes", "data", "device_id", "future")
+
+    def __init__(
+        self: Self,
+        action: CommandActions,
+        future: asyncio.Future[RESPONSE_TYPE],
+        device_id: int | None = None,
+        data: object = None,
+        changes: BULK_CHANGES_TYPE | None = None,
+    ) -> None:
+        self.action: CommandActions = action
+        self.future: asyncio.Future[RESPONSE_TYPE] = future
+        self.device_id: int | None = device_id
+        # The JSON body of an add, and the changes of a bulk command
+        self.data: object = data
+        self.changes: BULK_CHANGES_TYPE = changes or {}
+
+    def reply(self: Self, status: int, payload: object) -> None:
+        if not self.future.done():
+            self.future.set_result((status, payload))
+
+
+class SmartHomeServer:
+    # Commands from every connection are queued and applied once per loop
+    # iteration, with consecutive bulk changes merged into one batch. Routes:
+    # GET /devices, POST /devices, GET and DELETE /devices/<id>, POST
+    # /devices/<id>/toggle, POST /devices/bulk and GET /stats
+    def __init__(self: Self, home: SmartHome) -> None:
+        self.home: SmartHome = home
+        self.pending: List[Command] = []
+        self.server: asyncio.Server | None = None
+        self.connection_tasks: set[asyncio.Task[Any]] = set()
+        # How many times the queue was applied and how many commands it
+        # had, for seeing how well bursts are batched
+        self.flush_count: int = 0
+        self.command_count: int = 0
+
+    def get_home(self: Self) -> SmartHome:
+        return self.home
+
+    def get_mean_batch_size(self: Self) -> float:
+        if self.flush_count == 0:
+            return 0.0
+        return self.command_count / self.flush_count
+
+    async def start(self: Self, host: str = "127.0.0.1", port: int = 0) -> int:
+        # Returns the port, a free one is used when port is 0
+        self.server = await asyncio.start_server(
+            self.handle_connection, host, port, backlog=1024
+        )
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start_unix(self: Self, path: str) -> None:
+        self.server = await asyncio.start_unix_server(
+            self.handle_connection, path, backlog=1024
+        )
+
+    async def serve_forever(self: Self) -> None:
+        if self.server is None:
+            raise ValueError("server is not started.")
+        await self.server.serve_forever()
+
+    async def close(self: Self) -> None:
+        if self.server is not None:
+            self.server.close()
+            for task in list(self.connection_tasks):
+                task.cancel()
+            await asyncio.gather(
+                *self.connection_tasks, return_exceptions=True
+            )
+            await self.server.wait_closed()
+            self.server = None
+
+    # Connection methods
+    async def handle_connection(
+        self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.connection_tasks.add(task)
+        responses: RESPONSE_QUEUE_TYPE = asyncio.Queue(MAX_PIPELINE)
+        write_task = asyncio.create_task(
+            self.write_responses(writer, responses)
+        )
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await read_request(reader)
+                except HttpError as error:
+                    # The rest of the stream can't be trusted, so the
+                    # connection is closed after the error
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_result(
+                        (error.get_status(), {"error": str(error)})
+                    )
+                    await responses.put((future, False))
+                    break
+                if request is None:
+                    break
+                keep_alive = request.keep_alive
+                await responses.put((self.submit(request), keep_alive))
+            await responses.put(None)
+            await write_task
+        except (ConnectionError, asyncio.CancelledError):
+            write_task.cancel()
+        finally:
+            writer.close()
+            if task is not None:
+                self.connection_tasks.discard(task)
+
+    async def write_responses(
+        self: Self,
+        writer: asyncio.StreamWriter,
+        responses: RESPONSE_QUEUE_TYPE,
+    ) -> None:
+        while (response := await responses.get()) is not None:
+            future, keep_alive = response
+            status, payload = await future
+            writer.write(encode_response(status, payload, keep_alive))
+            # Pipelined responses are written together
+            if responses.empty():
+                await writer.drain()
+            if not keep_alive:
+                break
+        await writer.drain()
+
+    # Command methods
+    def submit(
+        self: Self, request: HttpRequest
+    ) -> asyncio.Future[RESPONSE_TYPE]:
+        future: asyncio.Future[RESPONSE_TYPE] = (
+            asyncio.get_running_loop().create_future()
+        )
+        try:
+            command = self.route(request, future)
+        except HttpError as error:
+            future.set_result((error.get_status(), {"error": str(error)}))
+            return future
+        if len(self.pending) == 0:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.pending.append(command)
+        return future
+
+    def route(
+        self: Self,
+        request: HttpRequest,
+        future: asyncio.Future[RESPONSE_TYPE],
+    ) -> Command:
+        parts = request.path.strip("/").split("/")
+        method = request.method
+        if parts == ["stats"]:
+            if method != "GET":
+                raise HttpError(405, "method not allowed.")
+            return Command(CommandActions.STATS, future)
+        if parts[0] != "devices" or len(parts) > 3:
+            raise HttpError(404, "not found.")
+
+        if len(parts) == 1:
+            if method == "GET":
+                return Command(CommandActions.LIST, future)
+            if method == "POST":
+                return Command(
+                    CommandActions.ADD, future, data=self.read_json(request)
+                )
+            raise HttpError(405, "method not allowed.")
+
+        if parts[1] == "bulk" and len(parts) == 2:
+            if method != "POST":
+                raise HttpError(405, "method not allowed.")
+            try:
+                changes = get_bulk_changes(self.read_json(request))
+            except ValueError as error:
+                raise HttpError(400, str(error)) from error
+            return Command(CommandActions.BULK, future, changes=changes)
+
+        try:
+            device_id = int(parts[1])
+        except ValueError as error:
+            raise HttpError(404, "not found.") from error
+        if len(parts) == 3:
+            if parts[2] != "toggle":
+                raise HttpError(404, "not found.")
+            if method != "POST":
+                raise HttpError(405, "method not allowed.")
+            return Command(CommandActions.TOGGLE, future, device_id)
+        if method == "GET":
+            return Command(CommandActions.GET, future, device_id)
+        if method == "DELETE":
+            return Command(CommandActions.REMOVE, future, device_id)
+        raise HttpError(405, "method not allowed.")
+
+    def read_json(self: Self, request: HttpRequest) -> object:
+        try:
+            return json.loads(request.body)
+        except ValueError as error:
+            raise HttpError(400, "invalid JSON body.") from error
+
+    def flush(self: Self) -> None:
+        commands = self.pending
+        self.pending = []
+        self.flush_count += 1
+        self.command_count += len(commands)
+
+        index = 0
+        while index < len(commands):
+            # The run of bulk commands from here is applied as one batch
+            end = index + 1
+            if commands[index].action is CommandActions.BULK:
+                while (
+                    end < len(commands)
+                    and commands[end].action is CommandActions.BULK
+                ):
+                    end += 1
+            try:
+                if end - index == 1:
+                    self.apply(commands[index])
+                else:
+                    self.apply_bulk(commands[index:end])
+            except Exception as error:
+                # The commands that haven't been replied to yet get an
+                # error, the rest of the queue is still applied
+                print("Error:", error)
+                for command in commands[index:end]:
+                    command.reply(500, {"error": "internal error."})
+            index = end
+
+    def apply(self: Self, command: Command) -> None:
+        home = self.home
+        try:
+            match command.action:
+                case CommandActions.LIST:
+                    command.reply(
+                        200,
+                        [
+                            device_to_json(device)
+                            for device in home.get_devices()
+                        ],
+                    )
+                case CommandActions.STATS:
+                    stats = home.get_stats()
+                    stats["devices"] = len(home.devices)
+                    command.reply(200, stats)
+                case CommandActions.ADD:
+                    device = device_from_json(command.data)
+                    home.add_device(device)
+                    command.reply(201, device_to_json(device))
+                case CommandActions.GET:
+                    command.reply(
+                        200, device_to_json(self.get_device(command))
+                    )
+                case CommandActions.REMOVE:
+                    device = self.get_device(command)
+                    home.remove_device(device.get_id())
+                    command.reply(200, device_to_json(device))
+                case CommandActions.TOGGLE:
+                    device = self.get_device(command)
+                    device.toggle_switch()
+                    command.reply(200, device_to_json(device))
+                case CommandActions.BULK:
+                    self.apply_bulk_changes(command.changes)
+                    command.reply(200, {"ok": True})
+        except HttpError as error:
+            command.reply(error.get_status(), {"error": str(error)})
+        except BatchError as error:
+            command.reply(
+                400,
+                {
+                    "error": "invalid batch.",
+                    "errors": {
+                        str(key): message
+                        for key, message in error.get_errors().items()
+                    },
+                },
+            )
+        except ValueError as error:
+            command.reply(400, {"error": str(error)})
+
+    def get_device(self: Self, command: Command) -> SmartDevice:
+        device = None
+        if command.device_id is not None:
+            device = self.home.get_device(command.device_id)
+        if device is None:
+            raise HttpError(404, "device is not in the smart home.")
+        return device
+
+    def apply_bulk_changes(self: Self, changes: BULK_CHANGES_TYPE) -> None:
+        # Every attribute is checked before any is applied
+        self.home.set_changes(
+            changes["consumption_rates"],
+            changes["cooking_modes"],
+            changes["switched_on"],
+        )
+
+    def apply_bulk(self: Self, commands: List[Command]) -> None:
+        if len(commands) == 1:
+            self.apply(commands[0])
+            return
+        # Each command is checked on its own first, so an invalid command
+        # gets its errors without changing anything
+        valid: List[Command] = []
+        for command in commands:
+            try:
+                self.home.check_changes(
+                    command.changes["consumption_rates"],
+                    command.changes["cooking_modes"],
+                    command.changes["switched_on"],
+                )
+            except ValueError:
+                self.apply(command)
+            else:
+                valid.append(command)
+        if len(valid) == 0:
+            return
+        # Later changes to a device replace earlier ones, which is the same
+        # as applying the commands in order
+        merged: BULK_CHANGES_TYPE = {
+            attribute: {} for attribute in BULK_ATTRIBUTES
+        }
+        for command in valid:
+            for attribute, values in command.changes.items():
+                merged[attribute].update(values)
+        try:
+            self.apply_bulk_changes(merged)
+        except ValueError:
+            # Every command was valid on its own, so only the power budget
+            # can have rejected the batch, and set_changes reserves the
+            # power of the whole batch before writing any of it. Nothing
+            # has been applied, so the commands are applied one at a time
+            # instead, each exactly once
+            for command in valid:
+                self.apply(command)
+            return
+        for command in valid:
+            command.reply(200, {"ok": True})
+
+
+async def run_server(
+    home: SmartHome, host: str, port: int, unix_path: str | None
+) -> None:
+    server = SmartHomeServer(home)
+    if unix_path is not None:
+        await server.start_unix(unix_path)
+        print(f"Serving on {unix_path}")
+    else:
+        port = await server.start(host, port)
+        print(f"Serving on http://{host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve a smart home over HTTP/JSON."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--unix", metavar="PATH", help="serve on a Unix socket instead"
+    )
+    parser.add_argument(
+        "--csv", metavar="FILE", help="load the devices from a CSV file"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="keep the device state in a columnar store",
+    )
+    args = parser.parse_args()
+
+    home = SmartHome(args.columnar)
+    if args.csv is not None:
+        home.add_devices(
+            SmartDeviceFile([]).read_smart_devices(
+                args.csv, row_error=lambda error: print("Error:", error)
+            )
+        )
+    try:
+        asyncio.run(run_server(home, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
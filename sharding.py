@@ -0,0 +1,206 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Self
+
+from backend import SmartAirFryer, SmartDevice, SmartHome, SmartPlug
+from simulation import HOUR_SECONDS
+
+# One in this many devices of a home is an air fryer, the rest are plugs
+AIR_FRYER_RATIO = 10
+
+# (total consumption at the start, total consumption at the end, switched
+# on devices) of one step of a shard, only ints so the sums are exact
+AGGREGATE_TYPE = tuple[int, int, int]
+
+
+class StepAggregate:
+    __slots__ = ("energy", "step", "switched_on_count", "total_consumption")
+
+    def __init__(
+        self: Self,
+        step: int,
+        total_consumption: int,
+        switched_on_count: int,
+        energy: float,
+    ) -> None:
+        self.step: int = step
+        # Of every home at the end of the step, in watts
+        self.total_consumption: int = total_consumption
+        self.switched_on_count: int = switched_on_count
+        # Used by every home during the step, in watt hours
+        self.energy: float = energy
+
+    def __str__(self: Self) -> str:
+        output = f"Step {self.step}: {self.total_consumption}W, "
+        output += f"{self.switched_on_count} on, {self.energy:.1f}Wh"
+        return output
+
+    def get_step(self: Self) -> int:
+        return self.step
+
+    def get_total_consumption(self: Self) -> int:
+        return self.total_consumption
+
+    def get_switched_on_count(self: Self) -> int:
+        return self.switched_on_count
+
+    def get_energy(self: Self) -> float:
+        return self.energy
+
+
+class Shard:
+    # Each home has a random generator seeded by its id, so it changes the same
+    # way whichever shard it is in
+    def __init__(
+        self: Self,
+        home_ids: List[int],
+        devices_per_home: int,
+        seed: int,
+        change_fraction: float,
+    ) -> None:
+        self.change_fraction: float = change_fraction
+        self.homes: List[SmartHome] = []
+        self.devices: List[List[SmartDevice]] = []
+        self.generators: List[random.Random] = []
+        for home_id in home_ids:
+            generator = random.Random(f"{seed}-{home_id}")
+            devices: List[SmartDevice] = [
+                SmartAirFryer()
+                if index % AIR_FRYER_RATIO == 0
+                else SmartPlug(generator.randint(0, 150))
+                for index in range(devices_per_home)
+            ]
+            home = SmartHome(columnar=True)
+            home.add_devices(devices)
+            self.homes.append(home)
+            self.devices.append(devices)
+            self.generators.append(generator)
+
+    def get_device_count(self: Self) -> int:
+        return sum(len(devices) for devices in self.devices)
+
+    def step(self: Self) -> AGGREGATE_TYPE:
+        # Changes a fraction of the devices of every home, a change being a
+        # switch or a new consumption rate
+        start_consumption = 0
+        total_consumption = 0
+        switched_on_count = 0
+        for home, devices, generator in zip(
+            self.homes, self.devices, self.generators, strict=True
+        ):
+            start_consumption += home.get_total_consumption()
+            for _ in range(round(len(devices) * self.change_fraction)):
+                device = generator.choice(devices)
+                if isinstance(device, SmartPlug) and generator.random() < 0.5:
+                    device.set_consumption_rate(generator.randint(0, 150))
+                else:
+                    device.toggle_switch()
+            total_consumption += home.get_total_consumption()
+            switched_on_count += home.get_switched_on_count()
+        return start_consumption, total_consumption, switched_on_count
+
+
+# The shard of a worker process, each worker has one shard for its life
+shard: Shard | None = None
+
+
+def start_shard(
+    home_ids: List[int],
+    devices_per_home: int,
+    seed: int,
+    change_fraction: float,
+) -> int:
+    # Runs in the worker, returns how many devices the shard has
+    global shard
+    shard = Shard(home_ids, devices_per_home, seed, change_fraction)
+    return shard.get_device_count()
+
+
+def run_shard(steps: int) -> List[AGGREGATE_TYPE]:
+    # Runs in the worker, only the aggregates are sent back
+    if shard is None:
+        raise ValueError("shard is not started.")
+    return [shard.step() for _ in range(steps)]
+
+
+class ShardedSimulation:
+    # Each shard has a one worker ProcessPoolExecutor, so its homes stay in
+    # that process and only the aggregates of each step cross to the
+    # coordinator
+    def __init__(
+        self: Self,
+        home_count: int,
+        devices_per_home: int,
+        shard_count: int,
+        seed: int = 0,
+        change_fraction: float = 0.1,
+        step_seconds: float = 60.0,
+    ) -> None:
+        if home_count <= 0:
+            raise ValueError("invalid home count (> 0).")
+        if shard_count <= 0:
+            raise ValueError("invalid shard count (> 0).")
+        if change_fraction < 0 or change_fraction > 1:
+            raise ValueError("invalid change fraction (>= 0 and <= 1).")
+        shard_count = min(shard_count, home_count)
+        self.step_seconds: float = step_seconds
+        self.step_count: int = 0
+        self.executors: List[ProcessPoolExecutor] = [
+            ProcessPoolExecutor(max_workers=1) for _ in range(shard_count)
+        ]
+        # The shards are built at the same time, each in its own process
+        futures = [
+            executor.submit(
+                start_shard,
+                list(range(index, home_count, shard_count)),
+                devices_per_home,
+                seed,
+                change_fraction,
+            )
+            for index, executor in enumerate(self.executors)
+        ]
+        self.device_count: int = sum(future.result() for future in futures)
+
+    def close(self: Self) -> None:
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+        self.executors = []
+
+    def get_shard_count(self: Self) -> int:
+        return len(self.executors)
+
+    def get_device_count(self: Self) -> int:
+        return self.device_count
+
+    def get_step_count(self: Self) -> int:
+        return self.step_count
+
+    def run(self: Self, steps: int) -> List[StepAggregate]:
+        # Each shard runs every step in one call, and returns one
+        # aggregate per step
+        if steps <= 0:
+            raise ValueError("invalid steps (> 0).")
+        futures = [
+            executor.submit(run_shard, steps) for executor in self.executors
+        ]
+        shard_aggregates = [future.result() for future in futures]
+
+        step_aggregates: List[StepAggregate] = []
+        for step_shard_aggregates in zip(*shard_aggregates, strict=True):
+            start_consumption, total_consumption, switched_on_count = map(
+                sum, zip(*step_shard_aggregates, strict=True)
+            )
+            self.step_count += 1
+            # The energy of a step is at the consumption from its start
+            step_aggregates.append(
+                StepAggregate(
+                    self.step_count,
+                    total_consumption,
+                    switched_on_count,
+                    start_consumption * self.step_seconds / HOUR_SECONDS,
+                )
+            )
+        return step_aggregates
+
+    def step(self: Self) -> StepAggregate:
+        return self.run(1)[0]
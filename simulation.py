@@ -0,0 +1,157 @@
+import heapq
+from itertools import count
+from typing import Callable, Dict, Iterable, List, Self
+
+from backend import (
+    DeviceEvent,
+    DeviceEventTypes,
+    SmartDevice,
+    SmartHome,
+    SmartPlug,
+)
+from scheduler import Scheduler
+
+HOUR_SECONDS = 60 * 60
+
+SIMULATION_ACTION_TYPE = Callable[[SmartHome], None]
+
+
+def get_power(device: SmartDevice) -> int:
+    # Only switched on smart plugs have a consumption rate
+    if isinstance(device, SmartPlug) and device.get_switched_on() is True:
+        return device.get_consumption_rate()
+    return 0
+
+
+class Simulation:
+    # Time jumps from one event to the next, and the energy of a device is only
+    # brought up to date when its power changes or is asked for
+    def __init__(self: Self, home: SmartHome, start: float = 0.0) -> None:
+        self.home: SmartHome = home
+        self.time: float = start
+        self.scheduler: Scheduler = Scheduler(home, self.get_time)
+
+        # Scripted events, (time, order added, action)
+        self.script: List[tuple[float, int, SIMULATION_ACTION_TYPE]] = []
+        self.script_order = count()
+
+        # The power of each device since its last time, and the energy it
+        # used before then, kept after a device is removed
+        self.powers: Dict[int, int] = {}
+        self.last_times: Dict[int, float] = {}
+        self.energies: Dict[int, float] = {}
+        for device in home.get_devices():
+            self.start_device(device)
+
+        home.subscribe(self.handle_device_event)
+
+    def close(self: Self) -> None:
+        self.home.unsubscribe(self.handle_device_event)
+
+    def get_time(self: Self) -> float:
+        return self.time
+
+    def get_home(self: Self) -> SmartHome:
+        return self.home
+
+    def get_scheduler(self: Self) -> Scheduler:
+        return self.scheduler
+
+    # Energy methods
+    def start_device(self: Self, device: SmartDevice) -> None:
+        device_id = device.get_id()
+        self.powers[device_id] = get_power(device)
+        self.last_times[device_id] = self.time
+        self.energies.setdefault(device_id, 0.0)
+
+    def update_energy(self: Self, device_id: int) -> None:
+        power = self.powers.get(device_id)
+        if power is None:
+            return
+        last_time = self.last_times[device_id]
+        if power != 0:
+            self.energies[device_id] += (
+                power * (self.time - last_time) / HOUR_SECONDS
+            )
+        self.last_times[device_id] = self.time
+
+    def handle_device_event(self: Self, event: DeviceEvent) -> None:
+        device = event.get_device()
+        device_id = device.get_id()
+        match event.get_event_type():
+            case DeviceEventTypes.ADDED:
+                self.start_device(device)
+            case DeviceEventTypes.REMOVED:
+                self.update_energy(device_id)
+                del self.powers[device_id]
+                del self.last_times[device_id]
+            case DeviceEventTypes.SWITCHED | DeviceEventTypes.RATE_CHANGED:
+                # The event comes after the change, so the energy up to now
+                # is at the old power
+                self.update_energy(device_id)
+                self.powers[device_id] = get_power(device)
+
+    def get_energy(self: Self, device_id: int) -> float:
+        if device_id not in self.energies:
+            raise ValueError("invalid device id.")
+        self.update_energy(device_id)
+        return self.energies[device_id]
+
+    def get_energies(self: Self) -> Dict[int, float]:
+        for device_id in self.powers:
+            self.update_energy(device_id)
+        return dict(self.energies)
+
+    def get_total_energy(self: Self) -> float:
+        return sum(self.get_energies().values())
+
+    # Event methods
+    def add_event(
+        self: Self, at: float, action: SIMULATION_ACTION_TYPE
+    ) -> None:
+        if at < self.time:
+            raise ValueError("invalid event time (in the past).")
+        heapq.heappush(self.script, (at, next(self.script_order), action))
+
+    def add_events(
+        self: Self, events: Iterable[tuple[float, SIMULATION_ACTION_TYPE]]
+    ) -> None:
+        for at, action in events:
+            self.add_event(at, action)
+
+    def get_next_time(self: Self) -> float | None:
+        next_time = self.scheduler.get_next_time()
+        if len(self.script) > 0 and (
+            next_time is None or self.script[0][0] < next_time
+        ):
+            next_time = self.script[0][0]
+        return next_time
+
+    def run_until(self: Self, end: float) -> int:
+        # Runs every event up to end, in time order, then moves the clock
+        # to end and returns how many events were run
+        if end < self.time:
+            raise ValueError("invalid end time (in the past).")
+        event_count = 0
+        while True:
+            next_time = self.get_next_time()
+            if next_time is None or next_time > end:
+                break
+            self.time = next_time
+            event_count += self.scheduler.run_pending(next_time)
+            while len(self.script) > 0 and self.script[0][0] <= next_time:
+                heapq.heappop(self.script)[2](self.home)
+                event_count += 1
+        self.time = end
+        return event_count
+
+    def run_for(self: Self, duration: float) -> int:
+        return self.run_until(self.time + duration)
+
+    def __str__(self: Self) -> str:
+        energies = self.get_energies()
+        output = f"Time: {self.time / HOUR_SECONDS:.2f}h\n"
+        for device_id, energy in energies.items():
+            output += f"Device {device_id}: {energy:.1f}Wh\n"
+        output += f"Total: {sum(energies.values()):.1f}Wh"
+        return output
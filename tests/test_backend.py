@@ -0,0 +1,167 @@
+import threading
+
+import pytest
+
+from backend import (
+    BatchError,
+    CookingModes,
+    DeviceEvent,
+    DeviceEventTypes,
+    SmartAirFryer,
+    SmartHome,
+    SmartPlug,
+)
+
+
+@pytest.fixture(params=[False, True], ids=["dict", "columnar"])
+def smart_home(request: pytest.FixtureRequest) -> SmartHome:
+    return SmartHome(request.param)
+
+
+def test_stats_and_indexes(smart_home: SmartHome) -> None:
+    smart_plugs = [SmartPlug(rate) for rate in (10, 20, 30)]
+    smart_air_fryer = SmartAirFryer()
+    smart_home.add_devices([*smart_plugs, smart_air_fryer])
+
+    smart_plugs[0].toggle_switch()
+    smart_plugs[1].toggle_switch()
+    smart_plugs[1].set_consumption_rate(25)
+    smart_air_fryer.toggle_switch()
+    smart_air_fryer.set_cooking_mode(CookingModes.CRISPY.value)
+    assert smart_home.get_total_consumption() == 35
+    assert smart_home.get_switched_on_count() == 3
+    assert smart_home.get_stats() == smart_home.calculate_stats()
+
+    assert set(smart_home.query(SmartPlug, switched_on=True)) == {
+        smart_plugs[0],
+        smart_plugs[1],
+    }
+    assert smart_home.query(cooking_mode=CookingModes.CRISPY.value) == [
+        smart_air_fryer
+    ]
+
+    smart_home.remove_device(smart_plugs[0].get_id())
+    smart_home.turn_on_all()
+    assert smart_home.get_total_consumption() == 55
+    smart_home.turn_off_all()
+    assert smart_home.get_total_consumption() == 0
+    assert smart_home.query(switched_on=True) == []
+    assert smart_home.check_stats()
+    assert smart_home.check_indexes()
+
+
+def test_batch_error_changes_nothing(smart_home: SmartHome) -> None:
+    smart_plug = SmartPlug(10)
+    smart_air_fryer = SmartAirFryer()
+    smart_home.add_devices([smart_plug, smart_air_fryer])
+
+    with pytest.raises(BatchError) as error:
+        smart_home.add_devices([SmartPlug(20), smart_plug])
+    assert list(error.value.get_errors()) == [1]
+    assert len(smart_home.get_devices()) == 2
+
+    with pytest.raises(BatchError) as error:
+        smart_home.set_changes(
+            {smart_plug.get_id(): 50},
+            {smart_air_fryer.get_id(): "invalid"},
+            {smart_plug.get_id(): True},
+        )
+    assert list(error.value.get_errors()) == [smart_air_fryer.get_id()]
+    assert smart_plug.get_consumption_rate() == 10
+    assert not smart_plug.get_switched_on()
+    assert smart_home.check_stats()
+    assert smart_home.check_indexes()
+
+
+def test_snapshot_is_stable(smart_home: SmartHome) -> None:
+    smart_plugs = [SmartPlug(10), SmartPlug(20)]
+    smart_home.add_devices(smart_plugs)
+    smart_plugs[0].toggle_switch()
+    snapshot = smart_home.snapshot()
+
+    smart_plugs[0].set_consumption_rate(100)
+    smart_plugs[1].toggle_switch()
+    smart_home.remove_device(smart_plugs[0].get_id())
+    smart_home.add_device(SmartAirFryer())
+
+    assert len(snapshot) == 2
+    assert snapshot.get_total_consumption() == 10
+    assert snapshot.get_switched_on_count() == 1
+    diff = snapshot.diff(smart_home.snapshot())
+    assert diff["removed"] == [smart_plugs[0].get_id()]
+    assert diff["changed"] == [smart_plugs[1].get_id()]
+    assert len(diff["added"]) == 1
+
+
+def test_changes_within_power_budget(smart_home: SmartHome) -> None:
+    first, second, third = SmartPlug(100), SmartPlug(50), SmartPlug(10)
+    smart_home.add_devices([first, second, third])
+    smart_home.turn_on_all()
+    smart_home.set_power_budget(160)
+
+    # Switching first off frees the power second needs, whatever order
+    # the changes are written in
+    smart_home.set_changes(
+        {third.get_id(): 0, second.get_id(): 150}, {}, {first.get_id(): False}
+    )
+    assert not first.get_switched_on()
+    assert second.get_consumption_rate() == 150
+    assert third.get_consumption_rate() == 0
+    assert smart_home.get_total_consumption() == 150
+
+    # Nothing is changed when the batch doesn't fit
+    with pytest.raises(ValueError, match="power budget"):
+        smart_home.set_changes(
+            {third.get_id(): 10}, {}, {first.get_id(): True}
+        )
+    assert not first.get_switched_on()
+    assert third.get_consumption_rate() == 0
+    assert smart_home.get_total_consumption() == 150
+    assert smart_home.check_stats()
+    assert smart_home.check_indexes()
+
+
+def test_shed_listeners_run_without_locks(smart_home: SmartHome) -> None:
+    first, second = SmartPlug(100), SmartPlug(50)
+    smart_home.add_devices([first, second])
+    smart_home.turn_on_all()
+    smart_home.set_power_budget(150)
+    events = []
+
+    def power_lock_free() -> bool:
+        # The lock is reentrant, so it is tried from another thread
+        results = []
+
+        def acquire() -> None:
+            results.append(smart_home.power_lock.acquire(blocking=False))
+            if results[0]:
+                smart_home.power_lock.release()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def listener(event: DeviceEvent) -> None:
+        events.append((event.event_type, event.device, power_lock_free()))
+        if event.device is first:
+            # Changing the membership from a cascade takes the locks in
+            # the usual order
+            smart_home.remove_device(first.get_id())
+
+    third = SmartPlug(20)
+    smart_home.add_device(third)
+    smart_home.set_device_priority(third.get_id(), 1)
+    smart_home.subscribe(listener)
+    third.toggle_switch()
+
+    # The shed device is told about before the device that shed it
+    assert events[0] == (DeviceEventTypes.SWITCHED, first, True)
+    assert events[-1] == (DeviceEventTypes.SWITCHED, third, True)
+    assert [device.get_id() for device in smart_home.get_devices()] == [
+        second.get_id(),
+        third.get_id(),
+    ]
+    assert smart_home.get_total_consumption() == 70
+    assert smart_home.check_stats()
+    assert smart_home.check_indexes()
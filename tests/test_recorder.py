@@ -0,0 +1,65 @@
+from backend import SmartHome, SmartPlug
+from recorder import Recorder, Resolutions
+
+
+def test_removed_history_is_reused() -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(100)
+    smart_home.add_device(smart_plug)
+    recorder = Recorder(smart_home, {Resolutions.RAW: 10})
+    for sample_time in range(5):
+        recorder.sample(sample_time)
+    history = recorder.get_history(smart_plug.get_id())
+    assert history is not None
+
+    smart_home.remove_device(smart_plug.get_id())
+    assert recorder.get_device_ids() == []
+
+    # The new device gets the buffers of the removed one, emptied
+    new_smart_plug = SmartPlug(50)
+    smart_home.add_device(new_smart_plug)
+    recorder.sample(5)
+    assert recorder.get_history(new_smart_plug.get_id()) is history
+    times, _, consumption_rates = recorder.get_range(
+        new_smart_plug.get_id(), 0, 10
+    )
+    assert list(times) == [5.0]
+    assert list(consumption_rates) == [50]
+    recorder.close()
+
+
+def test_added_device_shares_times() -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(100)
+    smart_home.add_device(smart_plug)
+    recorder = Recorder(
+        smart_home, {Resolutions.RAW: 10, Resolutions.MINUTE: 10}
+    )
+    for sample_time in range(0, 120, 10):
+        recorder.sample(sample_time)
+
+    # Only the samples taken since the device was added are its own
+    new_smart_plug = SmartPlug(50)
+    smart_home.add_device(new_smart_plug)
+    for sample_time in range(120, 180, 10):
+        recorder.sample(sample_time)
+    recorder.flush()
+
+    times, _, consumption_rates = recorder.get_range(
+        new_smart_plug.get_id(), 0, 1_000
+    )
+    assert list(times) == list(range(120, 180, 10))
+    assert list(consumption_rates) == [50] * 6
+    times, _, _ = recorder.get_range(smart_plug.get_id(), 0, 1_000)
+    assert list(times) == list(range(80, 180, 10))
+
+    times, _, consumption_rates = recorder.get_range(
+        new_smart_plug.get_id(), 0, 1_000, Resolutions.MINUTE
+    )
+    assert list(times) == [120]
+    assert list(consumption_rates) == [50]
+    times, _, _ = recorder.get_range(
+        smart_plug.get_id(), 0, 1_000, Resolutions.MINUTE
+    )
+    assert list(times) == [0, 60, 120]
+    recorder.close()
@@ -0,0 +1,63 @@
+import time
+from typing import List
+
+import pytest
+
+from backend import BatchError, SmartAirFryer, SmartHome, SmartPlug
+from replication import ReplicationFollower, ReplicationPrimary
+
+
+def test_duplicate_device_id() -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(10)
+    smart_home.add_device(smart_plug)
+    duplicate = SmartPlug(20)
+    duplicate.device_id = smart_plug.get_id()
+
+    with pytest.raises(ValueError, match="id is already"):
+        smart_home.add_device(duplicate)
+    with pytest.raises(BatchError):
+        smart_home.add_devices([SmartAirFryer(), duplicate])
+    assert len(smart_home.get_devices()) == 1
+    assert smart_home.check_stats()
+
+
+def pump(follower: ReplicationFollower, primary: ReplicationPrimary) -> None:
+    end = time.time() + 5
+    while follower.get_sequence() != primary.get_sequence():
+        assert time.time() < end
+        time.sleep(0.01)
+    follower.apply_pending()
+
+
+def test_follower_keeps_its_own_devices() -> None:
+    smart_home = SmartHome()
+    smart_plugs: List[SmartPlug] = [SmartPlug(10), SmartPlug(20)]
+    smart_home.add_devices(smart_plugs)
+    primary = ReplicationPrimary(smart_home)
+    port = primary.start()
+    follower_home = SmartHome()
+    local_smart_plug = SmartPlug(30)
+    follower_home.add_device(local_smart_plug)
+    follower = ReplicationFollower(follower_home, port=port)
+    follower.start()
+    try:
+        assert follower.get_connected().wait(5)
+        pump(follower, primary)
+        assert len(follower_home.get_devices()) == 3
+
+        smart_plugs[0].set_consumption_rate(99)
+        smart_home.remove_device(smart_plugs[1].get_id())
+        pump(follower, primary)
+        # Each change goes to the copy of its device, found by the id the
+        # device has on the primary
+        replica = follower.devices[smart_plugs[0].get_id()]
+        assert isinstance(replica, SmartPlug)
+        assert replica.get_consumption_rate() == 99
+        assert local_smart_plug.get_consumption_rate() == 30
+        assert len(follower_home.get_devices()) == 2
+        assert follower_home.check_stats()
+        assert follower_home.check_indexes()
+    finally:
+        follower.close()
+        primary.close()
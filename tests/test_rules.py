@@ -0,0 +1,71 @@
+from backend import CookingModes, SmartAirFryer, SmartHome, SmartPlug
+from rules import (
+    Condition,
+    RuleAttributes,
+    RulesEngine,
+    set_cooking_mode,
+    turn_off,
+    turn_on,
+)
+
+
+def test_rules_run_on_change() -> None:
+    smart_home = SmartHome()
+    smart_plugs = [SmartPlug(150) for _ in range(4)]
+    smart_air_fryer = SmartAirFryer()
+    smart_home.add_devices([*smart_plugs, smart_air_fryer])
+    rules_engine = RulesEngine(smart_home)
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.TOTAL_CONSUMPTION, ">", 400)],
+        turn_off(smart_air_fryer.get_id()),
+    )
+    rules_engine.add_rule(
+        [
+            Condition(
+                RuleAttributes.SWITCHED_ON,
+                "==",
+                True,
+                smart_plugs[0].get_id(),
+            )
+        ],
+        set_cooking_mode(smart_air_fryer.get_id(), CookingModes.DEFROST.value),
+    )
+
+    smart_air_fryer.toggle_switch()
+    smart_plugs[0].toggle_switch()
+    assert smart_air_fryer.get_cooking_mode() == CookingModes.DEFROST.value
+    smart_plugs[1].toggle_switch()
+    assert smart_air_fryer.get_switched_on()
+    smart_plugs[2].toggle_switch()
+    assert not smart_air_fryer.get_switched_on()
+    rules_engine.close()
+
+
+def test_rule_cascade_stops() -> None:
+    smart_home = SmartHome()
+    first, second = SmartPlug(1), SmartPlug(1)
+    smart_home.add_devices([first, second])
+    rules_engine = RulesEngine(smart_home)
+    first_id, second_id = first.get_id(), second.get_id()
+    # Each rule undoes the last, a rule only runs once per cascade
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.SWITCHED_ON, "==", True, first_id)],
+        turn_on(second_id),
+    )
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.SWITCHED_ON, "==", True, second_id)],
+        turn_off(first_id),
+    )
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.SWITCHED_ON, "==", False, first_id)],
+        turn_off(second_id),
+    )
+    rules_engine.add_rule(
+        [Condition(RuleAttributes.SWITCHED_ON, "==", False, second_id)],
+        turn_on(first_id),
+    )
+
+    first.toggle_switch()
+    assert any(entry.startswith("skipped") for entry in rules_engine.get_log())
+    assert smart_home.check_stats()
+    rules_engine.close()
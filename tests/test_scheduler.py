@@ -0,0 +1,70 @@
+from backend import SmartHome, SmartPlug
+from scheduler import ScheduleActions, Scheduler
+
+
+def test_recurring_schedule() -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(10)
+    smart_home.add_device(smart_plug)
+    scheduler = Scheduler(smart_home, lambda: 0.0)
+    scheduler.add_schedule(
+        smart_plug.get_id(), ScheduleActions.TOGGLE, 10.0, 10.0
+    )
+
+    assert scheduler.run_pending(5.0) == 0
+    assert scheduler.run_pending(10.0) == 1
+    assert smart_plug.get_switched_on()
+    # Every run that is due is caught up on, in order
+    assert scheduler.run_pending(30.0) == 2
+    assert smart_plug.get_switched_on()
+    assert scheduler.get_next_time() == 40.0
+
+
+def test_cancelled_and_removed_schedules() -> None:
+    smart_home = SmartHome()
+    smart_plugs = [SmartPlug(10), SmartPlug(20)]
+    smart_home.add_devices(smart_plugs)
+    scheduler = Scheduler(smart_home, lambda: 0.0)
+    cancelled_id = scheduler.add_schedule(
+        smart_plugs[0].get_id(), ScheduleActions.TURN_ON, 10.0
+    )
+    scheduler.add_schedule(
+        smart_plugs[1].get_id(), ScheduleActions.TURN_ON, 10.0, 10.0
+    )
+
+    assert scheduler.cancel_schedule(cancelled_id)
+    smart_home.remove_device(smart_plugs[1].get_id())
+    assert scheduler.run_pending(10.0) == 1
+    assert not smart_plugs[0].get_switched_on()
+    # A recurring schedule is removed once its device is
+    assert len(scheduler) == 0
+    assert scheduler.get_next_time() is None
+
+
+def test_failed_action_keeps_running() -> None:
+    smart_home = SmartHome()
+    smart_plugs = [SmartPlug(100), SmartPlug(100)]
+    smart_home.add_devices(smart_plugs)
+    smart_plugs[0].toggle_switch()
+    smart_home.set_power_budget(150)
+    scheduler = Scheduler(smart_home, lambda: 0.0)
+    over_budget_id = scheduler.add_schedule(
+        smart_plugs[1].get_id(), ScheduleActions.TURN_ON, 10.0, 10.0
+    )
+    scheduler.add_schedule(
+        smart_plugs[0].get_id(), ScheduleActions.TURN_OFF, 10.0
+    )
+
+    # The failed action is reported and the schedules after it still run
+    assert scheduler.run_pending(10.0) == 2
+    [(schedule_id, error)] = scheduler.pop_errors()
+    assert schedule_id == over_budget_id
+    assert isinstance(error, ValueError)
+    assert not smart_plugs[0].get_switched_on()
+    assert not smart_plugs[1].get_switched_on()
+
+    # The recurring schedule runs again, now within the budget
+    assert scheduler.get_next_time() == 20.0
+    assert scheduler.run_pending(20.0) == 1
+    assert smart_plugs[1].get_switched_on()
+    assert scheduler.pop_errors() == []
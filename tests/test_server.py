@@ -0,0 +1,228 @@
+import asyncio
+from typing import Iterator, List
+
+import pytest
+
+from backend import SmartAirFryer, SmartHome, SmartPlug
+from server import (
+    RESPONSE_TYPE,
+    Command,
+    CommandActions,
+    SmartHomeServer,
+    get_bulk_changes,
+)
+
+
+@pytest.fixture
+def loop() -> Iterator[asyncio.AbstractEventLoop]:
+    # The commands only need their futures, the loop is never run
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def flush_bulk(
+    server: SmartHomeServer,
+    loop: asyncio.AbstractEventLoop,
+    bodies: List[object],
+) -> List[RESPONSE_TYPE]:
+    futures: List[asyncio.Future[RESPONSE_TYPE]] = []
+    for body in bodies:
+        future: asyncio.Future[RESPONSE_TYPE] = loop.create_future()
+        server.pending.append(
+            Command(
+                CommandActions.BULK,
+                future,
+                changes=get_bulk_changes(body),
+            )
+        )
+        futures.append(future)
+    server.flush()
+    return [future.result() for future in futures]
+
+
+def test_bulk_error_changes_nothing(loop: asyncio.AbstractEventLoop) -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(10)
+    smart_home.add_device(smart_plug)
+    server = SmartHomeServer(smart_home)
+
+    [(status, _)] = flush_bulk(
+        server,
+        loop,
+        [
+            {
+                "consumption_rates": {str(smart_plug.get_id()): 99},
+                "switched_on": {"-1": True},
+            }
+        ],
+    )
+    assert status == 400
+    assert smart_plug.get_consumption_rate() == 10
+    assert smart_home.check_stats()
+
+
+def test_merged_bulk_rejects_only_invalid_commands(
+    loop: asyncio.AbstractEventLoop,
+) -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(10)
+    smart_air_fryer = SmartAirFryer()
+    smart_home.add_devices([smart_plug, smart_air_fryer])
+    server = SmartHomeServer(smart_home)
+    plug_id = str(smart_plug.get_id())
+    fryer_id = str(smart_air_fryer.get_id())
+
+    responses = flush_bulk(
+        server,
+        loop,
+        [
+            {"consumption_rates": {plug_id: 20}},
+            {
+                "consumption_rates": {plug_id: 99},
+                "cooking_modes": {fryer_id: "invalid"},
+            },
+            {"switched_on": {plug_id: True}},
+        ],
+    )
+    assert [status for status, _ in responses] == [200, 400, 200]
+    assert smart_plug.get_consumption_rate() == 20
+    assert smart_plug.get_switched_on()
+    assert smart_air_fryer.get_cooking_mode() == "Healthy"
+    assert smart_home.check_stats()
+
+
+def test_bulk_over_power_budget(loop: asyncio.AbstractEventLoop) -> None:
+    smart_home = SmartHome()
+    smart_plugs = [SmartPlug(100), SmartPlug(100)]
+    smart_home.add_devices(smart_plugs)
+    smart_home.set_power_budget(150)
+    server = SmartHomeServer(smart_home)
+    first_id, second_id = (
+        str(smart_plug.get_id()) for smart_plug in smart_plugs
+    )
+
+    # Both fit on their own but not together, the merged batch is rejected
+    # and the commands are applied one at a time, each only once
+    responses = flush_bulk(
+        server,
+        loop,
+        [
+            {"switched_on": {first_id: True}},
+            {"switched_on": {second_id: True}},
+        ],
+    )
+    assert [status for status, _ in responses] == [200, 400]
+    assert smart_plugs[0].get_switched_on()
+    assert not smart_plugs[1].get_switched_on()
+    assert smart_home.check_stats()
+
+
+def test_stats(loop: asyncio.AbstractEventLoop) -> None:
+    smart_home = SmartHome()
+    smart_home.add_devices([SmartPlug(10), SmartAirFryer()])
+    server = SmartHomeServer(smart_home)
+    future: asyncio.Future[RESPONSE_TYPE] = loop.create_future()
+    server.pending.append(Command(CommandActions.STATS, future))
+    server.flush()
+    status, stats = future.result()
+    assert status == 200
+    assert isinstance(stats, dict)
+    assert stats["devices"] == 2
+
+
+def test_invalid_cooking_mode(loop: asyncio.AbstractEventLoop) -> None:
+    smart_home = SmartHome()
+    smart_air_fryer = SmartAirFryer()
+    smart_home.add_device(smart_air_fryer)
+    server = SmartHomeServer(smart_home)
+    add_future: asyncio.Future[RESPONSE_TYPE] = loop.create_future()
+    server.pending.append(
+        Command(
+            CommandActions.ADD,
+            add_future,
+            data={"type": "smart_air_fryer", "cooking_mode": [1]},
+        )
+    )
+
+    [(status, _)] = flush_bulk(
+        server,
+        loop,
+        [{"cooking_modes": {str(smart_air_fryer.get_id()): [1]}}],
+    )
+    assert status == 400
+    assert add_future.result()[0] == 400
+    assert len(smart_home.get_devices()) == 1
+
+
+def test_unexpected_error_is_replied_to(
+    loop: asyncio.AbstractEventLoop, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    smart_home = SmartHome()
+    server = SmartHomeServer(smart_home)
+
+    def fail() -> None:
+        raise RuntimeError("failed")
+
+    monkeypatch.setattr(smart_home, "get_stats", fail)
+    futures: List[asyncio.Future[RESPONSE_TYPE]] = []
+    for action in (CommandActions.STATS, CommandActions.LIST):
+        future: asyncio.Future[RESPONSE_TYPE] = loop.create_future()
+        server.pending.append(Command(action, future))
+        futures.append(future)
+    server.flush()
+    # The commands after the one that failed are still applied
+    assert [future.result()[0] for future in futures] == [500, 200]
+
+
+def test_rejected_merged_bulk_is_applied_once(
+    loop: asyncio.AbstractEventLoop,
+) -> None:
+    smart_home = SmartHome()
+    first, second = SmartPlug(100), SmartPlug(50)
+    smart_home.add_devices([first, second])
+    smart_home.turn_on_all()
+    smart_home.set_power_budget(160)
+    server = SmartHomeServer(smart_home)
+    first_id, second_id = str(first.get_id()), str(second.get_id())
+
+    # Merged, the batch doesn't fit, so none of it is written and each
+    # command is applied on its own, in order
+    responses = flush_bulk(
+        server,
+        loop,
+        [
+            {"consumption_rates": {first_id: 90}},
+            {"consumption_rates": {second_id: 150}},
+        ],
+    )
+    assert [status for status, _ in responses] == [200, 400]
+    assert first.get_consumption_rate() == 90
+    assert second.get_consumption_rate() == 50
+    assert first.get_switched_on() and second.get_switched_on()
+    assert smart_home.check_stats()
+
+
+def test_bool_consumption_rate(loop: asyncio.AbstractEventLoop) -> None:
+    smart_home = SmartHome()
+    smart_plug = SmartPlug(10)
+    smart_home.add_device(smart_plug)
+    server = SmartHomeServer(smart_home)
+    add_future: asyncio.Future[RESPONSE_TYPE] = loop.create_future()
+    server.pending.append(
+        Command(
+            CommandActions.ADD,
+            add_future,
+            data={"type": "smart_plug", "consumption_rate": True},
+        )
+    )
+
+    [(status, _)] = flush_bulk(
+        server,
+        loop,
+        [{"consumption_rates": {str(smart_plug.get_id()): True}}],
+    )
+    assert status == 400
+    assert add_future.result()[0] == 400
+    assert smart_plug.get_consumption_rate() == 10
+    assert len(smart_home.get_devices()) == 1
@@ -0,0 +1,72 @@
+import random
+import sys
+import threading
+from typing import Iterator, List
+
+import pytest
+
+from backend import SmartAirFryer, SmartDevice, SmartHome, SmartPlug
+
+
+@pytest.fixture(autouse=True)
+def switch_often() -> Iterator[None]:
+    # Threads switch far more often than usual, so that races show up
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(switch_interval)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_query_while_adding_and_removing(columnar: bool) -> None:
+    smart_home = SmartHome(columnar)
+    smart_devices: List[SmartDevice] = [
+        SmartPlug(index % 151) if index % 2 else SmartAirFryer()
+        for index in range(200)
+    ]
+    smart_home.add_devices(smart_devices)
+    errors: List[Exception] = []
+    stopped = threading.Event()
+
+    def write(seed: int) -> None:
+        generator = random.Random(seed)
+        try:
+            for _ in range(2000):
+                smart_device = generator.choice(smart_devices)
+                if smart_device.home is None:
+                    try:
+                        smart_home.add_device(smart_device)
+                    except ValueError:
+                        # Added by another thread meanwhile
+                        pass
+                elif generator.random() < 0.5:
+                    smart_home.remove_device(smart_device.get_id())
+                else:
+                    smart_device.toggle_switch()
+        except Exception as error:
+            errors.append(error)
+
+    def read() -> None:
+        try:
+            while not stopped.is_set():
+                smart_home.query(SmartAirFryer, True, "Healthy")
+                smart_home.query(SmartPlug, switched_on=False)
+                smart_home.get_stats()
+        except Exception as error:
+            errors.append(error)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    writers = [
+        threading.Thread(target=write, args=(seed,)) for seed in range(6)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    stopped.set()
+    reader.join()
+
+    assert errors == []
+    assert smart_home.check_stats()
+    assert smart_home.check_indexes()